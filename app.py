@@ -1,9 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_request_context,
+    render_template,
+    request,
+    redirect,
+    url_for,
+)
 from flask_cors import CORS
 from models import db
+from db_pool import engine_options
 from routes import api_bp
+from llm_service import LLMServiceExtension
 from config import Config
+from migrate_db import run_migrations
+from metrics import DB_QUERIES, HTTP_REQUEST_SECONDS, render as render_metrics
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import logging
+import sqlite3
+import time
 
 # 配置日志
 logging.basicConfig(
@@ -12,6 +29,24 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """按接口统计SQL语句数"""
+    endpoint = "background"
+    if has_request_context():
+        endpoint = request.endpoint or "unknown"
+    DB_QUERIES.inc(endpoint=endpoint)
+
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite默认不检查外键，开启后删除会话时才会级联删除其消息"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
 def create_app():
     """创建Flask应用"""
     app = Flask(__name__)
@@ -22,9 +57,17 @@ def create_app():
     # 启用CORS
     CORS(app)
 
-    # 初始化数据库
+    # 初始化数据库，服务端数据库使用限定大小的连接池
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
     db.init_app(app)
 
+    # 注册大模型服务，每个进程第一次调用大模型时才创建
+    LLMServiceExtension(app)
+    if not Config.DEEPSEEK_API_KEY:
+        logger.warning("DEEPSEEK_API_KEY 环境变量未设置，聊天接口将不可用")
+
     # 注册蓝图
     app.register_blueprint(api_bp)
 
@@ -44,6 +87,28 @@ def create_app():
     def health():
         return {"status": "healthy", "message": "AI聊天助手运行正常"}
 
+    # Prometheus格式的运行指标
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    # 记录每个请求的处理耗时
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        started = g.get("request_started")
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                endpoint=request.endpoint or "unknown",
+                status=response.status_code,
+            )
+        return response
+
     # 错误处理
     @app.errorhandler(404)
     def not_found(error):
@@ -62,6 +127,7 @@ def init_database():
     try:
         with app.app_context():
             db.create_all()
+            run_migrations()
             logger.info("数据库初始化成功")
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}")
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+冷会话的消息归档与恢复
+
+超过 ARCHIVE_AFTER_DAYS 天没有更新的会话，其消息写入 MESSAGE_ARCHIVE_DIR 下的
+gzip压缩NDJSON文件（<会话ID>.ndjson.gz，格式与 ndjson_io.py 的导出文件相同），
+然后从messages表删除，会话记录 messages_archived_at。会话本身和统计字段保留，
+仍然出现在会话列表中；打开会话或继续发送消息时，消息从文件恢复回数据库。
+
+归档任务同时维护PostgreSQL的消息分区（见 partitions.py）：提前创建之后几个月的
+分区，并删除归档后已经变空的旧分区，消息表的大小随活跃数据而不是历史总量增长。
+已归档会话的消息不参与全文检索，恢复后重新可以检索。
+
+命令行用法（建议每天由cron执行一次）:
+    python archive.py run --days 90
+    python archive.py restore 42
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from models import db, Conversation, Message, refresh_conversation_stats
+from ndjson_io import EXPORT_FORMAT_VERSION, MESSAGE_EXPORT_FIELDS, parse_record
+from partitions import drop_empty_partitions, ensure_partitions
+from serializers import dumps
+from metrics import MESSAGE_ARCHIVE_CONVERSATIONS, MESSAGE_ARCHIVE_MESSAGES
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 按ID删除或恢复消息时每条语句处理的条数
+_CHUNK_SIZE = 500
+
+
+def archive_path(conversation_id):
+    """返回会话归档文件的路径"""
+    return os.path.join(Config.MESSAGE_ARCHIVE_DIR, f"{conversation_id}.ndjson.gz")
+
+
+def _write_archive(path, messages):
+    """先写入临时文件并落盘，再原子地替换，数据库提交前文件已经完整"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(
+                dumps(
+                    {
+                        "type": "meta",
+                        "version": EXPORT_FORMAT_VERSION,
+                        "exported_at": datetime.utcnow(),
+                    }
+                )
+                + b"\n"
+            )
+            for message in messages:
+                f.write(dumps({"type": "message", **message}) + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temporary, path)
+
+
+def read_archive(conversation_id):
+    """
+    读取会话的归档消息
+
+    Returns:
+        list: 消息字典（字段同 MESSAGE_EXPORT_FIELDS），按时间顺序排列
+
+    Raises:
+        FileNotFoundError: 归档文件不存在
+        ValueError: 文件格式不正确
+    """
+    messages = []
+    with gzip.open(archive_path(conversation_id), "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") == "meta":
+                if record.get("version") != EXPORT_FORMAT_VERSION:
+                    raise ValueError(f"不支持的归档格式版本: {record.get('version')}")
+            elif record.get("type") == "message":
+                messages.append(parse_record(record, MESSAGE_EXPORT_FIELDS))
+    return messages
+
+
+def archive_conversation(conversation_id, cutoff):
+    """
+    把一个会话的消息写入归档文件并从数据库删除
+
+    文件写入后才在同一个事务中标记会话、删除消息。标记时再次检查会话的更新时间，
+    期间有新消息写入（会话的 updated_at 随之更新）时放弃本次归档。
+
+    Args:
+        conversation_id (int): 会话ID
+        cutoff (datetime): 会话的更新时间早于该时间才归档
+
+    Returns:
+        int: 归档的消息数，会话已不满足条件时为0
+    """
+    rows = db.session.execute(
+        select(*[getattr(Message, name) for name in MESSAGE_EXPORT_FIELDS])
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at, Message.id)
+    ).all()
+    if not rows:
+        return 0
+    messages = [dict(zip(MESSAGE_EXPORT_FIELDS, row)) for row in rows]
+
+    path = archive_path(conversation_id)
+    _write_archive(path, messages)
+
+    conversations = Conversation.__table__
+    try:
+        claimed = db.session.execute(
+            conversations.update()
+            .where(
+                conversations.c.id == conversation_id,
+                conversations.c.messages_archived_at.is_(None),
+                conversations.c.updated_at < cutoff,
+            )
+            .values(
+                messages_archived_at=datetime.utcnow(),
+                # 显式保留 updated_at，归档不改变会话在列表中的顺序
+                updated_at=conversations.c.updated_at,
+            )
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            os.remove(path)
+            return 0
+
+        # 只删除已写入文件的消息
+        ids = [message["id"] for message in messages]
+        for start in range(0, len(ids), _CHUNK_SIZE):
+            db.session.execute(
+                delete(Message.__table__).where(
+                    Message.conversation_id == conversation_id,
+                    Message.id.in_(ids[start : start + _CHUNK_SIZE]),
+                )
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    MESSAGE_ARCHIVE_CONVERSATIONS.inc(operation="archive")
+    MESSAGE_ARCHIVE_MESSAGES.inc(len(messages), operation="archive")
+    return len(messages)
+
+
+def archive_cold_conversations(days=None, now=None):
+    """
+    归档长期未更新的会话并维护消息分区，需要在应用上下文中调用
+
+    Args:
+        days (int): 超过该天数未更新的会话被归档，默认使用 ARCHIVE_AFTER_DAYS
+        now (datetime): 当前时间（UTC），默认为现在
+
+    Returns:
+        dict: 归档的会话数、消息数、失败数，以及新建和删除的分区
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(
+        days=days if days is not None else Config.ARCHIVE_AFTER_DAYS
+    )
+    stats = {"conversations": 0, "messages": 0, "failed": 0}
+
+    last_id = 0
+    while True:
+        conversation_ids = (
+            db.session.execute(
+                select(Conversation.id)
+                .where(
+                    Conversation.id > last_id,
+                    Conversation.updated_at < cutoff,
+                    Conversation.messages_archived_at.is_(None),
+                    Conversation.message_count > 0,
+                )
+                .order_by(Conversation.id)
+                .limit(Config.ARCHIVE_BATCH_SIZE)
+            )
+            .scalars()
+            .all()
+        )
+        if not conversation_ids:
+            break
+        last_id = conversation_ids[-1]
+
+        for conversation_id in conversation_ids:
+            try:
+                archived = archive_conversation(conversation_id, cutoff)
+            except Exception as e:
+                logger.error(f"归档会话 {conversation_id} 失败: {str(e)}")
+                stats["failed"] += 1
+                continue
+            if archived:
+                stats["conversations"] += 1
+                stats["messages"] += archived
+
+    stats["created_partitions"] = ensure_partitions(now=now)
+    stats["dropped_partitions"] = drop_empty_partitions(cutoff)
+    return stats
+
+
+def restore_conversation(conversation_id):
+    """
+    把已归档会话的消息从文件恢复到数据库并删除归档文件
+
+    先清除会话的归档标记（同时锁定会话行），并发打开同一会话的请求中只有一个
+    执行恢复；消息按原ID写入，已存在的消息跳过。
+
+    Returns:
+        int: 恢复的消息数，会话未归档或已被其他请求恢复时为0
+
+    Raises:
+        FileNotFoundError: 归档文件不存在
+    """
+    conversations = Conversation.__table__
+    try:
+        claimed = db.session.execute(
+            conversations.update()
+            .where(
+                conversations.c.id == conversation_id,
+                conversations.c.messages_archived_at.isnot(None),
+            )
+            .values(
+                messages_archived_at=None,
+                updated_at=conversations.c.updated_at,
+            )
+        ).rowcount
+        if not claimed:
+            return 0
+
+        messages = read_archive(conversation_id)
+        restored = 0
+        for start in range(0, len(messages), _CHUNK_SIZE):
+            restored += Message.bulk_insert(messages[start : start + _CHUNK_SIZE])
+        refresh_conversation_stats([conversation_id])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    os.remove(archive_path(conversation_id))
+    MESSAGE_ARCHIVE_CONVERSATIONS.inc(operation="restore")
+    MESSAGE_ARCHIVE_MESSAGES.inc(restored, operation="restore")
+    logger.info(f"已从归档恢复会话 {conversation_id} 的 {restored} 条消息")
+    return restored
+
+
+def remove_archives(conversation_ids):
+    """删除会话后删除其归档文件（如果有）"""
+    for conversation_id in conversation_ids:
+        try:
+            os.remove(archive_path(conversation_id))
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="冷会话的消息归档与恢复")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="归档长期未更新的会话并维护消息分区")
+    run_parser.add_argument(
+        "--days",
+        type=int,
+        help="超过该天数未更新的会话被归档，默认为 ARCHIVE_AFTER_DAYS",
+    )
+
+    restore_parser = subparsers.add_parser("restore", help="恢复指定会话的消息")
+    restore_parser.add_argument("conversation_id", type=int, help="会话ID")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        try:
+            if args.command == "run":
+                stats = archive_cold_conversations(days=args.days)
+                print(f"✅ 归档完成: {stats}")
+            else:
+                restored = restore_conversation(args.conversation_id)
+                print(f"✅ 恢复完成: {restored} 条消息")
+        except Exception as e:
+            print(f"❌ 操作失败: {e}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
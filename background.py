@@ -0,0 +1,51 @@
+"""
+后台任务执行器
+
+将不需要阻塞请求的工作（如生成会话摘要）交给进程内的线程池执行。
+线程池在第一次提交任务时创建，因此在gunicorn等预派生（fork）模型下
+每个工作进程都会拥有自己的线程池。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    """延迟创建线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=Config.BACKGROUND_WORKERS, thread_name_prefix="background"
+        )
+    return _executor
+
+
+def submit(func, *args, **kwargs):
+    """
+    在后台线程中执行任务，任务运行在当前Flask应用的上下文中
+
+    需要在应用上下文中调用。任务抛出的异常只记录日志，不会向调用方传播。
+
+    Args:
+        func: 要执行的函数
+        *args, **kwargs: 传给函数的参数
+
+    Returns:
+        Future: 任务的Future对象
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"后台任务 {func.__name__} 执行失败: {str(e)}")
+
+    return _get_executor().submit(run)
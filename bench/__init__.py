@@ -0,0 +1,5 @@
+"""
+基准测试工具
+
+在本地假大模型服务上启动应用，回放流量并统计各接口的延迟，不依赖外网。
+"""
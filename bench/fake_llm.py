@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+兼容OpenAI接口的本地假大模型服务
+
+用于基准测试和故障演练，可配置首token延迟、生成速度和错误率，支持流式和
+非流式的 /v1/chat/completions，流式请求带 stream_options.include_usage 时
+在最后返回token用量。
+
+单独启动:
+    python -m bench.fake_llm --port 18080 --latency 0.5 --tokens-per-second 50
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 回复内容按字循环取自该文本，每个字算一个token
+REPLY_TEXT = (
+    "这是基准测试使用的模拟回复，内容没有实际意义，只用于测量系统各个环节的耗时。"
+)
+
+
+class FakeLLMConfig:
+    """假大模型服务的行为配置"""
+
+    def __init__(
+        self, latency=0.3, tokens_per_second=50, error_rate=0.0, reply_tokens=60
+    ):
+        """
+        Args:
+            latency (float): 首个token前的等待秒数
+            tokens_per_second (float): 之后每秒生成的token数，0表示不限速
+            error_rate (float): 返回503错误的概率
+            reply_tokens (int): 每次回复的token数
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.reply_tokens = reply_tokens
+
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def reply_tokens_list(self):
+        return [REPLY_TEXT[i % len(REPLY_TEXT)] for i in range(self.reply_tokens)]
+
+
+def _make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            with config._lock:
+                config.requests += 1
+                failed = random.random() < config.error_rate
+                if failed:
+                    config.errors += 1
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            if failed:
+                self._send_json(503, {"error": {"message": "fake upstream overloaded"}})
+                return
+
+            time.sleep(config.latency)
+            tokens = config.reply_tokens_list()
+            prompt_tokens = sum(
+                len(str(message.get("content", "")))
+                for message in request.get("messages", [])
+            )
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            }
+            base = {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+            }
+
+            if not request.get("stream"):
+                if config.tokens_per_second:
+                    time.sleep(len(tokens) / config.tokens_per_second)
+                self._send_json(
+                    200,
+                    {
+                        **base,
+                        "object": "chat.completion",
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {
+                                    "role": "assistant",
+                                    "content": "".join(tokens),
+                                },
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    },
+                )
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(payload):
+                data = json.dumps(payload, ensure_ascii=False)
+                self._write_chunk(f"data: {data}\n\n".encode("utf-8"))
+
+            try:
+                for index, token in enumerate(tokens):
+                    if index and config.tokens_per_second:
+                        time.sleep(1 / config.tokens_per_second)
+                    event(
+                        {
+                            **base,
+                            "object": "chat.completion.chunk",
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": {"content": token},
+                                    "finish_reason": None,
+                                }
+                            ],
+                        }
+                    )
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    event(
+                        {
+                            **base,
+                            "object": "chat.completion.chunk",
+                            "choices": [],
+                            "usage": usage,
+                        }
+                    )
+                self._write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端取消了请求（例如对冲请求落败）
+                pass
+
+    return Handler
+
+
+def start_fake_llm(config, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动假大模型服务
+
+    Returns:
+        tuple: (服务器, 兼容OpenAI的base_url)
+    """
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="兼容OpenAI接口的本地假大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.3, help="首token延迟（秒）")
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=50, help="生成速度，0表示不限速"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的概率")
+    parser.add_argument(
+        "--reply-tokens", type=int, default=60, help="每次回复的token数"
+    )
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        reply_tokens=args.reply_tokens,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(config))
+    print(f"假大模型服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+基准测试
+
+启动本地假大模型服务和应用，写入种子数据后按流量文件回放请求，输出各条
+流量的RPS、延迟分位数和首token耗时，以及各接口平均每个请求执行的SQL语句数。
+全程不访问外网，可以在部署前发现性能回退。
+
+用法:
+    python -m bench.run_bench --requests 500 --concurrency 20
+    python -m bench.run_bench --server gunicorn --llm-latency 1.0 --output result.json
+    python -m bench.run_bench --database-url postgresql://... --reset-database
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from bench.fake_llm import FakeLLMConfig, start_fake_llm
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TRAFFIC = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "traffic.jsonl"
+)
+
+# 种子消息的内容，按序号循环使用
+SEED_MESSAGES = [
+    "帮我写一个Python函数，判断一个字符串是不是回文。",
+    "可以，下面是一个简单的实现，先去掉空白再比较正反顺序。",
+    "如何在PostgreSQL里给大表加索引而不锁表？",
+    "可以使用 CREATE INDEX CONCURRENTLY，它不会阻塞写入，但耗时更长。",
+    "总结一下这篇文章的要点。",
+    "文章主要讲了三点：背景、方法和结论，其中方法部分最为详细。",
+]
+
+_METRIC_LINE = re.compile(r"^(\w+)\{([^}]*)\} (\S+)$")
+_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def percentile(values, p):
+    """返回第p百分位数（最近秩法），没有数据时为None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(p / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def load_traffic(path):
+    """
+    读取流量文件，每行一个JSON对象
+
+    字段: name（名称）、method、path、body（可选）、weight（权重，默认1）。
+    path 和 body 中的 {conversation_id} 和 {seq} 会被替换为种子会话ID和请求序号。
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            for field in ("name", "method", "path"):
+                if field not in entry:
+                    raise ValueError(f"{path} 第{line_number}行缺少字段 {field}")
+            entry.setdefault("weight", 1)
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f"流量文件为空: {path}")
+    return entries
+
+
+def _substitute(value, conversation_id, seq):
+    if isinstance(value, str):
+        return value.replace("{conversation_id}", str(conversation_id)).replace(
+            "{seq}", str(seq)
+        )
+    if isinstance(value, dict):
+        return {k: _substitute(v, conversation_id, seq) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_substitute(v, conversation_id, seq) for v in value]
+    return value
+
+
+def seed_database(conversations, messages_per_conversation):
+    """清空数据库并写入种子会话和消息，返回会话ID列表"""
+    from app import create_app
+    from migrate_db import run_migrations
+    from models import db, Conversation, Message, refresh_conversation_stats
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        run_migrations()
+
+        conversation_ids = []
+        now = datetime.utcnow()
+        for start in range(0, conversations, 200):
+            batch = [
+                Conversation(
+                    title=f"基准会话 {index}",
+                    created_at=now - timedelta(minutes=index),
+                    updated_at=now - timedelta(minutes=index),
+                )
+                for index in range(start, min(start + 200, conversations))
+            ]
+            db.session.add_all(batch)
+            db.session.flush()
+
+            rows = []
+            for conversation in batch:
+                for index in range(messages_per_conversation):
+                    rows.append(
+                        {
+                            "conversation_id": conversation.id,
+                            "role": "user" if index % 2 == 0 else "assistant",
+                            "content": SEED_MESSAGES[index % len(SEED_MESSAGES)],
+                            "created_at": conversation.created_at
+                            + timedelta(seconds=index),
+                        }
+                    )
+            if rows:
+                db.session.execute(Message.__table__.insert(), rows)
+            conversation_ids.extend(conversation.id for conversation in batch)
+            db.session.commit()
+
+        refresh_conversation_stats()
+        db.session.commit()
+    return conversation_ids
+
+
+def start_server(mode, port):
+    """
+    启动被测应用
+
+    Returns:
+        callable: 停止服务的函数
+    """
+    if mode == "gunicorn":
+        env = dict(os.environ)
+        env["GUNICORN_BIND"] = f"127.0.0.1:{port}"
+        # 指标按工作进程统计，只用一个工作进程保证抓取到全部数据
+        env["GUNICORN_WORKERS"] = "1"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+            cwd=ROOT_DIR,
+            env=env,
+        )
+
+        def stop():
+            # 等待工作进程退出，期间假大模型服务仍需可用
+            process.terminate()
+            process.wait(timeout=60)
+
+        return stop
+
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    server = make_server("127.0.0.1", port, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"应用在 {timeout} 秒内没有启动: {base_url}")
+
+
+def scrape_metrics(base_url):
+    """
+    抓取 /metrics
+
+    Returns:
+        tuple: (每个接口的SQL语句数, 每个接口的请求数)
+    """
+    queries = defaultdict(float)
+    requests_count = defaultdict(float)
+    text = requests.get(f"{base_url}/metrics", timeout=10).text
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        labels = dict(_LABEL.findall(labels))
+        if name == "db_queries_total":
+            queries[labels["endpoint"]] += float(value)
+        elif name == "http_request_duration_seconds_count":
+            requests_count[labels["endpoint"]] += float(value)
+    return queries, requests_count
+
+
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def send_request(base_url, entry, conversation_id, seq):
+    """发送一个请求，返回 (名称, 是否成功, 延迟, 首token耗时)"""
+    path = _substitute(entry["path"], conversation_id, seq)
+    body = _substitute(entry.get("body"), conversation_id, seq)
+    streaming = path.rstrip("/").endswith("/stream")
+
+    started = time.perf_counter()
+    ttft = None
+    try:
+        response = _session().request(
+            entry["method"], base_url + path, json=body, stream=streaming, timeout=120
+        )
+        ok = response.status_code < 400
+        if streaming and ok:
+            for line in response.iter_lines():
+                if line.startswith(b"event: delta") and ttft is None:
+                    ttft = time.perf_counter() - started
+                elif line.startswith(b"event: error"):
+                    ok = False
+        else:
+            response.content
+    except requests.RequestException:
+        ok = False
+    return entry["name"], ok, time.perf_counter() - started, ttft
+
+
+def run_traffic(base_url, schedule, concurrency):
+    """按计划并发发送请求，返回 (结果列表, 总耗时)"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(send_request, base_url, entry, conversation_id, seq)
+            for seq, (entry, conversation_id) in enumerate(schedule)
+        ]
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, queries, requests_count):
+    """汇总各条流量的延迟统计和各接口的SQL语句数"""
+    grouped = defaultdict(list)
+    for result in results:
+        grouped[result[0]].append(result)
+
+    traffic = {}
+    for name, items in sorted(grouped.items()):
+        latencies = [latency for _, ok, latency, _ in items if ok]
+        ttfts = [ttft for _, ok, _, ttft in items if ok and ttft is not None]
+        traffic[name] = {
+            "requests": len(items),
+            "errors": sum(1 for _, ok, _, _ in items if not ok),
+            "rps": len(items) / elapsed,
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+            "ttft_p50_ms": _ms(percentile(ttfts, 50)),
+            "ttft_p95_ms": _ms(percentile(ttfts, 95)),
+        }
+
+    endpoints = {}
+    for endpoint, count in sorted(queries.items()):
+        if not count:
+            continue
+        handled = requests_count.get(endpoint, 0)
+        endpoints[endpoint] = {
+            "queries": int(count),
+            "requests": int(handled),
+            "queries_per_request": round(count / handled, 2) if handled else None,
+        }
+
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "total_requests": len(results),
+        "total_rps": round(len(results) / elapsed, 2),
+        "traffic": traffic,
+        "db_queries": endpoints,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def print_report(report):
+    print()
+    print(
+        f"共 {report['total_requests']} 个请求，耗时 {report['elapsed_seconds']} 秒，"
+        f"总RPS {report['total_rps']}"
+    )
+    print()
+    header = f"{'流量':<24}{'请求':>6}{'失败':>6}{'RPS':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'TTFT50':>9}{'TTFT95':>9}"
+    print(header)
+    print("-" * len(header))
+
+    def cell(value):
+        return "-" if value is None else value
+
+    for name, row in report["traffic"].items():
+        print(
+            f"{name:<24}{row['requests']:>6}{row['errors']:>6}{row['rps']:>8.2f}"
+            f"{cell(row['p50_ms']):>9}{cell(row['p95_ms']):>9}{cell(row['p99_ms']):>9}"
+            f"{cell(row['ttft_p50_ms']):>9}{cell(row['ttft_p95_ms']):>9}"
+        )
+    print("（延迟单位：毫秒）")
+    print()
+    print(f"{'接口':<32}{'SQL语句':>10}{'请求':>8}{'每请求':>10}")
+    for endpoint, row in report["db_queries"].items():
+        print(
+            f"{endpoint:<32}{row['queries']:>10}{row['requests']:>8}"
+            f"{cell(row['queries_per_request']):>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地假大模型服务上运行基准测试")
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC, help="流量文件（jsonl）")
+    parser.add_argument("--requests", type=int, default=300, help="回放的请求总数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发数")
+    parser.add_argument("--warmup", type=int, default=10, help="预热请求数，不计入结果")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--server", choices=["thread", "gunicorn"], default="thread")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--database-url", help="被测数据库，默认使用临时SQLite文件")
+    parser.add_argument(
+        "--reset-database",
+        action="store_true",
+        help="确认清空 --database-url 指定的数据库",
+    )
+    parser.add_argument("--conversations", type=int, default=200, help="种子会话数")
+    parser.add_argument(
+        "--messages-per-conversation", type=int, default=20, help="每个种子会话的消息数"
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.3, help="假大模型首token延迟（秒）"
+    )
+    parser.add_argument(
+        "--llm-tokens-per-second", type=float, default=50, help="假大模型生成速度"
+    )
+    parser.add_argument(
+        "--llm-error-rate", type=float, default=0.0, help="假大模型错误率"
+    )
+    parser.add_argument(
+        "--llm-reply-tokens", type=int, default=60, help="每次回复的token数"
+    )
+    parser.add_argument(
+        "--response-cache", action="store_true", help="启用回复缓存（默认关闭）"
+    )
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    if args.database_url and not args.reset_database:
+        parser.error(
+            "基准测试会清空数据库，使用 --database-url 时需要同时指定 --reset-database"
+        )
+
+    llm_config = FakeLLMConfig(
+        latency=args.llm_latency,
+        tokens_per_second=args.llm_tokens_per_second,
+        error_rate=args.llm_error_rate,
+        reply_tokens=args.llm_reply_tokens,
+    )
+    _, llm_base_url = start_fake_llm(llm_config)
+
+    database_url = args.database_url or (
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.sqlite")
+    )
+    # 配置在导入应用模块时读取，必须先设置环境变量
+    os.environ.update(
+        {
+            "DATABASE_URL": database_url,
+            "DEEPSEEK_API_KEY": "bench",
+            "DEEPSEEK_BASE_URL": llm_base_url,
+            "LLM_ENDPOINTS": "",
+            "OPIK_API_KEY": "",
+            "RESPONSE_CACHE_ENABLED": "true" if args.response_cache else "false",
+        }
+    )
+
+    print(
+        f"📊 写入种子数据: {args.conversations} 个会话 × {args.messages_per_conversation} 条消息"
+    )
+    conversation_ids = seed_database(args.conversations, args.messages_per_conversation)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"🚀 启动应用（{args.server}）: {base_url}")
+    stop_server = start_server(args.server, args.port)
+    try:
+        wait_until_ready(base_url)
+
+        traffic = load_traffic(args.traffic)
+        rng = random.Random(args.seed)
+        weights = [entry["weight"] for entry in traffic]
+
+        def plan(count):
+            return [
+                (entry, rng.choice(conversation_ids))
+                for entry in rng.choices(traffic, weights=weights, k=count)
+            ]
+
+        if args.warmup:
+            run_traffic(base_url, plan(args.warmup), args.concurrency)
+
+        queries_before, requests_before = scrape_metrics(base_url)
+        llm_requests_before = llm_config.requests
+        print(f"🔁 回放 {args.requests} 个请求，并发 {args.concurrency}")
+        results, elapsed = run_traffic(base_url, plan(args.requests), args.concurrency)
+        # 留出时间让后台的标题和摘要任务完成
+        time.sleep(1)
+        queries_after, requests_after = scrape_metrics(base_url)
+    finally:
+        stop_server()
+
+    queries = {
+        endpoint: queries_after[endpoint] - queries_before.get(endpoint, 0)
+        for endpoint in queries_after
+        if endpoint != "metrics"
+    }
+    requests_count = {
+        endpoint: requests_after[endpoint] - requests_before.get(endpoint, 0)
+        for endpoint in requests_after
+    }
+    report = summarize(results, elapsed, queries, requests_count)
+    report["llm_requests"] = llm_config.requests - llm_requests_before
+    report["settings"] = vars(args)
+
+    print_report(report)
+    print(f"\n假大模型收到 {report['llm_requests']} 个请求")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+启动耗时测量
+
+每轮在新的Python进程中依次测量：导入应用模块、create_app()、第一次获取
+大模型服务（导入langchain、创建HTTP客户端和调度器），输出各阶段的中位数和
+最小值。前两个阶段相当于工作进程启动和 init_db.py 的开销，第三个阶段由
+第一个聊天请求或预热线程承担。
+
+用法:
+    python -m bench.startup_time --runs 5
+    python -m bench.startup_time --importtime 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ("import_app", "create_app", "first_llm_service")
+
+# 在子进程中执行，结果以一行JSON输出
+_MEASURE_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+with application.app_context():
+    from llm_service import get_llm_service
+    get_llm_service()
+ready = time.perf_counter()
+print(json.dumps({
+    "import_app": imported - started,
+    "create_app": created - imported,
+    "first_llm_service": ready - created,
+}))
+"""
+
+
+def _environment():
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("DEEPSEEK_API_KEY", "startup-time")
+    env["OPIK_API_KEY"] = ""
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure_once():
+    """在新进程中测量一轮，返回各阶段耗时（秒）"""
+    result = subprocess.run(
+        [sys.executable, "-c", _MEASURE_SCRIPT],
+        cwd=ROOT_DIR,
+        env=_environment(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(limit):
+    """用 -X importtime 列出导入应用模块时累计耗时最长的模块"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT_DIR,
+        env=_environment(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量应用的启动耗时")
+    parser.add_argument("--runs", type=int, default=5, help="测量轮数")
+    parser.add_argument(
+        "--importtime", type=int, default=0, help="另外列出导入最慢的N个模块"
+    )
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    samples = {phase: [] for phase in PHASES}
+    for _ in range(args.runs):
+        for phase, seconds in measure_once().items():
+            samples[phase].append(seconds)
+
+    summary = {
+        phase: {
+            "median_ms": statistics.median(values) * 1000,
+            "min_ms": min(values) * 1000,
+        }
+        for phase, values in samples.items()
+    }
+    print(f"{'阶段':<20}{'中位数(ms)':>12}{'最小值(ms)':>12}")
+    for phase, stats in summary.items():
+        print(f"{phase:<20}{stats['median_ms']:>12.1f}{stats['min_ms']:>12.1f}")
+
+    if args.importtime:
+        print(f"\n导入最慢的 {args.importtime} 个模块（累计耗时）:")
+        for cumulative, name in slowest_imports(args.importtime):
+            print(f"{cumulative / 1000:>10.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+进程内LRU缓存
+
+同时按条目数、占用字节数和过期时间淘汰，线程安全。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """粗略估算缓存值占用的字节数"""
+    if isinstance(value, (str, bytes)):
+        return len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value) + 56
+    return 64
+
+
+class LRUCache:
+    """带过期时间和容量上限的LRU缓存"""
+
+    def __init__(self, max_entries=1000, max_bytes=None, ttl=None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries (int): 最多缓存的条目数
+            max_bytes (int): 最多占用的字节数，为None时不限制
+            ttl (float): 条目的过期秒数，为None时永不过期
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        """当前占用的字节数"""
+        return self._bytes
+
+    def get(self, key, default=None):
+        """读取缓存，命中时将条目移到最近使用的位置"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None, ttl=None):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+            size (int): 值占用的字节数，为None时自动估算
+            ttl (float): 覆盖默认过期秒数
+        """
+        size = estimate_size(value) if size is None else size
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        """删除缓存条目"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回缓存的统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        """淘汰最久未使用的条目，直到满足容量限制"""
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
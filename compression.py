@@ -0,0 +1,92 @@
+"""
+HTTP响应压缩
+
+按客户端的 Accept-Encoding 协商使用brotli或gzip压缩响应体：
+- 只压缩超过大小阈值的JSON、文本等可压缩类型，小响应压缩收益不抵CPU开销；
+- 流式响应（SSE）需要逐条及时送达，304等没有响应体的响应无需压缩，均跳过；
+- brotli为可选依赖，未安装时只使用gzip。
+"""
+
+import gzip
+from flask import request
+from config import Config
+from metrics import HTTP_RESPONSE_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 可压缩的响应类型
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+
+def choose_encoding(accept_encodings):
+    """
+    根据 Accept-Encoding 选择压缩方式
+
+    Args:
+        accept_encodings: werkzeug 的 request.accept_encodings
+
+    Returns:
+        str: "br"、"gzip"，都不接受时返回None
+    """
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = None
+    best_quality = 0
+    for encoding in candidates:
+        # 按顺序比较，质量相同时优先brotli
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    """按指定方式压缩响应体"""
+    if encoding == "br":
+        return brotli.compress(data, quality=Config.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.COMPRESSION_GZIP_LEVEL)
+
+
+def compress_response(response):
+    """after_request 钩子：按需压缩响应体"""
+    if not Config.COMPRESSION_ENABLED:
+        return response
+
+    # 流式响应和已直接透传的响应保持原样
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    # 不论是否压缩，响应都随 Accept-Encoding 变化，缓存需要区分
+    response.vary.add("Accept-Encoding")
+
+    data = response.get_data()
+    if len(data) < Config.COMPRESSION_MIN_BYTES:
+        HTTP_RESPONSE_BYTES.inc(len(data), encoding="identity")
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        HTTP_RESPONSE_BYTES.inc(len(data), encoding="identity")
+        return response
+
+    compressed = compress(data, encoding)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    HTTP_RESPONSE_BYTES.inc(len(compressed), encoding=encoding)
+    return response
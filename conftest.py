@@ -0,0 +1,43 @@
+"""
+pytest公共配置
+
+测试使用临时目录中的SQLite数据库，需要在导入应用之前设置 DATABASE_URL。
+test_api.py 是对运行中服务的接口测试脚本（python test_api.py），不由pytest收集。
+"""
+
+import os
+import tempfile
+import pytest
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(prefix="opik-demo-test-"), "test.db"
+)
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+collect_ignore = ["test_api.py"]
+
+
+@pytest.fixture
+def app():
+    """创建应用和空数据库，测试在应用上下文中执行"""
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def conversation(app):
+    """一个空会话"""
+    from models import db, Conversation
+
+    conversation = Conversation(title="测试会话")
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
@@ -0,0 +1,76 @@
+"""
+数据库连接池配置
+
+PostgreSQL等服务端数据库使用限定大小的QueuePool：每个工作进程最多持有
+DB_POOL_SIZE + DB_MAX_OVERFLOW 个连接，超出时请求排队等待，而不是同时向
+数据库发起大量连接；连接在使用前检测是否可用，并定期回收。SQLite不使用这些设置。
+
+等待连接的耗时、已借出的连接数和连接上限由 /metrics 输出，用于确定连接池大小：
+等待耗时经常不为零说明连接池偏小，借出数长期远低于上限说明可以调小。
+"""
+
+import time
+import weakref
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from metrics import (
+    DB_POOL_CAPACITY,
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_TIMEOUTS,
+    DB_POOL_WAIT_SECONDS,
+)
+from config import Config
+
+_pools = weakref.WeakSet()
+
+
+class TimedQueuePool(QueuePool):
+    """记录获取连接等待耗时的QueuePool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _checked_out():
+    return sum(pool.checkedout() for pool in list(_pools))
+
+
+def _capacity():
+    return sum(pool.size() + max(pool._max_overflow, 0) for pool in list(_pools))
+
+
+DB_POOL_CHECKED_OUT.set_function(_checked_out)
+DB_POOL_CAPACITY.set_function(_capacity)
+
+
+def engine_options(database_uri):
+    """
+    返回 SQLALCHEMY_ENGINE_OPTIONS
+
+    Args:
+        database_uri (str): 数据库连接地址
+
+    Returns:
+        dict: SQLite返回空字典，其他数据库返回连接池设置
+    """
+    if database_uri.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": Config.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": Config.DB_POOL_PRE_PING,
+    }
@@ -0,0 +1,77 @@
+"""
+gunicorn配置
+
+默认使用gevent工作进程：等待大模型和数据库的I/O时只挂起当前协程，
+单个进程即可同时处理数百个进行中的生成请求，而不是每个请求占用一个线程。
+
+启动方式:
+    gunicorn -c gunicorn.conf.py
+"""
+
+import glob
+import os
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND") or "0.0.0.0:5000"
+wsgi_app = "app:create_app()"
+
+# 工作进程数量与类型
+workers = int(os.environ.get("GUNICORN_WORKERS") or 2)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS") or "gevent"
+# 每个gevent工作进程可同时处理的连接数
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS") or 1000)
+
+# 流式回复可能持续较长时间
+timeout = int(os.environ.get("GUNICORN_TIMEOUT") or 120)
+graceful_timeout = 30
+keepalive = 5
+
+# 工作进程加载应用后在后台预热大模型服务，第一个聊天请求不必等待初始化
+warm_up_llm = (os.environ.get("GUNICORN_WARM_UP_LLM") or "true").lower() == "true"
+
+# 各工作进程的指标写入同一目录，/metrics 汇总所有工作进程的数据；
+# 需要在导入应用（metrics模块）之前设置
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "opik-demo-metrics")
+)
+
+
+def on_starting(server):
+    """主进程启动时清空上次运行留下的指标文件"""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    """工作进程fork后的初始化"""
+    if worker_class == "gevent":
+        # 让psycopg2在等待数据库时让出协程，而不是阻塞整个工作进程
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+        server.log.info(f"工作进程 {worker.pid} 已启用psycopg2协程支持")
+
+    # 开启 preload_app 时应用在主进程中创建，丢弃可能继承的大模型服务实例
+    from llm_service import reset_llm_services
+
+    reset_llm_services()
+
+
+def post_worker_init(worker):
+    """工作进程加载应用之后的初始化"""
+    # 定期把回调仪表（连接池、队列长度等）的值写入指标文件
+    from metrics import start_refresher
+
+    start_refresher()
+
+    if warm_up_llm:
+        worker.wsgi.extensions["llm_service"].warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    """工作进程退出后删除其存活仪表的指标文件"""
+    from metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -0,0 +1,193 @@
+"""
+大模型端点共用的HTTP连接池
+
+所有端点的 ChatOpenAI 客户端共用一个 httpx.Client：连接在请求之间保持复用，
+不必每次重新建立TCP和TLS连接；安装了h2时使用HTTP/2，同一连接上可以并发多个
+流式请求。客户端随大模型服务在每个进程中创建，不会跨fork共享。
+
+传输层统计进行中的请求数和新建的连接数，连接数持续增长说明连接没有被复用，
+进行中的请求数接近 LLM_HTTP_MAX_CONNECTIONS 时请求会排队等待连接。
+
+在 track_responses() 中发出的请求，其响应流会登记到调用方提供的
+ResponseTracker，对冲请求落败时路由器从另一个线程调用 abort() 立即断开，
+不必等到下一个分块；响应头还没到达的请求在响应头到达时随即断开。
+"""
+
+import socket
+import threading
+from contextlib import contextmanager
+import httpx
+from metrics import LLM_HTTP_CONNECTIONS_OPENED, LLM_HTTP_IN_FLIGHT
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    h2 = None
+
+
+class _InFlight:
+    """进行中的请求计数"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        with self._lock:
+            self.value += amount
+
+
+_in_flight = _InFlight()
+LLM_HTTP_IN_FLIGHT.set_function(lambda: _in_flight.value)
+
+# 当前线程（gevent下为协程）登记响应流的 ResponseTracker
+_local = threading.local()
+
+
+class ResponseTracker:
+    """一次逻辑请求打开的响应流，可以从其他线程中断"""
+
+    def __init__(self):
+        self._streams = []
+        self._aborted = False
+        self._lock = threading.Lock()
+
+    def add(self, stream):
+        with self._lock:
+            if not self._aborted:
+                self._streams.append(stream)
+                return
+        stream.abort()
+
+    def abort(self):
+        """断开已打开的响应，之后到达的响应也立即断开"""
+        with self._lock:
+            self._aborted = True
+            streams, self._streams = self._streams, []
+        for stream in streams:
+            stream.abort()
+
+
+@contextmanager
+def track_responses(tracker):
+    """
+    把当前线程中新打开的响应流登记到 tracker
+
+    Args:
+        tracker (ResponseTracker): 可以在其他线程中对其调用 abort()
+    """
+    previous = getattr(_local, "tracker", None)
+    _local.tracker = tracker
+    try:
+        yield
+    finally:
+        _local.tracker = previous
+
+
+def _trace(event_name, info):
+    """httpcore的连接事件回调，记录新建的TCP连接和TLS握手"""
+    if event_name == "connection.connect_tcp.complete":
+        LLM_HTTP_CONNECTIONS_OPENED.inc(stage="tcp")
+    elif event_name == "connection.start_tls.complete":
+        LLM_HTTP_CONNECTIONS_OPENED.inc(stage="tls")
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """流式响应体关闭时才结束计数"""
+
+    def __init__(self, stream, network_stream=None):
+        self._stream = stream
+        self._network_stream = network_stream
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._stream.close()
+        finally:
+            _in_flight.add(-1)
+
+    def abort(self):
+        """
+        从其他线程中断响应：先关闭套接字的读写，正在读取的线程随即出错返回，
+        再关闭响应流、归还连接。HTTP/2 的连接由多个请求共用，只重置本请求的流。
+        """
+        with self._lock:
+            # 已关闭的响应其连接可能已经回到连接池被其他请求复用
+            if self._closed:
+                return
+            sock = None
+            if self._network_stream is not None:
+                sock = self._network_stream.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        try:
+            self.close()
+        except Exception as e:
+            logger.debug(f"关闭被取消的响应时出错: {str(e)}")
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """统计进行中请求数和新建连接数的传输层"""
+
+    def handle_request(self, request):
+        request.extensions = {**request.extensions, "trace": _trace}
+        _in_flight.add(1)
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            _in_flight.add(-1)
+            raise
+        # HTTP/1.1 的响应带有独占的网络流，HTTP/2 的流由多个请求共用，不能直接断开
+        network_stream = None
+        if response.extensions.get("http_version") != b"HTTP/2":
+            network_stream = response.extensions.get("network_stream")
+        stream = _TrackedStream(response.stream, network_stream)
+        tracker = getattr(_local, "tracker", None)
+        if tracker is not None:
+            tracker.add(stream)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=stream,
+            extensions=response.extensions,
+        )
+
+
+def create_http_client():
+    """
+    按配置创建共用的HTTP客户端
+
+    Returns:
+        httpx.Client: 保持连接、限制连接数的客户端
+    """
+    http2 = Config.LLM_HTTP2 and h2 is not None
+    if Config.LLM_HTTP2 and h2 is None:
+        logger.info("未安装h2，大模型HTTP客户端使用HTTP/1.1")
+
+    limits = httpx.Limits(
+        max_connections=Config.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    return httpx.Client(
+        transport=InstrumentedTransport(http2=http2, limits=limits),
+        timeout=httpx.Timeout(
+            Config.LLM_REQUEST_TIMEOUT_SECONDS,
+            connect=Config.LLM_CONNECT_TIMEOUT_SECONDS,
+        ),
+    )
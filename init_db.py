@@ -7,6 +7,7 @@ import os
 import sys
 from app import create_app
 from models import db
+from migrate_db import run_migrations
 
 
 def init_database():
@@ -17,6 +18,7 @@ def init_database():
         try:
             print("📊 正在创建数据库表...")
             db.create_all()
+            run_migrations()
             print("✅ 数据库表创建成功!")
 
             # 显示创建的表
@@ -0,0 +1,529 @@
+"""
+大模型多端点路由
+
+DeepSeekService 可以配置多个兼容OpenAI接口的端点（LLM_ENDPOINTS），按顺序
+排列，第一个为主端点：
+- 对冲请求：主端点的首个token超过其历史首token耗时的百分位数仍未到达时，
+  向下一个端点再发一次相同请求，先产出内容的一方胜出，另一方被取消；
+- 故障转移：端点在产出内容前出错时，立即改用下一个端点；
+- 健康评分：按指数加权移动平均记录每个端点的首token耗时和错误率，错误率高
+  的端点排到后面；
+- 熔断：连续失败达到阈值后暂停使用该端点，冷却后放行一次试探请求，成功即恢复。
+
+对冲请求是额外的上游请求，需要从调度器不排队地再占用一个并发名额和令牌，
+占用不到时不发送；故障转移在前一个请求结束后才发出，沿用原来的名额。
+各端点的错误率、首token耗时均值、熔断状态，以及对冲和故障转移的次数见 /metrics。
+
+所有调用在内部都走流式接口，非流式调用只是把流式结果拼接起来。
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+from config import Config
+from http_pool import ResponseTracker, track_responses
+from metrics import (
+    LLM_ENDPOINT_CIRCUIT_STATE,
+    LLM_ENDPOINT_ERROR_RATE,
+    LLM_ENDPOINT_REQUESTS,
+    LLM_ENDPOINT_TTFT_EWMA_SECONDS,
+    LLM_ENDPOINT_TTFT_SECONDS,
+    LLM_FAILOVERS,
+    LLM_HEDGES,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 指数加权移动平均的平滑系数
+EWMA_ALPHA = 0.2
+
+# 错误率超过该值的端点视为降级，排到候选列表末尾
+DEGRADED_ERROR_RATE = 0.5
+
+# 每个端点保留的首token耗时样本数
+TTFT_SAMPLE_SIZE = 200
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_STATES = (CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN)
+
+
+class NoAvailableEndpoint(Exception):
+    """所有端点都处于熔断状态"""
+
+
+def _ewma(current, value):
+    return value if current is None else current + EWMA_ALPHA * (value - current)
+
+
+def percentile(samples, p):
+    """返回样本的第p百分位数（最近秩法）"""
+    ordered = sorted(samples)
+    index = max(int(round(p / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class Endpoint:
+    """一个兼容OpenAI接口的端点及其健康状态"""
+
+    def __init__(
+        self,
+        name,
+        client,
+        failure_threshold=3,
+        reset_seconds=30,
+    ):
+        """
+        Args:
+            name (str): 端点名称，用于日志和统计
+            client: LangChain聊天模型，需要支持 stream()
+            failure_threshold (int): 触发熔断的连续失败次数
+            reset_seconds (float): 熔断后再次试探前的冷却秒数
+        """
+        self.name = name
+        self.client = client
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.ttft_ewma = None
+        self.error_rate = 0.0
+        self.ttft_samples = deque(maxlen=TTFT_SAMPLE_SIZE)
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.failures = 0
+        self._export()
+
+    @property
+    def model(self):
+        return self.client.model_name
+
+    @property
+    def degraded(self):
+        return self.error_rate > DEGRADED_ERROR_RATE
+
+    def _export(self):
+        """把健康状态写入指标，需要在持有锁时调用"""
+        LLM_ENDPOINT_ERROR_RATE.set(self.error_rate, endpoint=self.name)
+        if self.ttft_ewma is not None:
+            LLM_ENDPOINT_TTFT_EWMA_SECONDS.set(self.ttft_ewma, endpoint=self.name)
+        for state in CIRCUIT_STATES:
+            LLM_ENDPOINT_CIRCUIT_STATE.set(
+                1 if state == self.state else 0, endpoint=self.name, state=state
+            )
+
+    def allow(self):
+        """
+        判断能否向该端点发送请求
+
+        熔断冷却结束后转为半开状态，只放行一次试探请求。
+        """
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if (
+                self.state == CIRCUIT_OPEN
+                and time.monotonic() - self.opened_at >= self.reset_seconds
+            ):
+                self.state = CIRCUIT_HALF_OPEN
+                self._export()
+                logger.info(f"端点 {self.name} 熔断冷却结束，发送试探请求")
+                return True
+            return False
+
+    def record_success(self, ttft):
+        """记录一次成功的请求及其首token耗时"""
+        with self._lock:
+            self.requests += 1
+            self.error_rate = _ewma(self.error_rate, 0.0)
+            self.ttft_ewma = _ewma(self.ttft_ewma, ttft)
+            self.ttft_samples.append(ttft)
+            self.consecutive_failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                logger.info(f"端点 {self.name} 已恢复")
+            self.state = CIRCUIT_CLOSED
+            self._export()
+        LLM_ENDPOINT_REQUESTS.inc(endpoint=self.name, result="success")
+
+    def record_failure(self):
+        """记录一次失败的请求，必要时打开熔断"""
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate = _ewma(self.error_rate, 1.0)
+            self.consecutive_failures += 1
+            if (
+                self.state == CIRCUIT_HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                if self.state != CIRCUIT_OPEN:
+                    logger.warning(
+                        f"端点 {self.name} 连续失败 {self.consecutive_failures} 次，已熔断"
+                    )
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+            self._export()
+        LLM_ENDPOINT_REQUESTS.inc(endpoint=self.name, result="failure")
+
+    def abandon(self):
+        """请求被取消且没有结果时调用，半开状态下允许重新试探"""
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic() - self.reset_seconds
+                self._export()
+
+    def hedge_delay(self, p, min_delay, max_delay, min_samples):
+        """发送对冲请求前等待首token的秒数"""
+        with self._lock:
+            if len(self.ttft_samples) < min_samples:
+                return max_delay
+            delay = percentile(self.ttft_samples, p)
+        return min(max(delay, min_delay), max_delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "model": self.model,
+                "state": self.state,
+                "requests": self.requests,
+                "failures": self.failures,
+                "error_rate": round(self.error_rate, 4),
+                "ttft_ewma": (
+                    round(self.ttft_ewma, 4) if self.ttft_ewma is not None else None
+                ),
+            }
+
+
+class _Attempt:
+    """向某个端点发出的一次请求"""
+
+    def __init__(self, endpoint, scheduler=None):
+        self.endpoint = endpoint
+        self.started_at = time.monotonic()
+        self.ttft = None
+        self.cancelled = False
+        # 本次请求打开的HTTP响应流，取消时从调用方一侧断开
+        self.responses = ResponseTracker()
+        # 对冲请求额外占用了调度器的名额，请求结束或被取消时归还
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+
+    def release_slot(self):
+        """归还额外占用的调度器名额，只归还一次"""
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.release()
+
+    def cancel(self):
+        """
+        取消请求：立即归还名额并断开HTTP响应，读取线程随即出错退出，
+        不必等待上游的下一个分块（上游卡住时正是发送对冲请求的原因）
+        """
+        self.cancelled = True
+        self.release_slot()
+        self.responses.abort()
+
+
+class LLMRouter:
+    """在多个端点之间对冲请求和故障转移的路由器"""
+
+    def __init__(
+        self,
+        endpoints,
+        hedge_enabled=True,
+        hedge_percentile=95,
+        hedge_min_delay=0.3,
+        hedge_max_delay=3.0,
+        hedge_min_samples=20,
+        scheduler=None,
+    ):
+        """
+        初始化路由器
+
+        Args:
+            endpoints (list): 按优先级排列的 Endpoint 列表
+            hedge_enabled (bool): 是否发送对冲请求
+            hedge_percentile (float): 对冲等待时间取首token耗时的百分位数
+            hedge_min_delay (float): 对冲等待时间下限
+            hedge_max_delay (float): 对冲等待时间上限，样本不足时使用
+            hedge_min_samples (int): 按百分位数计算等待时间所需的最少样本数
+            scheduler (LLMScheduler): 对冲请求从中占用额外名额，为None时不限制
+        """
+        if not endpoints:
+            raise ValueError("至少需要配置一个大模型端点")
+        self.endpoints = endpoints
+        self.hedge_enabled = hedge_enabled and len(endpoints) > 1
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.scheduler = scheduler
+
+        # 统计由请求线程更新，在锁内计数
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.failovers = 0
+
+    @classmethod
+    def from_config(cls, scheduler=None, **client_kwargs):
+        """
+        根据配置创建路由器
+
+        Args:
+            scheduler (LLMScheduler): 调度器，对冲请求从中占用额外名额
+            **client_kwargs: 传给每个 ChatOpenAI 客户端的模型参数（temperature等）
+        """
+        # langchain_openai导入较慢，只在创建路由器时导入
+        from langchain_openai import ChatOpenAI
+        from http_pool import create_http_client
+
+        # 所有端点共用一个保持连接的HTTP客户端
+        http_client = create_http_client()
+
+        if Config.LLM_ENDPOINTS:
+            specs = json.loads(Config.LLM_ENDPOINTS)
+        else:
+            specs = [
+                {
+                    "name": "deepseek",
+                    "base_url": Config.DEEPSEEK_BASE_URL,
+                    "model": "deepseek-chat",
+                }
+            ]
+
+        endpoints = []
+        for index, spec in enumerate(specs):
+            client = ChatOpenAI(
+                model=spec.get("model", "deepseek-chat"),
+                openai_api_key=spec.get("api_key") or Config.DEEPSEEK_API_KEY,
+                openai_api_base=spec["base_url"],
+                request_timeout=Config.LLM_REQUEST_TIMEOUT_SECONDS,
+                max_retries=0,  # 重试由调度器和路由器负责
+                streaming=True,
+                stream_usage=True,  # 在最后一个分块中返回token用量
+                http_client=http_client,
+                **client_kwargs,
+            )
+            endpoints.append(
+                Endpoint(
+                    spec.get("name") or f"endpoint-{index}",
+                    client,
+                    failure_threshold=Config.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_seconds=Config.LLM_CIRCUIT_RESET_SECONDS,
+                )
+            )
+
+        return cls(
+            endpoints,
+            hedge_enabled=Config.LLM_HEDGE_ENABLED,
+            hedge_percentile=Config.LLM_HEDGE_PERCENTILE,
+            hedge_min_delay=Config.LLM_HEDGE_MIN_DELAY_SECONDS,
+            hedge_max_delay=Config.LLM_HEDGE_MAX_DELAY_SECONDS,
+            hedge_min_samples=Config.LLM_HEDGE_MIN_SAMPLES,
+            scheduler=scheduler,
+        )
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+    def _candidates(self):
+        """按优先级返回可用的端点，降级的端点排在后面"""
+        available = [endpoint for endpoint in self.endpoints if endpoint.allow()]
+        return [e for e in available if not e.degraded] + [
+            e for e in available if e.degraded
+        ]
+
+    def _count(self, name, metric, **labels):
+        """累加路由器的统计并同步到指标"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        metric.inc(**labels)
+
+    def _acquire_hedge_slot(self):
+        """为对冲请求占用调度器的额外名额，没有调度器时总是成功"""
+        return self.scheduler is None or self.scheduler.try_acquire()
+
+    def _hedge_delay(self, endpoint):
+        return endpoint.hedge_delay(
+            self.hedge_percentile,
+            self.hedge_min_delay,
+            self.hedge_max_delay,
+            self.hedge_min_samples,
+        )
+
+    def _pump(self, attempt, messages, callbacks, events):
+        """在后台线程中读取一个端点的流式输出，放入事件队列"""
+        stream = None
+        try:
+            with track_responses(attempt.responses):
+                stream = attempt.endpoint.client.stream(
+                    messages, config={"callbacks": callbacks or []}
+                )
+                for chunk in stream:
+                    if attempt.cancelled:
+                        break
+                    if attempt.ttft is None:
+                        attempt.ttft = time.monotonic() - attempt.started_at
+                    events.put((attempt, "chunk", chunk))
+                else:
+                    events.put((attempt, "done", None))
+        except Exception as e:
+            events.put((attempt, "error", e))
+        finally:
+            if stream is not None:
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            if attempt.cancelled and attempt.ttft is None:
+                attempt.endpoint.abandon()
+            attempt.release_slot()
+
+    def stream(self, messages, callbacks=None):
+        """
+        流式调用模型
+
+        先产出内容的端点胜出，之后只转发该端点的输出；产出内容后再出错时
+        异常直接抛给调用方。
+
+        Args:
+            messages (list): LangChain消息列表
+            callbacks (list): LangChain回调
+
+        Yields:
+            AIMessageChunk: 增量回复
+        """
+        pending = self._candidates()
+        if not pending:
+            raise NoAvailableEndpoint("所有大模型端点都处于熔断状态")
+
+        events = queue.Queue()
+        running = []
+
+        def launch(scheduler=None):
+            attempt = _Attempt(pending.pop(0), scheduler)
+            running.append(attempt)
+            threading.Thread(
+                target=self._pump,
+                args=(attempt, messages, callbacks, events),
+                name=f"llm-{attempt.endpoint.name}",
+                daemon=True,
+            ).start()
+            if self.hedge_enabled and pending:
+                return time.monotonic() + self._hedge_delay(attempt.endpoint)
+            return None
+
+        hedge_at = launch()
+        winner = None
+        try:
+            # 等待第一个产出内容的端点
+            while winner is None:
+                timeout = None
+                if hedge_at is not None:
+                    timeout = max(hedge_at - time.monotonic(), 0)
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None
+                    if not self._acquire_hedge_slot():
+                        # 调度器已满或限速中，不额外发送请求，继续等待原请求
+                        self._count("hedges_skipped", LLM_HEDGES, result="skipped")
+                        continue
+                    self._count("hedges", LLM_HEDGES, result="sent")
+                    logger.info(
+                        f"端点 {running[-1].endpoint.name} 首token超时，"
+                        f"向 {pending[0].name} 发送对冲请求"
+                    )
+                    launch(self.scheduler)
+                    continue
+
+                if kind == "error":
+                    running.remove(attempt)
+                    attempt.endpoint.record_failure()
+                    logger.warning(f"端点 {attempt.endpoint.name} 请求失败: {payload}")
+                    if running:
+                        continue
+                    if not pending:
+                        raise payload
+                    self._count("failovers", LLM_FAILOVERS)
+                    hedge_at = launch()
+                    continue
+
+                winner = attempt
+                ttft = attempt.ttft
+                if ttft is None:
+                    ttft = time.monotonic() - attempt.started_at
+                attempt.endpoint.record_success(ttft)
+                LLM_ENDPOINT_TTFT_SECONDS.observe(ttft, endpoint=attempt.endpoint.name)
+                if attempt is not running[0]:
+                    self._count("hedge_wins", LLM_HEDGES, result="won")
+                for other in running:
+                    if other is not winner:
+                        other.cancel()
+
+            if kind == "done":
+                return
+            yield payload
+
+            # 只转发胜出端点的后续输出
+            while True:
+                attempt, kind, payload = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == "done":
+                    return
+                if kind == "error":
+                    winner.endpoint.record_failure()
+                    raise payload
+                yield payload
+        finally:
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.cancel()
+                else:
+                    attempt.cancelled = True
+
+    def invoke(self, messages, callbacks=None):
+        """
+        非流式调用模型，拼接流式输出
+
+        Returns:
+            AIMessage: 模型回复，端点返回了token用量时附带 usage_metadata
+        """
+        from langchain_core.messages import AIMessage
+
+        content = []
+        usage = None
+        for chunk in self.stream(messages, callbacks):
+            if chunk.content:
+                content.append(chunk.content)
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+        return AIMessage(content="".join(content), usage_metadata=usage)
+
+    def stats(self):
+        """返回路由器和各端点的运行统计"""
+        with self._lock:
+            counts = {
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedges_skipped": self.hedges_skipped,
+                "failovers": self.failovers,
+            }
+        return {
+            **counts,
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+        }
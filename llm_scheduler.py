@@ -0,0 +1,331 @@
+"""
+大模型调用调度器
+
+所有对上游API的调用都经过调度器：
+- 并发上限：同时进行中的请求数不超过 max_concurrency，多余的请求排队等待；
+- 优先级：排队时按优先级放行，聊天回复优先于摘要和标题生成；
+- 令牌桶限速：平滑突发流量，避免触发上游的429限流；
+- 合并请求（single-flight）：相同键的请求在进行中时，后来者直接等待并共享结果；
+- 重试：遇到429或5xx错误时按指数退避重试。
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+from metrics import LLM_QUEUE_SECONDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值越小越优先
+PRIORITY_CHAT = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_TITLE = 2
+
+# 指标中使用的优先级名称
+PRIORITY_NAMES = {
+    PRIORITY_CHAT: "chat",
+    PRIORITY_SUMMARY: "summary",
+    PRIORITY_TITLE: "title",
+}
+
+# 可重试的上游HTTP状态码
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class SchedulerTimeout(Exception):
+    """排队等待超时"""
+
+
+class TokenBucket:
+    """令牌桶限速器"""
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数
+            capacity (float): 桶容量，即允许的突发请求数
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def reserve(self):
+        """预定一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_take(self):
+        """有可用令牌时取走一个并返回True，否则不等待，直接返回False"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _Call:
+    """进行中的合并请求"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def is_retryable(error):
+    """判断上游错误是否值得重试"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+class LLMScheduler:
+    """带优先级、限速和请求合并的大模型调用调度器"""
+
+    def __init__(
+        self,
+        max_concurrency,
+        rate_per_second=0,
+        burst=1,
+        max_retries=0,
+        retry_backoff=0.5,
+        queue_timeout=None,
+    ):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency (int): 同时进行中的最大请求数
+            rate_per_second (float): 每秒允许发起的请求数，0表示不限速
+            burst (int): 令牌桶容量
+            max_retries (int): 可重试错误的最大重试次数
+            retry_backoff (float): 第一次重试前等待的秒数，之后按指数增长
+            queue_timeout (float): 排队等待的最长秒数，为None时一直等待
+        """
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_second, burst) if rate_per_second else None
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue_timeout = queue_timeout
+
+        self._condition = threading.Condition()
+        self._waiting = []  # (优先级, 序号) 小顶堆
+        self._sequence = itertools.count()
+        self._active = 0
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        self.completed = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_config(cls):
+        """根据配置创建调度器"""
+        return cls(
+            max_concurrency=Config.LLM_MAX_CONCURRENCY,
+            rate_per_second=Config.LLM_RATE_LIMIT_PER_SECOND,
+            burst=Config.LLM_RATE_LIMIT_BURST,
+            max_retries=Config.LLM_MAX_RETRIES,
+            retry_backoff=Config.LLM_RETRY_BACKOFF_SECONDS,
+            queue_timeout=Config.LLM_QUEUE_TIMEOUT_SECONDS,
+        )
+
+    @contextmanager
+    def slot(self, priority):
+        """
+        占用一个并发名额
+
+        按优先级排队，同一优先级先到先得；拿到名额后再从令牌桶取令牌。
+
+        Raises:
+            SchedulerTimeout: 排队超过 queue_timeout
+        """
+        ticket = (priority, next(self._sequence))
+        queued_at = time.monotonic()
+        deadline = (
+            queued_at + self.queue_timeout if self.queue_timeout is not None else None
+        )
+
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while (
+                    self._waiting[0] != ticket or self._active >= self.max_concurrency
+                ):
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            self.timeouts += 1
+                            raise SchedulerTimeout("大模型请求排队超时")
+                    self._condition.wait(timeout)
+            finally:
+                # 无论成功还是超时都离开等待队列，并唤醒其他等待者
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+            self._active += 1
+
+        LLM_QUEUE_SECONDS.observe(
+            time.monotonic() - queued_at,
+            priority=PRIORITY_NAMES.get(priority, str(priority)),
+        )
+        try:
+            if self.bucket is not None:
+                wait = self.bucket.reserve()
+                if wait > 0:
+                    time.sleep(wait)
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self):
+        """
+        不排队地占用一个额外的并发名额，用于对冲请求
+
+        只有没有请求在排队、并发数未满并且令牌桶中有令牌时才成功，
+        对冲请求不会挤占排队中的请求，也不会突破限速；成功后需要调用 release()。
+
+        Returns:
+            bool: 是否占用成功
+        """
+        with self._condition:
+            if self._waiting or self._active >= self.max_concurrency:
+                return False
+            if self.bucket is not None and not self.bucket.try_take():
+                return False
+            self._active += 1
+        return True
+
+    def release(self):
+        """归还 slot() 或 try_acquire() 占用的名额"""
+        with self._condition:
+            self._active -= 1
+            self.completed += 1
+            self._condition.notify_all()
+
+    def _backoff(self, attempt):
+        """第attempt次重试前等待的秒数（带随机抖动）"""
+        return self.retry_backoff * (2**attempt) * (0.5 + random.random())
+
+    def run(self, priority, func, key=None):
+        """
+        在调度器中执行一次非流式调用
+
+        Args:
+            priority (int): 优先级
+            func: 无参调用函数
+            key (str): 合并键，相同键的进行中请求共享同一结果；为None时不合并
+
+        Returns:
+            func 的返回值
+        """
+        if key is None:
+            return self._run_with_retries(priority, func)
+
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_with_retries(priority, func)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _run_with_retries(self, priority, func):
+        attempt = 0
+        while True:
+            try:
+                with self.slot(priority):
+                    return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                delay = self._backoff(attempt)
+                logger.warning(f"上游请求失败，{delay:.2f}秒后重试: {str(e)}")
+                time.sleep(delay)
+                attempt += 1
+
+    def stream(self, priority, factory):
+        """
+        在调度器中执行一次流式调用，整个流式输出期间占用一个并发名额
+
+        只有在尚未产出任何内容时才会重试，避免重复输出。
+
+        Args:
+            priority (int): 优先级
+            factory: 无参函数，返回产出增量内容的迭代器
+
+        Yields:
+            迭代器产出的内容
+        """
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with self.slot(priority):
+                    for item in factory():
+                        started = True
+                        yield item
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                delay = self._backoff(attempt)
+                logger.warning(f"上游流式请求失败，{delay:.2f}秒后重试: {str(e)}")
+                time.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        """返回调度器的运行统计"""
+        with self._condition:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "completed": self.completed,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
@@ -1,13 +1,47 @@
-from langchain_openai import ChatOpenAI
+"""
+大模型服务
 
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from langchain.memory import ConversationBufferWindowMemory
-from opik.integrations.langchain import OpikTracer
+DeepSeekService 封装提示词构建、调度、路由、缓存和跟踪。服务通过
+LLMServiceExtension 注册到应用，在每个进程第一次调用大模型时才创建：
+langchain等依赖在创建时才导入，HTTP客户端和后台线程不会跨fork共享，
+导入本模块、启动应用和运行数据库脚本都不受影响，未配置API密钥也能启动。
+"""
+
+from flask import current_app
 from config import Config
+from tokenizer import count_tokens, MESSAGE_OVERHEAD_TOKENS
+from response_cache import ResponseCache
+from llm_router import LLMRouter
+from tracing import Tracer
+from metrics import (
+    LLM_COMPLETION_TOKENS,
+    LLM_ERRORS,
+    LLM_GENERATION_SECONDS,
+    LLM_PROMPT_TOKENS,
+    LLM_SCHEDULER_ACTIVE,
+    LLM_SCHEDULER_WAITING,
+    LLM_TOKENS_PER_SECOND,
+    LLM_TTFT_SECONDS,
+)
+from llm_scheduler import (
+    LLMScheduler,
+    PRIORITY_CHAT,
+    PRIORITY_SUMMARY,
+    PRIORITY_TITLE,
+)
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 聊天使用的系统提示词
+SYSTEM_PROMPT = """你是一个有用的AI助手，请用中文回答用户的问题。回答要准确、有帮助，并且简洁明了。"""
+
 
 class DeepSeekService:
     """DeepSeek大模型服务类"""
@@ -20,97 +54,291 @@ class DeepSeekService:
         if not self.api_key:
             raise ValueError("DEEPSEEK_API_KEY 环境变量未设置")
 
-        # 初始化ChatOpenAI模型
-        self.llm = ChatOpenAI(
-            model="deepseek-chat",
-            openai_api_key=self.api_key,
-            openai_api_base=self.base_url,
-            temperature=0.7,
-            max_tokens=2000,
-            streaming=True,
+        # 初始化调用调度器（并发上限、限速、优先级和请求合并）
+        self.scheduler = LLMScheduler.from_config()
+        LLM_SCHEDULER_ACTIVE.set_function(lambda: self.scheduler.stats()["active"])
+        LLM_SCHEDULER_WAITING.set_function(lambda: self.scheduler.stats()["waiting"])
+
+        # 初始化模型端点路由（对冲请求、故障转移和熔断），对冲请求同样受调度器限制
+        self.model_params = {"temperature": 0.7, "max_tokens": 2000}
+        self.router = LLMRouter.from_config(
+            scheduler=self.scheduler, **self.model_params
         )
 
-        # 初始化记忆
-        self.memory = ConversationBufferWindowMemory(
-            k=10, return_messages=True  # 保留最近10轮对话
+        # 初始化回复缓存，缓存键和语义缓存的命名空间都包含模型和模型参数
+        self.response_cache = (
+            ResponseCache.from_config() if Config.RESPONSE_CACHE_ENABLED else None
         )
+        self.cache_params = {"model": self.router.primary.model, **self.model_params}
+        self.cache_namespace = ResponseCache.make_namespace(
+            SYSTEM_PROMPT, self.cache_params
+        )
+
+        # 初始化跟踪器（采样后异步批量上报到Opik）
+        self.tracer = Tracer.from_config(tags=["deepseek", "flask-app"])
+
+    def _build_messages(self, user_message, conversation_history=None, summary=None):
+        """
+        构建发送给大模型的消息列表
+
+        Args:
+            user_message (str): 用户消息
+            conversation_history (list): 对话历史，格式为 [{"role": "user/assistant", "content": "..."}]
+            summary (str): 更早对话的摘要
+
+        Returns:
+            list: LangChain消息列表
+        """
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+        messages = []
+
+        # 添加系统消息
+        messages.append(SystemMessage(content=SYSTEM_PROMPT))
+
+        # 添加更早对话的摘要
+        if summary:
+            messages.append(SystemMessage(content=f"此前对话的摘要：\n{summary}"))
+
+        # 添加对话历史（调用方已按token预算截取）
+        if conversation_history:
+            for msg in conversation_history:
+                if msg["role"] == "user":
+                    messages.append(HumanMessage(content=msg["content"]))
+                elif msg["role"] == "assistant":
+                    messages.append(AIMessage(content=msg["content"]))
 
-        # 初始化Opik跟踪器（如果配置正确）
-        self.opik_tracer = None
-        if Config.OPIK_API_KEY:
+        # 添加当前用户消息
+        messages.append(HumanMessage(content=user_message))
+
+        return messages
+
+    def history_token_budget(self, user_message, summary_tokens=0):
+        """
+        计算对话历史可使用的token预算
+
+        Args:
+            user_message (str): 当前用户消息
+            summary_tokens (int): 会话摘要的token数
+
+        Returns:
+            int: 扣除系统提示词、摘要和当前消息后剩余的token数
+        """
+        fixed_tokens = (
+            count_tokens(SYSTEM_PROMPT) + summary_tokens + count_tokens(user_message)
+        )
+        return max(Config.CONTEXT_TOKEN_BUDGET - fixed_tokens, 0)
+
+    def _invoke(self, messages, priority, route, key=None):
+        """
+        通过调度器调用模型
+
+        Args:
+            messages (list): LangChain消息列表
+            priority (int): 调度优先级
+            route (str): 跟踪使用的路由名称
+            key (str): 合并键，相同键的进行中请求共享结果
+
+        Returns:
+            AIMessage: 模型回复
+        """
+        started = time.perf_counter()
+        with self.tracer.trace(
+            route, messages, model=self.router.primary.model
+        ) as span:
             try:
-                # 设置环境变量供Opik使用
-                import os
-
-                os.environ["OPIK_API_KEY"] = Config.OPIK_API_KEY
-                if Config.OPIK_PROJECT_NAME:
-                    os.environ["OPIK_PROJECT_NAME"] = Config.OPIK_PROJECT_NAME
-                if Config.OPIK_WORKSPACE:
-                    os.environ["OPIK_WORKSPACE"] = Config.OPIK_WORKSPACE
-
-                self.opik_tracer = OpikTracer(
-                    tags=["deepseek", "chat", "flask-app"],
-                    metadata={"service": "DeepSeekService", "model": "deepseek-chat"},
+                response = self.scheduler.run(
+                    priority, lambda: self.router.invoke(messages), key=key
                 )
-                logger.info("Opik跟踪器初始化成功")
-            except Exception as e:
-                logger.warning(f"Opik跟踪器初始化失败: {e}")
-                self.opik_tracer = None
+            except Exception:
+                LLM_ERRORS.inc(route=route)
+                raise
+            span.output = response.content
+
+        self._observe_generation(
+            route,
+            messages,
+            response.content,
+            time.perf_counter() - started,
+            usage=response.usage_metadata,
+        )
+        return response
+
+    def _observe_generation(
+        self, route, messages, content, elapsed, ttft=None, usage=None
+    ):
+        """
+        记录一次大模型调用的耗时和token用量指标
+
+        端点没有返回token用量时，用本地分词器估算。
+        """
+        if usage:
+            prompt_tokens = usage["input_tokens"]
+            completion_tokens = usage["output_tokens"]
         else:
-            logger.info("Opik配置不完整，跳过跟踪器初始化")
-            logger.info(
-                f"OPIK_API_KEY: {'已设置' if Config.OPIK_API_KEY else '未设置'}"
+            prompt_tokens = sum(count_tokens(message.content) for message in messages)
+            completion_tokens = (
+                count_tokens(content) - MESSAGE_OVERHEAD_TOKENS if content else 0
             )
-            logger.info(
-                f"OPIK_WORKSPACE: {'已设置' if Config.OPIK_WORKSPACE else '未设置'}"
+
+        LLM_GENERATION_SECONDS.observe(elapsed, route=route)
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, route=route)
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, route=route)
+        generation_seconds = elapsed - (ttft or 0)
+        if completion_tokens and generation_seconds > 0:
+            LLM_TOKENS_PER_SECOND.observe(
+                completion_tokens / generation_seconds, route=route
             )
 
-    def generate_response(self, user_message, conversation_history=None):
+    def _cache_lookup(self, user_message, conversation_history, summary):
+        """
+        查找缓存的回复
+
+        缓存键同时用作合并进行中请求的键，因此即使未启用缓存也会计算。
+
+        Returns:
+            tuple: (缓存键, 是否单轮提问, 缓存的回复或None)
+        """
+        single_turn = not conversation_history and not summary
+        key = ResponseCache.make_key(
+            SYSTEM_PROMPT,
+            summary,
+            conversation_history,
+            user_message,
+            self.cache_params,
+        )
+        if self.response_cache is None:
+            return key, single_turn, None
+        return (
+            key,
+            single_turn,
+            self.response_cache.get(
+                key, user_message, single_turn, self.cache_namespace
+            ),
+        )
+
+    def generate_response(self, user_message, conversation_history=None, summary=None):
         """
         生成AI回复
 
         Args:
             user_message (str): 用户消息
             conversation_history (list): 对话历史，格式为 [{"role": "user/assistant", "content": "..."}]
+            summary (str): 更早对话的摘要
 
         Returns:
             str: AI回复内容
         """
         try:
-            logger.info(f"收到用户消息: {user_message}")
             logger.info(
-                f"对话历史长度: {len(conversation_history) if conversation_history else 0}"
+                f"生成回复，对话历史长度: {len(conversation_history) if conversation_history else 0}"
             )
-            # 构建消息列表
-            messages = []
-
-            # 添加系统消息
-            system_prompt = """你是一个有用的AI助手，请用中文回答用户的问题。回答要准确、有帮助，并且简洁明了。"""
-            messages.append(SystemMessage(content=system_prompt))
-
-            # 添加对话历史
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # 只保留最近10轮对话
-                    if msg["role"] == "user":
-                        messages.append(HumanMessage(content=msg["content"]))
-                    elif msg["role"] == "assistant":
-                        messages.append(AIMessage(content=msg["content"]))
-
-            # 添加当前用户消息
-            messages.append(HumanMessage(content=user_message))
-
-            # 生成回复
-            if self.opik_tracer:
-                response = self.llm(messages, callbacks=[self.opik_tracer])
-            else:
-                response = self.llm(messages)
+            cache_key, single_turn, cached = self._cache_lookup(
+                user_message, conversation_history, summary
+            )
+            if cached is not None:
+                logger.info("命中回复缓存")
+                return cached
+
+            messages = self._build_messages(user_message, conversation_history, summary)
 
+            # 生成回复，相同提示词的进行中请求会被合并
+            response = self._invoke(messages, PRIORITY_CHAT, "chat", key=cache_key)
+
+            if self.response_cache is not None and response.content:
+                self.response_cache.set(
+                    cache_key,
+                    user_message,
+                    single_turn,
+                    self.cache_namespace,
+                    response.content,
+                )
             return response.content
 
         except Exception as e:
             logger.error(f"生成AI回复时出错: {str(e)}")
             return f"抱歉，生成回复时出现错误：{str(e)}"
 
+    def stream_response(self, user_message, conversation_history=None, summary=None):
+        """
+        流式生成AI回复
+
+        与 generate_response 不同，出错时异常会直接抛给调用方，
+        以便调用方保存已生成的部分内容。
+
+        Args:
+            user_message (str): 用户消息
+            conversation_history (list): 对话历史，格式为 [{"role": "user/assistant", "content": "..."}]
+            summary (str): 更早对话的摘要
+
+        Yields:
+            str: 增量回复内容
+        """
+        logger.info(
+            f"流式生成回复，对话历史长度: {len(conversation_history) if conversation_history else 0}"
+        )
+        cache_key, single_turn, cached = self._cache_lookup(
+            user_message, conversation_history, summary
+        )
+        if cached is not None:
+            logger.info("命中回复缓存")
+            yield cached
+            return
+
+        messages = self._build_messages(user_message, conversation_history, summary)
+
+        chunks = []
+        usage = None
+        ttft = None
+        started = time.perf_counter()
+        with self.tracer.trace(
+            "chat", messages, model=self.router.primary.model, streaming=True
+        ) as span:
+            stream = self.scheduler.stream(
+                PRIORITY_CHAT, lambda: self.router.stream(messages)
+            )
+            try:
+                for chunk in stream:
+                    if chunk.usage_metadata:
+                        usage = chunk.usage_metadata
+                    if chunk.content:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                            LLM_TTFT_SECONDS.observe(ttft, route="chat")
+                        chunks.append(chunk.content)
+                        yield chunk.content
+            except Exception:
+                LLM_ERRORS.inc(route="chat")
+                raise
+            finally:
+                # 中途取消或出错时记录已生成的部分
+                span.output = "".join(chunks)
+
+        self._observe_generation(
+            "chat",
+            messages,
+            span.output,
+            time.perf_counter() - started,
+            ttft=ttft,
+            usage=usage,
+        )
+
+        # 只缓存完整生成的回复
+        if self.response_cache is not None and chunks:
+            self.response_cache.set(
+                cache_key,
+                user_message,
+                single_turn,
+                self.cache_namespace,
+                "".join(chunks),
+            )
+
+    @staticmethod
+    def _title_key(first_message):
+        """标题请求的合并键"""
+        digest = hashlib.sha256(first_message.encode("utf-8")).hexdigest()
+        return f"title:{digest}"
+
     def generate_title(self, first_message):
         """
         根据第一条消息生成对话标题
@@ -121,6 +349,8 @@ class DeepSeekService:
         Returns:
             str: 生成的标题
         """
+        from langchain_core.messages import HumanMessage, SystemMessage
+
         try:
             title_prompt = f"""请为以下对话生成一个简洁的标题（不超过20个字符）：
             
@@ -135,10 +365,9 @@ class DeepSeekService:
                 HumanMessage(content=title_prompt),
             ]
 
-            if self.opik_tracer:
-                response = self.llm(messages, callbacks=[self.opik_tracer])
-            else:
-                response = self.llm(messages)
+            response = self._invoke(
+                messages, PRIORITY_TITLE, "title", key=self._title_key(first_message)
+            )
             title = response.content.strip()
 
             # 限制标题长度
@@ -150,3 +379,163 @@ class DeepSeekService:
         except Exception as e:
             logger.error(f"生成标题时出错: {str(e)}")
             return "新对话"
+
+    def generate_titles(self, first_messages):
+        """
+        在一次模型调用中为多个对话生成标题
+
+        批量结果无法解析时，退回为逐条调用 generate_title。
+
+        Args:
+            first_messages (list): 每个对话的第一条用户消息
+
+        Returns:
+            list: 与输入顺序一致的标题列表
+        """
+        if len(first_messages) == 1:
+            return [self.generate_title(first_messages[0])]
+
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        try:
+            numbered = "\n".join(
+                f"{index}. {message}" for index, message in enumerate(first_messages, 1)
+            )
+            title_prompt = f"""请为以下每条用户消息分别生成一个简洁的对话标题（每个不超过20个字符）。
+只输出一个JSON字符串数组，数组长度为{len(first_messages)}，顺序与消息编号一致。
+
+{numbered}"""
+
+            messages = [
+                SystemMessage(
+                    content="你是一个标题生成助手，请根据用户消息生成简洁的对话标题。"
+                ),
+                HumanMessage(content=title_prompt),
+            ]
+
+            response = self._invoke(messages, PRIORITY_TITLE, "title")
+
+            content = response.content
+            titles = json.loads(content[content.index("[") : content.rindex("]") + 1])
+            if not isinstance(titles, list) or len(titles) != len(first_messages):
+                raise ValueError(f"标题数量不匹配: {len(titles)}")
+
+            # 限制标题长度
+            return [
+                title[:20] + "..." if len(title) > 20 else title
+                for title in (str(title).strip() for title in titles)
+            ]
+
+        except Exception as e:
+            logger.warning(f"批量生成标题失败，改为逐条生成: {str(e)}")
+            return [self.generate_title(message) for message in first_messages]
+
+    def summarize_conversation(self, previous_summary, messages):
+        """
+        将新的对话内容合并进已有摘要
+
+        与 generate_title 不同，出错时异常会直接抛给调用方，避免用错误信息覆盖摘要。
+
+        Args:
+            previous_summary (str): 已有摘要，没有时为None
+            messages (list): 需要合并的消息，格式为 [{"role": "user/assistant", "content": "..."}]
+
+        Returns:
+            str: 更新后的摘要
+        """
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        transcript = "\n".join(
+            f"{'用户' if msg['role'] == 'user' else '助手'}：{msg['content']}"
+            for msg in messages
+        )
+        summary_prompt = f"""已有摘要：
+{previous_summary or "（无）"}
+
+新的对话内容：
+{transcript}
+
+请将新的对话内容合并到已有摘要中，保留关键事实、用户偏好和尚未解决的问题，不超过{Config.SUMMARY_MAX_CHARS}字。
+
+摘要："""
+
+        messages = [
+            SystemMessage(
+                content="你是一个对话摘要助手，请用中文简洁、客观地概括对话内容。"
+            ),
+            HumanMessage(content=summary_prompt),
+        ]
+
+        response = self._invoke(messages, PRIORITY_SUMMARY, "summary")
+        return response.content.strip()
+
+
+class LLMServiceExtension:
+    """按进程延迟创建 DeepSeekService 的Flask扩展"""
+
+    def __init__(self, app=None):
+        self._service = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _extensions.add(self)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["llm_service"] = self
+
+    def get(self):
+        """
+        返回当前进程的服务实例，第一次调用时创建
+
+        Raises:
+            ValueError: 未配置 DEEPSEEK_API_KEY
+        """
+        service = self._service
+        if service is not None and self._pid == os.getpid():
+            return service
+        with self._lock:
+            if self._service is None or self._pid != os.getpid():
+                started = time.perf_counter()
+                self._service = DeepSeekService()
+                self._pid = os.getpid()
+                logger.info(
+                    f"大模型服务初始化完成，耗时 {time.perf_counter() - started:.2f} 秒"
+                )
+            return self._service
+
+    def reset(self):
+        """丢弃继承自父进程的服务实例，fork后在子进程中调用"""
+        self._lock = threading.Lock()
+        self._service = None
+        self._pid = None
+
+    def warm_up(self, app):
+        """在后台线程中提前创建服务，使第一个聊天请求不必等待初始化"""
+
+        def run():
+            with app.app_context():
+                try:
+                    self.get()
+                except Exception as e:
+                    logger.warning(f"预热大模型服务失败: {str(e)}")
+
+        threading.Thread(target=run, name="llm-warm-up", daemon=True).start()
+
+
+_extensions = weakref.WeakSet()
+
+
+def reset_llm_services():
+    """重置本进程中所有的服务实例"""
+    for extension in list(_extensions):
+        extension.reset()
+
+
+# fork出的子进程（gunicorn工作进程等）不使用父进程创建的HTTP客户端和线程
+os.register_at_fork(after_in_child=reset_llm_services)
+
+
+def get_llm_service():
+    """返回当前应用的大模型服务，需要在应用上下文中调用"""
+    return current_app.extensions["llm_service"].get()
@@ -0,0 +1,542 @@
+"""
+应用内指标
+
+计数器、仪表和直方图，按Prometheus文本格式由 /metrics 输出。
+
+设置了 PROMETHEUS_MULTIPROC_DIR 且安装了 prometheus_client 时使用多进程模式：
+gunicorn的每个工作进程把指标写入该目录下的文件，/metrics 汇总所有工作进程的
+数据，无论请求落到哪个进程。计数器和直方图累加（含已退出的进程），仪表按
+multiprocess_mode 合并，默认对存活进程求和。通过回调函数读取的仪表由后台线程
+定期写入文件（start_refresher）。gunicorn.conf.py 默认启用该模式，在启动时
+清空目录，并在工作进程退出时调用 mark_process_dead()。
+
+未启用时在进程内统计，/metrics 只输出处理该次请求的进程的数据。
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# 多进程模式：指标写入 PROMETHEUS_MULTIPROC_DIR，由 /metrics 汇总所有工作进程
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+if MULTIPROCESS and prometheus_client is None:
+    logger.warning(
+        "设置了 PROMETHEUS_MULTIPROC_DIR 但未安装prometheus_client，指标只在进程内统计"
+    )
+    MULTIPROCESS = False
+
+# 多进程模式下回调仪表写入文件的间隔（秒）
+CALLBACK_REFRESH_SECONDS = 5
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 生成速度直方图的分桶（token/秒）
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+# 跟踪在请求路径上的单次耗时分桶（秒），开销通常在微秒级
+TRACING_OVERHEAD_BUCKETS = (
+    0.000005,
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+)
+
+# 批量写入消息数的分桶
+WRITE_BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+
+    def refresh(self):
+        """把回调仪表的当前值写入多进程文件"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                metric.refresh()
+
+    def render(self):
+        """按Prometheus文本格式输出所有指标"""
+        if MULTIPROCESS:
+            self.refresh()
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return prometheus_client.generate_latest(registry).decode("utf-8")
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # 标签值元组 -> 指标状态
+        self._lock = threading.Lock()
+        # 多进程模式下实际记录数值的 prometheus_client 指标
+        self._shared = None
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _child(self, labels):
+        """返回多进程模式下对应标签的 prometheus_client 指标"""
+        self._key(labels)
+        if not self.labelnames:
+            return self._shared
+        return self._shared.labels(**labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter(_Metric):
+    """只增不减的计数器，名称按惯例以 _total 结尾"""
+
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if MULTIPROCESS:
+            self._shared = prometheus_client.Counter(
+                self.name, self.documentation, self.labelnames, registry=None
+            )
+
+    def inc(self, amount=1, **labels):
+        if self._shared is not None:
+            self._child(labels).inc(amount)
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", self._format_labels(key), value
+
+
+class Gauge(_Metric):
+    """
+    仪表，可以直接设置数值，也可以在输出时通过回调函数读取
+
+    multiprocess_mode 为多进程模式下合并各工作进程数值的方式：livesum 对存活
+    进程求和，livemax 取存活进程中的最大值。
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args, multiprocess_mode="livesum", **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+        if MULTIPROCESS:
+            self._shared = prometheus_client.Gauge(
+                self.name,
+                self.documentation,
+                self.labelnames,
+                registry=None,
+                multiprocess_mode=multiprocess_mode,
+            )
+
+    def set(self, value, **labels):
+        if self._shared is not None:
+            self._child(labels).set(value)
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """设置输出时调用的回调函数，只适用于没有标签的仪表"""
+        self._function = function
+        self.refresh()
+
+    def refresh(self):
+        """多进程模式下把回调函数的当前值写入文件"""
+        function = self._function
+        if self._shared is None or function is None:
+            return
+        try:
+            self._shared.set(function())
+        except Exception as e:
+            logger.debug(f"读取仪表 {self.name} 失败: {str(e)}")
+
+    def samples(self):
+        if self._function is not None:
+            yield "", "", self._function()
+            return
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", self._format_labels(key), value
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        if MULTIPROCESS:
+            self._shared = prometheus_client.Histogram(
+                self.name,
+                self.documentation,
+                self.labelnames,
+                registry=None,
+                buckets=self.buckets,
+            )
+
+    def observe(self, value, **labels):
+        if self._shared is not None:
+            self._child(labels).observe(value)
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 块的耗时，块内抛出异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(
+                (key, (list(state[0]), state[1], state[2]))
+                for key, state in self._values.items()
+            )
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", self._format_labels(
+                    key, [("le", _format_value(bound))]
+                ), cumulative
+            yield "_sum", self._format_labels(key), total
+            yield "_count", self._format_labels(key), count
+
+
+# HTTP请求
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP请求的处理耗时，流式响应只包含开始发送之前的部分",
+    ["method", "endpoint", "status"],
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "http_response_bytes_total",
+    "API响应体发送的字节数（不含流式响应），按压缩方式区分",
+    ["encoding"],
+)
+
+# 数据库查询次数，请求之外（后台线程等）的查询记为 background
+DB_QUERIES = Counter(
+    "db_queries_total",
+    "执行的SQL语句数",
+    ["endpoint"],
+)
+
+# 发送消息的各个阶段
+CHAT_REQUEST_SECONDS = Histogram(
+    "chat_request_seconds",
+    "从收到消息到AI回复保存完成的总耗时",
+    ["endpoint"],
+)
+DB_READ_SECONDS = Histogram(
+    "chat_db_read_seconds",
+    "发送消息时读取会话和对话历史的耗时",
+    ["endpoint"],
+)
+DB_COMMIT_SECONDS = Histogram(
+    "chat_db_commit_seconds",
+    "保存消息时提交事务的耗时",
+    ["operation"],
+)
+WRITE_BEHIND_BATCH_MESSAGES = Histogram(
+    "chat_write_behind_batch_messages",
+    "延迟写入时每次提交写入的消息数",
+    buckets=WRITE_BATCH_BUCKETS,
+)
+WRITE_BEHIND_PENDING = Gauge(
+    "chat_write_behind_pending_messages",
+    "已进入延迟写入队列、尚未提交的消息数",
+)
+WRITE_BEHIND_FAILURES = Counter(
+    "chat_write_behind_failed_messages_total",
+    "重试后仍未能写入数据库的消息数",
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds",
+    "从连接池获取数据库连接的等待耗时（不含SQLite）",
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "等待数据库连接超时的次数",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "已从连接池借出的数据库连接数",
+)
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity_connections",
+    "连接池允许的最大连接数（pool_size + max_overflow）",
+)
+MESSAGE_ARCHIVE_CONVERSATIONS = Counter(
+    "chat_archive_conversations_total",
+    "归档到文件或从文件恢复的会话数",
+    ["operation"],
+)
+MESSAGE_ARCHIVE_MESSAGES = Counter(
+    "chat_archive_messages_total",
+    "归档到文件或从文件恢复的消息数",
+    ["operation"],
+)
+READ_CACHE_REQUESTS = Counter(
+    "chat_read_cache_requests_total",
+    "会话消息窗口缓存的查找次数，result 为 hit_local、hit_shared 或 miss",
+    ["operation", "result"],
+)
+READ_CACHE_ENTRIES = Gauge(
+    "chat_read_cache_entries",
+    "进程内缓存的会话消息窗口数",
+)
+READ_CACHE_BYTES = Gauge(
+    "chat_read_cache_bytes",
+    "进程内会话消息窗口缓存占用的字节数（估算）",
+)
+SEARCH_SECONDS = Histogram(
+    "search_query_seconds",
+    "全文检索的查询耗时",
+)
+TITLE_GENERATION_SECONDS = Histogram(
+    "chat_title_generation_seconds",
+    "后台批量生成会话标题的耗时",
+)
+
+# 大模型调用
+LLM_QUEUE_SECONDS = Histogram(
+    "llm_queue_wait_seconds",
+    "大模型请求在调度器中排队等待的耗时",
+    ["priority"],
+)
+LLM_TTFT_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "流式调用从发起（含排队）到收到首个token的耗时",
+    ["route"],
+)
+LLM_ENDPOINT_TTFT_SECONDS = Histogram(
+    "llm_endpoint_ttft_seconds",
+    "各端点收到首个token的耗时",
+    ["endpoint"],
+)
+LLM_GENERATION_SECONDS = Histogram(
+    "llm_generation_seconds",
+    "一次大模型调用的总耗时（含排队）",
+    ["route"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "生成速度：输出token数除以首token之后的生成耗时，非流式调用按总耗时计算",
+    ["route"],
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens_total",
+    "发送给大模型的提示词token数",
+    ["route"],
+)
+LLM_COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens_total",
+    "大模型生成的token数",
+    ["route"],
+)
+LLM_ERRORS = Counter(
+    "llm_errors_total",
+    "失败的大模型调用次数",
+    ["route"],
+)
+LLM_ENDPOINT_REQUESTS = Counter(
+    "llm_endpoint_requests_total",
+    "各端点完成的请求数，result 为 success 或 failure",
+    ["endpoint", "result"],
+)
+# 端点健康状态由各工作进程分别统计，多进程模式下取最差（最大）的一个
+LLM_ENDPOINT_ERROR_RATE = Gauge(
+    "llm_endpoint_error_rate",
+    "各端点错误率的指数加权移动平均，超过0.5的端点排到候选列表末尾",
+    ["endpoint"],
+    multiprocess_mode="livemax",
+)
+LLM_ENDPOINT_TTFT_EWMA_SECONDS = Gauge(
+    "llm_endpoint_ttft_ewma_seconds",
+    "各端点首token耗时的指数加权移动平均",
+    ["endpoint"],
+    multiprocess_mode="livemax",
+)
+LLM_ENDPOINT_CIRCUIT_STATE = Gauge(
+    "llm_endpoint_circuit_state",
+    "各端点的熔断状态，当前状态（closed、open 或 half_open）为1，其余为0",
+    ["endpoint", "state"],
+    multiprocess_mode="livemax",
+)
+LLM_HEDGES = Counter(
+    "llm_hedges_total",
+    "对冲请求次数，result 为 sent（已发送）、won（先于原请求产出内容）"
+    "或 skipped（调度器没有空闲名额或令牌，未发送）",
+    ["result"],
+)
+LLM_FAILOVERS = Counter(
+    "llm_failovers_total",
+    "端点在产出内容前出错、改用下一个端点的次数",
+)
+LLM_HTTP_IN_FLIGHT = Gauge(
+    "llm_http_in_flight_requests",
+    "正在进行中的大模型HTTP请求数（流式响应读取完毕才结束）",
+)
+LLM_HTTP_CONNECTIONS_OPENED = Counter(
+    "llm_http_connections_opened_total",
+    "到大模型端点新建的连接数，stage为tcp或tls（TLS握手）",
+    ["stage"],
+)
+LLM_RESPONSE_CACHE_REQUESTS = Counter(
+    "llm_response_cache_requests_total",
+    "大模型回复缓存的查找次数，tier 为 exact 或 semantic，result 为 hit 或 miss",
+    ["tier", "result"],
+)
+LLM_SCHEDULER_ACTIVE = Gauge(
+    "llm_scheduler_active_requests",
+    "正在进行中的大模型请求数",
+)
+LLM_SCHEDULER_WAITING = Gauge(
+    "llm_scheduler_waiting_requests",
+    "在调度器中排队的大模型请求数",
+)
+
+
+# 大模型调用跟踪
+TRACING_SPANS = Counter(
+    "llm_tracing_spans_total",
+    "结束的跟踪数据条数，result 为 enqueued（进入上报队列）、dropped（队列已满被丢弃）"
+    "或 sampled_out（未被采样）",
+    ["route", "result"],
+)
+TRACING_RECORD_SECONDS = Histogram(
+    "llm_tracing_record_overhead_seconds",
+    "每条跟踪数据在请求路径上的耗时（采样判断和入队）",
+    buckets=TRACING_OVERHEAD_BUCKETS,
+)
+TRACING_EXPORTED_SPANS = Counter(
+    "llm_tracing_exported_spans_total",
+    "后台上报的跟踪数据条数，result 为 success 或 error",
+    ["result"],
+)
+TRACING_EXPORT_SECONDS = Histogram(
+    "llm_tracing_export_batch_seconds",
+    "后台每批跟踪数据的上报耗时",
+)
+TRACING_QUEUED_SPANS = Gauge(
+    "llm_tracing_queued_spans",
+    "等待后台上报的跟踪数据条数",
+)
+
+
+def render():
+    """输出所有已注册指标"""
+    return REGISTRY.render()
+
+
+def start_refresher(interval=CALLBACK_REFRESH_SECONDS):
+    """
+    多进程模式下启动后台线程，定期把本进程回调仪表的值写入文件，
+    使 /metrics 落到其他工作进程时也能读到较新的数值。需要在工作进程中调用。
+    """
+    if not MULTIPROCESS:
+        return
+
+    def run():
+        while True:
+            REGISTRY.refresh()
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="metrics-refresher", daemon=True).start()
+
+
+def mark_process_dead(pid):
+    """工作进程退出后删除其存活仪表的文件，由gunicorn主进程调用"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
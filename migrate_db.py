@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+数据库迁移脚本
+
+每个迁移都是幂等的，已执行的迁移记录在 schema_migrations 表中。
+新建的数据库由 db.create_all() 直接创建最新表结构，迁移只补齐旧库缺失的部分。
+"""
+
+import sys
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import db, Message, refresh_conversation_stats
+from partitions import partition_messages_table
+from tokenizer import count_tokens
+from search_index import (
+    PG_SEARCH_INDEX_NAME,
+    PG_SEARCH_VECTOR_SQL,
+    SQLITE_FTS_STATEMENTS,
+    search_tokens,
+)
+
+
+def _column_names(table):
+    """返回数据表当前的列名集合"""
+    return {column["name"] for column in inspect(db.engine).get_columns(table)}
+
+
+def _add_column_if_missing(table, column, ddl):
+    """如果数据表缺少指定列则添加"""
+    if column not in _column_names(table):
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def add_conversation_stats():
+    """为会话添加消息数量、最后消息时间和预览的冗余字段，并回填历史数据"""
+    _add_column_if_missing(
+        "conversations", "message_count", "INTEGER NOT NULL DEFAULT 0"
+    )
+    _add_column_if_missing("conversations", "last_message_at", "TIMESTAMP")
+    _add_column_if_missing("conversations", "last_message_preview", "VARCHAR(100)")
+    db.session.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_conversations_updated_at "
+            "ON conversations (updated_at)"
+        )
+    )
+    refresh_conversation_stats()
+
+
+def add_conversation_keyset_indexes():
+    """为会话列表的游标分页和标题搜索添加索引"""
+    for name, columns in [
+        ("ix_conversations_updated_at_id", "updated_at, id"),
+        ("ix_conversations_created_at_id", "created_at, id"),
+        ("ix_conversations_title_id", "title, id"),
+    ]:
+        db.session.execute(
+            text(f"CREATE INDEX IF NOT EXISTS {name} ON conversations ({columns})")
+        )
+    db.session.execute(text("DROP INDEX IF EXISTS ix_conversations_updated_at"))
+
+    # PostgreSQL下使用pg_trgm加速标题的模糊搜索（ILIKE '%关键词%'）
+    if db.engine.dialect.name == "postgresql":
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                db.session.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_conversations_title_trgm "
+                        "ON conversations USING gin (title gin_trgm_ops)"
+                    )
+                )
+        except Exception as e:
+            print(f"⚠️  跳过标题三元组索引（需要pg_trgm扩展权限）: {e}")
+
+
+def add_message_history_index():
+    """为按会话读取消息添加 (conversation_id, created_at, id) 复合索引"""
+    db.session.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created_id "
+            "ON messages (conversation_id, created_at, id)"
+        )
+    )
+
+
+def add_message_token_count(batch_size=1000):
+    """为消息添加缓存的token数，并按主键分批回填历史消息"""
+    _add_column_if_missing("messages", "token_count", "INTEGER NOT NULL DEFAULT 0")
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text(
+                "SELECT id, content FROM messages "
+                "WHERE id > :last_id AND token_count = 0 ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": batch_size},
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            text("UPDATE messages SET token_count = :token_count WHERE id = :id"),
+            [{"id": row.id, "token_count": count_tokens(row.content)} for row in rows],
+        )
+        db.session.commit()
+        last_id = rows[-1].id
+
+
+def add_conversation_summary():
+    """为会话添加滚动摘要字段"""
+    _add_column_if_missing("conversations", "summary", "TEXT")
+    _add_column_if_missing("conversations", "summary_message_id", "INTEGER")
+    _add_column_if_missing(
+        "conversations", "summary_token_count", "INTEGER NOT NULL DEFAULT 0"
+    )
+
+
+def _rebuild_sqlite_messages_table():
+    """SQLite不支持修改外键约束，按官方建议的方式重建messages表"""
+    columns = _column_names("messages")
+    db.session.execute(text("DROP INDEX IF EXISTS ix_messages_conversation_created_id"))
+    db.session.execute(text("ALTER TABLE messages RENAME TO messages_old"))
+    Message.__table__.create(bind=db.session.connection())
+
+    copied = ", ".join(
+        column.name for column in Message.__table__.columns if column.name in columns
+    )
+    # 旧库未开启外键检查，可能残留所属会话已删除的消息，这些消息无法访问，不再复制
+    db.session.execute(
+        text(
+            f"INSERT INTO messages ({copied}) SELECT {copied} FROM messages_old "
+            "WHERE conversation_id IN (SELECT id FROM conversations)"
+        )
+    )
+    db.session.execute(text("DROP TABLE messages_old"))
+
+
+def cascade_message_deletes():
+    """将消息的外键改为 ON DELETE CASCADE，删除会话时由数据库删除其消息"""
+    foreign_keys = [
+        fk
+        for fk in inspect(db.engine).get_foreign_keys("messages")
+        if fk["referred_table"] == "conversations"
+    ]
+    if foreign_keys and all(
+        (fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE"
+        for fk in foreign_keys
+    ):
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        for fk in foreign_keys:
+            db.session.execute(
+                text(f'ALTER TABLE messages DROP CONSTRAINT "{fk["name"]}"')
+            )
+        db.session.execute(
+            text(
+                "ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey "
+                "FOREIGN KEY (conversation_id) REFERENCES conversations (id) "
+                "ON DELETE CASCADE"
+            )
+        )
+    elif dialect == "sqlite":
+        _rebuild_sqlite_messages_table()
+    else:
+        print(
+            f"⚠️  跳过外键修改（不支持的数据库: {dialect}），请手动添加 ON DELETE CASCADE"
+        )
+
+
+def add_conversation_archived_at():
+    """为会话添加归档时间"""
+    _add_column_if_missing("conversations", "archived_at", "TIMESTAMP")
+
+
+def add_message_search_index(batch_size=1000):
+    """为消息添加全文检索的分词结果并按主键分批回填，然后建立检索索引"""
+    _add_column_if_missing("messages", "search_tokens", "TEXT")
+
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        # 回填期间不经过触发器，回填后重建FTS索引
+        for name in ("insert", "delete", "update"):
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS messages_fts_{name}"))
+        db.session.execute(text("DROP TABLE IF EXISTS messages_fts"))
+
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            text(
+                "SELECT id, content FROM messages "
+                "WHERE id > :last_id AND search_tokens IS NULL ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": batch_size},
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            text("UPDATE messages SET search_tokens = :search_tokens WHERE id = :id"),
+            [
+                {"id": row.id, "search_tokens": search_tokens(row.content)}
+                for row in rows
+            ],
+        )
+        db.session.commit()
+        last_id = rows[-1].id
+
+    if dialect == "sqlite":
+        for statement in SQLITE_FTS_STATEMENTS:
+            db.session.execute(text(statement))
+        db.session.execute(
+            text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        )
+    elif dialect == "postgresql":
+        # 回填完成后再建索引，比逐行更新索引快得多
+        db.session.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEX_NAME} "
+                f"ON messages USING gin ({PG_SEARCH_VECTOR_SQL})"
+            )
+        )
+
+
+def add_conversation_messages_archived_at():
+    """为会话添加消息归档时间（见 archive.py）"""
+    _add_column_if_missing("conversations", "messages_archived_at", "TIMESTAMP")
+
+
+def partition_messages():
+    """PostgreSQL下把messages表转换为按月分区的表（见 partitions.py）"""
+    partition_messages_table()
+
+
+# 按顺序执行的迁移列表
+MIGRATIONS = [
+    ("0001_add_conversation_stats", add_conversation_stats),
+    ("0002_add_conversation_keyset_indexes", add_conversation_keyset_indexes),
+    ("0003_add_message_history_index", add_message_history_index),
+    ("0004_add_message_token_count", add_message_token_count),
+    ("0005_add_conversation_summary", add_conversation_summary),
+    ("0006_cascade_message_deletes", cascade_message_deletes),
+    ("0007_add_conversation_archived_at", add_conversation_archived_at),
+    ("0008_add_message_search_index", add_message_search_index),
+    (
+        "0009_add_conversation_messages_archived_at",
+        add_conversation_messages_archived_at,
+    ),
+    ("0010_partition_messages", partition_messages),
+]
+
+
+def run_migrations():
+    """执行所有尚未执行的迁移，需要在应用上下文中调用"""
+    db.session.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+        )
+    )
+    db.session.commit()
+
+    applied = set(
+        db.session.execute(text("SELECT name FROM schema_migrations")).scalars()
+    )
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"🔧 执行迁移: {name}")
+        try:
+            migration()
+            db.session.execute(
+                text(
+                    "INSERT INTO schema_migrations (name, applied_at) "
+                    "VALUES (:name, :applied_at)"
+                ),
+                {"name": name, "applied_at": datetime.utcnow()},
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def main():
+    """主函数"""
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            db.create_all()
+            run_migrations()
+            print("✅ 数据库迁移完成!")
+        except Exception as e:
+            print(f"❌ 数据库迁移失败: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
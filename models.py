@@ -1,14 +1,42 @@
+import weakref
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import DDL, bindparam, event, func, select, text
+from tokenizer import count_tokens
+from search_index import (
+    PG_SEARCH_INDEX_NAME,
+    PG_SEARCH_VECTOR_SQL,
+    SQLITE_FTS_STATEMENTS,
+    search_tokens,
+)
 
 db = SQLAlchemy()
 
 
+def _default_token_count(context):
+    """插入消息时计算并缓存其token数"""
+    return count_tokens(context.get_current_parameters()["content"])
+
+
+def _default_search_tokens(context):
+    """插入消息时生成全文检索用的分词结果，批量插入时同样生效"""
+    return search_tokens(context.get_current_parameters()["content"])
+
+
+# 会话列表中最后一条消息预览的最大长度
+MESSAGE_PREVIEW_LENGTH = 100
+
+
 class Conversation(db.Model):
     """会话模型"""
 
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 会话列表各排序方式的游标分页索引
+        db.Index("ix_conversations_updated_at_id", "updated_at", "id"),
+        db.Index("ix_conversations_created_at_id", "created_at", "id"),
+        db.Index("ix_conversations_title_id", "title", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False, default="新对话")
@@ -17,9 +45,31 @@ class Conversation(db.Model):
         db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
-    # 关联消息
+    # 冗余统计字段，随消息的插入和删除在同一事务中更新
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_message_at = db.Column(db.DateTime)
+    last_message_preview = db.Column(db.String(MESSAGE_PREVIEW_LENGTH))
+
+    # 滚动摘要：summary 概括了ID不超过 summary_message_id 的全部消息
+    summary = db.Column(db.Text)
+    summary_message_id = db.Column(db.Integer)
+    summary_token_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    # 归档时间，已归档的会话默认不出现在会话列表中
+    archived_at = db.Column(db.DateTime)
+    # 消息移入归档文件的时间（见 archive.py），统计字段保持不变，打开会话时自动恢复
+    messages_archived_at = db.Column(db.DateTime)
+
+    # 关联消息：删除会话时由数据库的 ON DELETE CASCADE 删除其消息，
+    # ORM不再把消息逐条加载到内存中删除
     messages = db.relationship(
-        "Message", backref="conversation", lazy=True, cascade="all, delete-orphan"
+        "Message",
+        backref="conversation",
+        lazy=True,
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     def to_dict(self):
@@ -29,7 +79,11 @@ class Conversation(db.Model):
             "title": self.title,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
-            "message_count": len(self.messages),
+            "message_count": self.message_count,
+            "last_message_at": (
+                self.last_message_at.isoformat() if self.last_message_at else None
+            ),
+            "last_message_preview": self.last_message_preview,
         }
 
 
@@ -37,14 +91,31 @@ class Message(db.Model):
     """消息模型"""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按会话读取消息（正序或倒序分页）的索引
+        db.Index(
+            "ix_messages_conversation_created_id", "conversation_id", "created_at", "id"
+        ),
+        # 全文检索索引，SQLite使用FTS5表（见下方的 after_create 事件）
+        db.Index(
+            PG_SEARCH_INDEX_NAME, text(PG_SEARCH_VECTOR_SQL), postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(
-        db.Integer, db.ForeignKey("conversations.id"), nullable=False
+        db.Integer,
+        db.ForeignKey("conversations.id", ondelete="CASCADE"),
+        nullable=False,
     )
     role = db.Column(db.String(20), nullable=False)  # 'user' 或 'assistant'
     content = db.Column(db.Text, nullable=False)
+    token_count = db.Column(
+        db.Integer, nullable=False, default=_default_token_count, server_default="0"
+    )
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 全文检索用的分词结果，见 search_index.py
+    search_tokens = db.Column(db.Text, default=_default_search_tokens)
 
     def to_dict(self):
         """转换为字典格式"""
@@ -55,3 +126,235 @@ class Message(db.Model):
             "content": self.content,
             "created_at": self.created_at.isoformat(),
         }
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        """
+        用一条多行INSERT批量插入消息，ID已存在的消息跳过
+
+        不构造ORM对象，也不触发 after_insert 事件，调用方需要随后对相关会话
+        调用 refresh_conversation_stats。
+
+        Args:
+            rows (list): 消息字典，包含 conversation_id、role、content，
+                可选 id、token_count、created_at；各行的键需要一致
+
+        Returns:
+            int: 实际插入的条数
+        """
+        if not rows:
+            return 0
+
+        values = []
+        for row in rows:
+            row = dict(row)
+            if row.get("token_count") is None:
+                row["token_count"] = count_tokens(row["content"])
+            if row.get("created_at") is None:
+                row["created_at"] = datetime.utcnow()
+            values.append(row)
+
+        stmt = (
+            conflict_insert(cls.__table__)
+            .values(values)
+            .on_conflict_do_nothing(index_elements=message_key_columns())
+        )
+        return db.session.execute(stmt).rowcount
+
+    @classmethod
+    def context_window(cls, conversation_id, token_budget, max_messages, after_id=None):
+        """
+        获取在token预算内的最近消息，用于构建提示词
+
+        从最新的消息开始倒序累加缓存的token数，直到超出预算或达到条数上限。
+        累加在数据库中通过窗口函数完成，只查询需要的列，不构造ORM对象。
+
+        Args:
+            conversation_id (int): 会话ID
+            token_budget (int): 历史消息可使用的token预算
+            max_messages (int): 最多返回的消息条数
+            after_id (int): 只考虑ID大于该值的消息（更早的消息已被摘要）
+
+        Returns:
+            list: 按时间正序排列的 [{"role": "...", "content": "..."}]
+        """
+        if token_budget <= 0 or max_messages <= 0:
+            return []
+
+        newest_first = (cls.created_at.desc(), cls.id.desc())
+        conditions = [cls.conversation_id == conversation_id]
+        if after_id is not None:
+            conditions.append(cls.id > after_id)
+
+        recent = (
+            select(
+                cls.role,
+                cls.content,
+                cls.created_at,
+                cls.id,
+                func.sum(cls.token_count)
+                .over(order_by=newest_first)
+                .label("running_tokens"),
+            )
+            .where(*conditions)
+            .order_by(*newest_first)
+            .limit(max_messages)
+            .subquery()
+        )
+        rows = db.session.execute(
+            select(recent.c.role, recent.c.content)
+            .where(recent.c.running_tokens <= token_budget)
+            .order_by(recent.c.created_at.asc(), recent.c.id.asc())
+        ).all()
+        return [{"role": role, "content": content} for role, content in rows]
+
+
+for _statement in SQLITE_FTS_STATEMENTS:
+    event.listen(
+        Message.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite")
+    )
+
+
+def conflict_insert(table):
+    """
+    返回支持 ON CONFLICT 子句的INSERT构造
+
+    用于保留ID的批量导入：PostgreSQL和SQLite的INSERT都提供
+    on_conflict_do_nothing / on_conflict_do_update。
+    """
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+# 引擎 -> messages表唯一键的列，见 message_key_columns
+_message_key_columns = weakref.WeakKeyDictionary()
+
+
+def message_key_columns():
+    """
+    返回messages表主键的列，用作 ON CONFLICT 的冲突目标
+
+    PostgreSQL按月分区后（见 partitions.py），主键必须包含分区键，
+    变为 (id, created_at)；其他情况下为 (id)。结果按引擎缓存。
+    """
+    engine = db.engine
+    columns = _message_key_columns.get(engine)
+    if columns is None:
+        columns = ["id"]
+        if engine.dialect.name == "postgresql":
+            partitioned = db.session.execute(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass('messages'))"
+                )
+            ).scalar()
+            if partitioned:
+                columns = ["id", "created_at"]
+        _message_key_columns[engine] = columns
+    return columns
+
+
+def clear_message_key_columns():
+    """表结构变化（分区迁移）后清除 message_key_columns 的缓存"""
+    _message_key_columns.clear()
+
+
+@event.listens_for(Message, "after_insert")
+def _increment_conversation_stats(mapper, connection, target):
+    """插入消息后更新会话的冗余统计字段"""
+    connection.execute(
+        Conversation.__table__.update()
+        .where(Conversation.__table__.c.id == target.conversation_id)
+        .values(
+            message_count=Conversation.__table__.c.message_count + 1,
+            last_message_at=target.created_at,
+            last_message_preview=target.content[:MESSAGE_PREVIEW_LENGTH],
+        )
+    )
+
+
+@event.listens_for(Message, "after_delete")
+def _decrement_conversation_stats(mapper, connection, target):
+    """删除消息后重新计算会话的冗余统计字段"""
+    refresh_conversation_stats([target.conversation_id], connection=connection)
+
+
+def increment_conversation_stats(messages):
+    """
+    批量插入消息（不经过ORM事件）后，按会话增量更新冗余统计字段
+
+    每个会话执行一次UPDATE，会话的 updated_at 随之更新（onupdate）。
+
+    Args:
+        messages (list): 新插入的消息字典，包含 conversation_id、content、created_at，
+            按时间顺序排列
+    """
+    added = {}
+    latest = {}
+    for message in messages:
+        conversation_id = message["conversation_id"]
+        added[conversation_id] = added.get(conversation_id, 0) + 1
+        latest[conversation_id] = message
+    if not added:
+        return
+
+    conversations = Conversation.__table__
+    stmt = (
+        conversations.update()
+        .where(conversations.c.id == bindparam("b_id"))
+        .values(
+            message_count=conversations.c.message_count + bindparam("b_added"),
+            last_message_at=bindparam("b_last_at"),
+            last_message_preview=bindparam("b_preview"),
+        )
+    )
+    db.session.execute(
+        stmt,
+        [
+            {
+                "b_id": conversation_id,
+                "b_added": count,
+                "b_last_at": latest[conversation_id]["created_at"],
+                "b_preview": latest[conversation_id]["content"][
+                    :MESSAGE_PREVIEW_LENGTH
+                ],
+            }
+            for conversation_id, count in added.items()
+        ],
+    )
+
+
+def refresh_conversation_stats(conversation_ids=None, connection=None):
+    """
+    根据messages表重新计算会话的冗余统计字段
+
+    Args:
+        conversation_ids (list): 需要刷新的会话ID，为None时刷新全部会话
+        connection: 使用的数据库连接，默认使用当前会话
+    """
+    conversations = Conversation.__table__
+    messages = Message.__table__
+    correlated = messages.c.conversation_id == conversations.c.id
+
+    stmt = conversations.update().values(
+        # 显式保留 updated_at，避免 onupdate 把回填当作会话更新
+        updated_at=conversations.c.updated_at,
+        message_count=select(func.count()).where(correlated).scalar_subquery(),
+        last_message_at=select(func.max(messages.c.created_at))
+        .where(correlated)
+        .scalar_subquery(),
+        last_message_preview=select(
+            func.substr(messages.c.content, 1, MESSAGE_PREVIEW_LENGTH)
+        )
+        .where(correlated)
+        .order_by(messages.c.created_at.desc(), messages.c.id.desc())
+        .limit(1)
+        .scalar_subquery(),
+    )
+    if conversation_ids is not None:
+        stmt = stmt.where(conversations.c.id.in_(list(conversation_ids)))
+
+    (connection or db.session).execute(stmt)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+会话和消息的NDJSON导出与导入
+
+导出文件每行一个JSON对象，第一行是 {"type": "meta", ...}，随后依次是全部
+会话（"type": "conversation"）和全部消息（"type": "message"），消息按会话和
+时间排序，已归档到文件的消息（见 archive.py）排在最后。会话排在消息之前，
+导入时总是先写入会话，不会违反外键约束。
+
+- 导出使用服务端游标（yield_per）逐批读取，内存占用与数据量无关；PostgreSQL上
+  所有查询在同一个 REPEATABLE READ 事务中执行，读取同一个快照，导出期间写入的
+  消息不会出现在未导出的会话下；
+- 导入按批用多行INSERT写入并保留原ID，已存在的消息跳过，已存在的会话只在导入的
+  更新时间更晚时更新，不会用旧备份覆盖较新的数据；每批提交后记录检查点，中断后
+  重新执行会从检查点继续；
+- 会话的冗余统计字段不导出，导入时按批重新计算。
+
+命令行用法:
+    python ndjson_io.py export backup.ndjson --since 2024-01-01
+    python ndjson_io.py import backup.ndjson --batch-size 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from sqlalchemy import select, text
+from models import (
+    db,
+    Conversation,
+    Message,
+    conflict_insert,
+    refresh_conversation_stats,
+)
+from serializers import dumps
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMAT_VERSION = 1
+
+CONVERSATION_EXPORT_FIELDS = (
+    "id",
+    "title",
+    "created_at",
+    "updated_at",
+    "archived_at",
+    "summary",
+    "summary_message_id",
+    "summary_token_count",
+)
+MESSAGE_EXPORT_FIELDS = (
+    "id",
+    "conversation_id",
+    "role",
+    "content",
+    "token_count",
+    "created_at",
+)
+
+# 导入时需要解析的时间字段
+_DATETIME_FIELDS = {"created_at", "updated_at", "archived_at"}
+
+# 导出时攒够该字节数再交给WSGI服务器发送，减少小块写入
+_EXPORT_BUFFER_BYTES = 64 * 1024
+
+
+def parse_time(value):
+    """
+    解析ISO格式的日期或时间，带时区的时间转换为UTC（数据库中保存的是UTC）
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _export_records(since=None, until=None, batch_size=1000):
+    """按导出顺序逐条生成记录字典"""
+    engine = db.engine
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            connection = connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            yield from _export_snapshot(connection, since, until, batch_size)
+
+
+def _export_snapshot(connection, since, until, batch_size):
+    """在同一个事务中查询并生成导出记录"""
+    conditions = []
+    if since is not None:
+        conditions.append(Conversation.updated_at >= since)
+    if until is not None:
+        conditions.append(Conversation.updated_at < until)
+
+    yield {
+        "type": "meta",
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.utcnow(),
+        "since": since,
+        "until": until,
+    }
+
+    conversations = connection.execute(
+        select(*[getattr(Conversation, name) for name in CONVERSATION_EXPORT_FIELDS])
+        .where(*conditions)
+        .order_by(Conversation.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in conversations:
+        yield {"type": "conversation", **dict(zip(CONVERSATION_EXPORT_FIELDS, row))}
+
+    messages = select(*[getattr(Message, name) for name in MESSAGE_EXPORT_FIELDS])
+    if conditions:
+        messages = messages.where(
+            Message.conversation_id.in_(select(Conversation.id).where(*conditions))
+        )
+    messages = connection.execute(
+        # 与会话消息索引的顺序一致
+        messages.order_by(
+            Message.conversation_id, Message.created_at, Message.id
+        ).execution_options(yield_per=batch_size)
+    )
+    for row in messages:
+        yield {"type": "message", **dict(zip(MESSAGE_EXPORT_FIELDS, row))}
+
+    # 消息已归档的会话从归档文件读取（archive.py 依赖本模块，在这里导入）
+    from archive import read_archive
+
+    archived = (
+        connection.execute(
+            select(Conversation.id)
+            .where(*conditions, Conversation.messages_archived_at.isnot(None))
+            .order_by(Conversation.id)
+        )
+        .scalars()
+        .all()
+    )
+    for conversation_id in archived:
+        try:
+            archived_messages = read_archive(conversation_id)
+        except FileNotFoundError:
+            # 导出期间会话可能刚被恢复，归档文件已删除，消息已回到数据库；
+            # 恢复晚于导出的快照，需要在快照之外读取
+            archived_messages = [
+                dict(zip(MESSAGE_EXPORT_FIELDS, row))
+                for row in db.session.execute(
+                    select(*[getattr(Message, name) for name in MESSAGE_EXPORT_FIELDS])
+                    .where(Message.conversation_id == conversation_id)
+                    .order_by(Message.created_at, Message.id)
+                )
+            ]
+            if not archived_messages:
+                logger.warning(f"会话 {conversation_id} 的归档文件不存在，跳过其消息")
+        except (OSError, ValueError) as e:
+            logger.error(f"读取会话 {conversation_id} 的归档文件失败，跳过其消息: {e}")
+            continue
+        for message in archived_messages:
+            yield {"type": "message", **message}
+
+
+def iter_export(since=None, until=None, batch_size=1000):
+    """
+    流式导出会话和消息，需要在应用上下文中调用
+
+    Args:
+        since (datetime): 只导出更新时间不早于该时间的会话及其消息
+        until (datetime): 只导出更新时间早于该时间的会话及其消息
+        batch_size (int): 服务端游标每次读取的行数
+
+    Yields:
+        bytes: 若干行NDJSON
+    """
+    buffer = []
+    size = 0
+    for record in _export_records(since, until, batch_size):
+        line = dumps(record) + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= _EXPORT_BUFFER_BYTES:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def parse_record(record, fields):
+    """取出导入需要的字段并解析时间"""
+    row = {}
+    for name in fields:
+        if name not in record:
+            continue
+        value = record[name]
+        if name in _DATETIME_FIELDS and value is not None:
+            value = parse_time(value)
+        row[name] = value
+    return row
+
+
+def _upsert_conversations(rows):
+    """批量写入会话，已存在的会话只在导入的更新时间更晚时用导入的数据更新"""
+    if not rows:
+        return
+    table = Conversation.__table__
+    stmt = conflict_insert(table).values(rows)
+    updated = {
+        name: stmt.excluded[name]
+        for name in CONVERSATION_EXPORT_FIELDS
+        if name != "id" and name in rows[0]
+    }
+    newer = None
+    if "updated_at" in rows[0]:
+        newer = stmt.excluded.updated_at > table.c.updated_at
+    db.session.execute(
+        stmt.on_conflict_do_update(index_elements=["id"], set_=updated, where=newer)
+    )
+
+
+def _read_checkpoint(checkpoint_path):
+    """返回检查点记录的已导入行号，没有检查点时返回0"""
+    try:
+        with open(checkpoint_path, encoding="utf-8") as f:
+            return int(json.load(f)["line"])
+    except FileNotFoundError:
+        return 0
+
+
+def _write_checkpoint(checkpoint_path, line_number):
+    """原子地更新检查点，进程在写入途中退出也不会留下损坏的文件"""
+    temporary = checkpoint_path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"line": line_number}, f)
+    os.replace(temporary, checkpoint_path)
+
+
+def reset_sequences():
+    """导入指定ID的数据后，把PostgreSQL的自增序列推进到当前最大ID之后"""
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in ("conversations", "messages"):
+        db.session.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}"
+            )
+        )
+    db.session.commit()
+
+
+def import_ndjson(path, batch_size=500, checkpoint_path=None, resume=True):
+    """
+    从NDJSON文件导入会话和消息，需要在应用上下文中调用
+
+    每批在一个事务中写入并刷新相关会话的统计字段，提交后更新检查点。
+    重复导入同一文件是安全的：已存在的消息被跳过，已存在的会话只在导入的
+    数据更新时更新。
+
+    Args:
+        path (str): NDJSON文件路径
+        batch_size (int): 每批写入的记录数
+        checkpoint_path (str): 检查点文件路径，默认为 <path>.checkpoint
+        resume (bool): 是否从检查点继续
+
+    Returns:
+        dict: 导入统计
+
+    Raises:
+        ValueError: 文件格式不正确
+    """
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    start_line = _read_checkpoint(checkpoint_path) if resume else 0
+    if start_line:
+        logger.info(f"从检查点继续导入: 跳过前 {start_line} 行")
+
+    stats = {"conversations": 0, "messages": 0, "skipped_messages": 0, "batches": 0}
+    conversations = []
+    messages = []
+
+    def flush(line_number):
+        if not conversations and not messages:
+            return
+        try:
+            _upsert_conversations(conversations)
+            inserted = Message.bulk_insert(messages)
+            conversation_ids = {row["id"] for row in conversations} | {
+                row["conversation_id"] for row in messages
+            }
+            refresh_conversation_stats(conversation_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        _write_checkpoint(checkpoint_path, line_number)
+
+        stats["conversations"] += len(conversations)
+        stats["messages"] += inserted
+        stats["skipped_messages"] += len(messages) - inserted
+        stats["batches"] += 1
+        conversations.clear()
+        messages.clear()
+
+    line_number = 0
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number <= start_line or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                record_type = record.get("type")
+            except (ValueError, AttributeError):
+                raise ValueError(f"第 {line_number} 行不是有效的JSON对象")
+
+            if record_type == "meta":
+                if record.get("version") != EXPORT_FORMAT_VERSION:
+                    raise ValueError(f"不支持的导出格式版本: {record.get('version')}")
+                continue
+            if record_type == "conversation":
+                conversations.append(parse_record(record, CONVERSATION_EXPORT_FIELDS))
+            elif record_type == "message":
+                messages.append(parse_record(record, MESSAGE_EXPORT_FIELDS))
+            else:
+                raise ValueError(f"第 {line_number} 行的记录类型未知: {record_type}")
+
+            if len(conversations) + len(messages) >= batch_size:
+                flush(line_number)
+
+    flush(line_number)
+    reset_sequences()
+    # 全部导入完成后删除检查点，再次导入同一文件时从头开始
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="会话和消息的NDJSON导出与导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出为NDJSON")
+    export_parser.add_argument("output", help="输出文件，- 表示标准输出")
+    export_parser.add_argument("--since", help="只导出更新时间不早于该时间的会话")
+    export_parser.add_argument("--until", help="只导出更新时间早于该时间的会话")
+
+    import_parser = subparsers.add_parser("import", help="从NDJSON导入")
+    import_parser.add_argument("input", help="NDJSON文件")
+    import_parser.add_argument("--batch-size", type=int, default=500)
+    import_parser.add_argument(
+        "--checkpoint", help="检查点文件，默认为 <input>.checkpoint"
+    )
+    import_parser.add_argument(
+        "--no-resume", action="store_true", help="忽略已有的检查点，从头导入"
+    )
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        try:
+            if args.command == "export":
+                since, until = parse_time(args.since), parse_time(args.until)
+                output = (
+                    sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+                )
+                try:
+                    for chunk in iter_export(since, until):
+                        output.write(chunk)
+                finally:
+                    if output is not sys.stdout.buffer:
+                        output.close()
+                print("✅ 导出完成!", file=sys.stderr)
+            else:
+                stats = import_ndjson(
+                    args.input,
+                    batch_size=args.batch_size,
+                    checkpoint_path=args.checkpoint,
+                    resume=not args.no_resume,
+                )
+                print(
+                    f"✅ 导入完成: 会话 {stats['conversations']} 个，"
+                    f"新增消息 {stats['messages']} 条，"
+                    f"跳过已存在的消息 {stats['skipped_messages']} 条"
+                )
+        except Exception as e:
+            print(f"❌ 操作失败: {e}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
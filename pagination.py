@@ -0,0 +1,104 @@
+"""
+游标（keyset）分页工具
+
+游标是排序键取值经过JSON编码后的base64字符串，对客户端不透明。
+与 OFFSET 分页不同，翻页时数据库只需沿索引从上一页的末尾继续扫描，
+查询耗时与已翻过的页数无关。
+"""
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+def encode_cursor(values):
+    """
+    将一行记录的排序键编码为游标
+
+    Args:
+        values (list): 排序键取值，datetime会被转换为ISO格式字符串
+
+    Returns:
+        str: 游标字符串
+    """
+    serializable = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    raw = json.dumps(serializable, ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, columns):
+    """
+    解析游标，按列类型还原排序键取值
+
+    Args:
+        cursor (str): 游标字符串
+        columns (list): 排序列，用于还原datetime类型
+
+    Returns:
+        list: 排序键取值
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("无效的分页游标")
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and column.type.python_type is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                # 被篡改的游标中时间可能不是字符串
+                raise ValueError("无效的分页游标")
+        decoded.append(value)
+    return decoded
+
+
+def keyset_paginate(query, columns, descending, cursor=None, limit=20):
+    """
+    对查询应用游标分页
+
+    排序列的最后一列必须唯一（通常是主键），保证翻页结果稳定。
+
+    Args:
+        query: SQLAlchemy查询对象
+        columns (list): 排序列
+        descending (bool): 是否降序
+        cursor (str): 上一页返回的游标，为None时从第一页开始
+        limit (int): 每页条数
+
+    Returns:
+        tuple: (本页记录列表, 下一页游标或None)
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    key = tuple_(*columns)
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        boundary = tuple_(*values)
+        query = query.filter(key < boundary if descending else key > boundary)
+
+    if descending:
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*[column.asc() for column in columns])
+
+    # 多取一条用于判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return rows, next_cursor
@@ -0,0 +1,249 @@
+"""
+PostgreSQL消息表的按月范围分区
+
+messages 按 created_at 分区，每月一个分区（messages_pYYYY_MM），另有默认分区
+messages_default 接收没有对应月份分区的消息（例如导入的很早以前的消息）。
+按会话读取消息的索引和全文检索索引建立在各个分区上，单个分区及其索引的大小
+随时间有界；会话的消息归档后（见 archive.py），旧月份的分区变空，直接删除即可，
+不需要对大表执行DELETE和VACUUM。
+
+分区表的唯一约束必须包含分区键，主键变为 (id, created_at)；ID仍由原来的序列生成。
+SQLite不分区，这里的函数在SQLite下不做任何事。
+"""
+
+import re
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db, clear_message_key_columns
+from search_index import PG_SEARCH_INDEX_NAME, PG_SEARCH_VECTOR_SQL
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "messages_default"
+_PARTITION_NAME = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+
+
+def _month_start(value):
+    """返回时间所在月份的第一天零点"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month, count):
+    """月份第一天加上若干个月"""
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    """返回月份对应的分区名"""
+    return f"messages_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned():
+    """messages 是否已经是分区表"""
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return db.session.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass('messages'))"
+        )
+    ).scalar()
+
+
+def list_partitions():
+    """
+    返回按月份排序的月份分区，不含默认分区
+
+    Returns:
+        list: [(月份第一天, 分区名)]
+    """
+    names = db.session.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('messages')"
+        )
+    ).scalars()
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append(
+                (datetime(int(match.group(1)), int(match.group(2)), 1), name)
+            )
+    return sorted(partitions)
+
+
+def _create_partition(month):
+    """创建一个月份分区，范围为 [本月第一天, 下月第一天)"""
+    db.session.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+            f"PARTITION OF messages FOR VALUES FROM ('{month.isoformat()}') "
+            f"TO ('{_add_months(month, 1).isoformat()}')"
+        )
+    )
+
+
+def ensure_partitions(months_ahead=None, now=None):
+    """
+    创建当前月份及之后 months_ahead 个月的分区
+
+    Args:
+        months_ahead (int): 提前创建的月数，默认使用 MESSAGE_PARTITION_MONTHS_AHEAD
+        now (datetime): 当前时间（UTC），默认为现在
+
+    Returns:
+        list: 新建的分区名
+    """
+    if not is_partitioned():
+        return []
+    if months_ahead is None:
+        months_ahead = Config.MESSAGE_PARTITION_MONTHS_AHEAD
+
+    existing = {name for _, name in list_partitions()}
+    month = _month_start(now or datetime.utcnow())
+    created = []
+    for offset in range(months_ahead + 1):
+        target = _add_months(month, offset)
+        if partition_name(target) in existing:
+            continue
+        try:
+            with db.session.begin_nested():
+                _create_partition(target)
+            created.append(partition_name(target))
+        except Exception as e:
+            # 默认分区中已有该月份的消息时无法创建，这些消息会一直留在默认分区
+            logger.warning(f"创建消息分区 {partition_name(target)} 失败: {str(e)}")
+    db.session.commit()
+    return created
+
+
+def drop_empty_partitions(before):
+    """
+    删除范围在 before 之前结束、并且已经没有消息的月份分区
+
+    每个分区在单独的事务中锁定、检查并删除。
+
+    Args:
+        before (datetime): 只删除结束时间不晚于该时间的分区
+
+    Returns:
+        list: 删除的分区名
+    """
+    if not is_partitioned():
+        return []
+
+    dropped = []
+    for month, name in list_partitions():
+        if _add_months(month, 1) > before:
+            break
+        # 先锁定分区再检查是否为空，检查之后恢复归档的消息不会写入即将删除的分区；
+        # 分区正在被其他事务使用时不等待，留到下次执行
+        try:
+            db.session.execute(
+                text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE NOWAIT")
+            )
+        except OperationalError:
+            db.session.rollback()
+            logger.info(f"消息分区 {name} 正在使用中，跳过删除")
+            continue
+        if db.session.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+            db.session.rollback()
+            continue
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        dropped.append(name)
+    db.session.commit()
+    return dropped
+
+
+def partition_messages_table(months_ahead=None):
+    """
+    把普通的messages表转换为按月分区的表并复制已有消息，由数据库迁移调用
+
+    在一个事务中完成，期间messages表被锁定；消息很多时请在维护窗口执行。
+    """
+    if db.engine.dialect.name != "postgresql" or is_partitioned():
+        return
+    if months_ahead is None:
+        months_ahead = Config.MESSAGE_PARTITION_MONTHS_AHEAD
+
+    sequence = db.session.execute(
+        text("SELECT pg_get_serial_sequence('messages', 'id')")
+    ).scalar()
+    oldest = db.session.execute(text("SELECT MIN(created_at) FROM messages")).scalar()
+
+    # 旧表连同其索引改名或删除，序列解除归属，删除旧表时不会被一并删除
+    if sequence:
+        db.session.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    db.session.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+    db.session.execute(
+        text(
+            "ALTER TABLE messages_unpartitioned "
+            "RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey"
+        )
+    )
+    db.session.execute(text("DROP INDEX IF EXISTS ix_messages_conversation_created_id"))
+    db.session.execute(text(f"DROP INDEX IF EXISTS {PG_SEARCH_INDEX_NAME}"))
+    db.session.execute(
+        text(
+            "UPDATE messages_unpartitioned SET created_at = now() AT TIME ZONE 'utc' "
+            "WHERE created_at IS NULL"
+        )
+    )
+
+    # LIKE 复制列、非空约束和默认值（包括ID序列）
+    db.session.execute(
+        text(
+            "CREATE TABLE messages (LIKE messages_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        )
+    )
+    db.session.execute(
+        text("ALTER TABLE messages ALTER COLUMN created_at SET NOT NULL")
+    )
+    db.session.execute(text("ALTER TABLE messages ADD PRIMARY KEY (id, created_at)"))
+    db.session.execute(
+        text(
+            "ALTER TABLE messages ADD CONSTRAINT messages_conversation_id_fkey "
+            "FOREIGN KEY (conversation_id) REFERENCES conversations (id) "
+            "ON DELETE CASCADE"
+        )
+    )
+
+    current = _month_start(datetime.utcnow())
+    month = _month_start(oldest) if oldest is not None else current
+    month = min(month, current)
+    while month <= _add_months(current, months_ahead):
+        _create_partition(month)
+        month = _add_months(month, 1)
+    db.session.execute(
+        text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF messages DEFAULT")
+    )
+
+    db.session.execute(
+        text("INSERT INTO messages SELECT * FROM messages_unpartitioned")
+    )
+    db.session.execute(text("DROP TABLE messages_unpartitioned"))
+    if sequence:
+        db.session.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY messages.id"))
+
+    # 在分区表上建立的索引会自动建立在每个分区上
+    db.session.execute(
+        text(
+            "CREATE INDEX ix_messages_conversation_created_id "
+            "ON messages (conversation_id, created_at, id)"
+        )
+    )
+    db.session.execute(
+        text(
+            f"CREATE INDEX {PG_SEARCH_INDEX_NAME} "
+            f"ON messages USING gin ({PG_SEARCH_VECTOR_SQL})"
+        )
+    )
+    clear_message_key_columns()
@@ -0,0 +1,400 @@
+"""
+会话消息的读穿透缓存
+
+每个会话缓存最近的一段消息（窗口，最多 READ_CACHE_WINDOW_MESSAGES 条），用于：
+- 会话详情：窗口包含会话的全部消息时直接返回；
+- 消息分页：窗口包含客户端游标之后的全部消息时直接返回；
+- 对话历史：构建提示词时在窗口中按token预算从新到旧选取消息。
+
+缓存分两级：进程内LRU（按条目数和字节数淘汰），以及可选的共享后端。共享后端
+redis 由多个工作进程共用；local 是它的进程内替身，同样保存序列化后的数据，
+用于测试和没有Redis的开发环境。共享后端出错时按未命中处理，不影响请求。
+
+窗口记录生成时会话的 (message_count, last_message_at)，读取时与请求中已经查询到的
+会话行比较，不一致就视为未命中并重新加载，其他进程写入的消息不会被遗漏。
+本进程写入消息后把消息追加到窗口并同步更新版本，正在聊天的会话不再查询历史消息；
+删除会话时删除其窗口。会话行本身不缓存，它是校验窗口和生成ETag的依据。
+"""
+
+import json
+import threading
+from datetime import datetime
+from cache import LRUCache
+from models import db, Message
+from serializers import MESSAGE_FIELDS, dumps
+from tokenizer import count_tokens
+from metrics import READ_CACHE_BYTES, READ_CACHE_ENTRIES, READ_CACHE_REQUESTS
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# 窗口中每条消息保存的字段，比API输出多了构建提示词需要的token数
+WINDOW_FIELDS = MESSAGE_FIELDS + ("token_count",)
+WINDOW_COLUMNS = tuple(getattr(Message, name) for name in WINDOW_FIELDS)
+
+
+def _iso(value):
+    """时间统一保存为ISO字符串，两级缓存中的窗口格式相同"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _version(conversation):
+    """窗口对应的会话版本"""
+    return [conversation.message_count, _iso(conversation.last_message_at)]
+
+
+def _window_entry(message):
+    """把消息字典转换为窗口中的条目，缺少token数时重新计算"""
+    entry = {name: message.get(name) for name in WINDOW_FIELDS}
+    entry["created_at"] = _iso(entry["created_at"])
+    if entry["token_count"] is None:
+        entry["token_count"] = count_tokens(entry["content"])
+    return entry
+
+
+def _public(entries):
+    """窗口条目转换为API输出的消息字典"""
+    return [{name: entry[name] for name in MESSAGE_FIELDS} for entry in entries]
+
+
+class RedisBackend:
+    """Redis共享后端"""
+
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise RuntimeError("未安装redis，无法使用Redis缓存后端")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, data):
+        self.client.set(key, data, ex=self.ttl)
+
+    def delete(self, keys):
+        self.client.delete(*keys)
+
+
+class LocalBackend:
+    """共享后端的进程内替身，与Redis一样保存序列化后的字节"""
+
+    def __init__(self, ttl, max_bytes=None):
+        self.cache = LRUCache(max_entries=100000, max_bytes=max_bytes, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, data):
+        self.cache.set(key, data, size=len(data))
+
+    def delete(self, keys):
+        for key in keys:
+            self.cache.delete(key)
+
+
+class ReadCache:
+    """会话消息窗口的两级读穿透缓存"""
+
+    def __init__(self, local=None, shared=None, window_size=None):
+        """
+        初始化缓存
+
+        Args:
+            local (LRUCache): 进程内缓存，为None时不缓存，全部读取数据库
+            shared: 共享后端（RedisBackend 或 LocalBackend），可选
+            window_size (int): 每个会话最多缓存的消息数
+        """
+        self.local = local
+        self.shared = shared
+        self.window_size = window_size or Config.READ_CACHE_WINDOW_MESSAGES
+        # 同一进程内的追加依次进行，不会互相覆盖
+        self._lock = threading.Lock()
+
+        if local is not None:
+            READ_CACHE_ENTRIES.set_function(lambda: len(local))
+            READ_CACHE_BYTES.set_function(lambda: local.size_bytes)
+
+    @classmethod
+    def from_config(cls):
+        """根据配置创建缓存"""
+        if not Config.READ_CACHE_ENABLED:
+            return cls()
+
+        local = LRUCache(
+            max_entries=Config.READ_CACHE_MAX_ENTRIES,
+            max_bytes=Config.READ_CACHE_MAX_BYTES,
+            ttl=Config.READ_CACHE_TTL_SECONDS,
+        )
+        shared = None
+        backend = Config.READ_CACHE_BACKEND
+        try:
+            if backend == "redis":
+                shared = RedisBackend(
+                    Config.READ_CACHE_REDIS_URL, Config.READ_CACHE_TTL_SECONDS
+                )
+            elif backend == "local":
+                shared = LocalBackend(
+                    Config.READ_CACHE_TTL_SECONDS, Config.READ_CACHE_MAX_BYTES
+                )
+        except Exception as e:
+            logger.warning(f"共享缓存后端初始化失败，仅使用进程内缓存: {e}")
+        return cls(local, shared)
+
+    @property
+    def enabled(self):
+        return self.local is not None
+
+    @staticmethod
+    def _key(conversation_id):
+        return f"chat:window:{conversation_id}"
+
+    def _shared_get(self, key):
+        if self.shared is None:
+            return None
+        try:
+            data = self.shared.get(key)
+        except Exception as e:
+            logger.warning(f"读取共享缓存失败: {str(e)}")
+            return None
+        return json.loads(data) if data else None
+
+    def _store(self, conversation_id, window):
+        if not self.enabled:
+            return
+        key = self._key(conversation_id)
+        self.local.set(key, window)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, dumps(window))
+            except Exception as e:
+                logger.warning(f"写入共享缓存失败: {str(e)}")
+
+    def get_window(self, conversation, operation):
+        """
+        返回与会话当前版本一致的窗口
+
+        Args:
+            conversation: 会话行或对象，需要 id、message_count、last_message_at
+            operation (str): 读取用途，用于命中率统计
+
+        Returns:
+            dict: {"version", "complete", "messages"}，未命中时为None
+        """
+        if not self.enabled:
+            return None
+        key = self._key(conversation.id)
+        version = _version(conversation)
+
+        window = self.local.get(key)
+        if window is not None and window["version"] == version:
+            READ_CACHE_REQUESTS.inc(operation=operation, result="hit_local")
+            return window
+
+        # 本进程的窗口缺失或已过期时，共享后端中可能有其他进程更新过的窗口
+        window = self._shared_get(key)
+        if window is not None and window["version"] == version:
+            self.local.set(key, window)
+            READ_CACHE_REQUESTS.inc(operation=operation, result="hit_shared")
+            return window
+
+        READ_CACHE_REQUESTS.inc(operation=operation, result="miss")
+        return None
+
+    def _make_window(self, conversation, entries, complete):
+        """生成窗口并缓存，超过窗口大小时只保留最新的消息"""
+        if len(entries) > self.window_size:
+            entries = entries[-self.window_size :]
+            complete = False
+        window = {
+            "version": _version(conversation),
+            "complete": complete,
+            "messages": entries,
+        }
+        self._store(conversation.id, window)
+        return window
+
+    def _load_recent(self, conversation):
+        """从数据库加载会话最新的消息作为窗口"""
+        rows = (
+            db.session.query(*WINDOW_COLUMNS)
+            .filter(Message.conversation_id == conversation.id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(self.window_size + 1)
+            .all()
+        )
+        entries = [_window_entry(dict(zip(WINDOW_FIELDS, row))) for row in rows]
+        entries.reverse()
+        return self._make_window(
+            conversation, entries, complete=len(entries) <= self.window_size
+        )
+
+    def conversation_messages(self, conversation):
+        """
+        返回会话的全部消息（按时间正序），用于会话详情
+
+        窗口不完整时查询全部消息，并缓存其中最新的部分。
+        """
+        window = self.get_window(conversation, "detail")
+        if window is not None and window["complete"]:
+            return _public(window["messages"])
+
+        rows = (
+            db.session.query(*WINDOW_COLUMNS)
+            .filter(Message.conversation_id == conversation.id)
+            .order_by(Message.created_at.asc(), Message.id.asc())
+            .all()
+        )
+        entries = [_window_entry(dict(zip(WINDOW_FIELDS, row))) for row in rows]
+        if self.enabled:
+            self._make_window(conversation, entries, complete=True)
+        return _public(entries)
+
+    def messages_after(self, conversation, after_id, limit):
+        """
+        从窗口中返回游标之后的一页消息
+
+        Args:
+            conversation: 会话行或对象
+            after_id (int): 客户端已有的最后一条消息ID，为None时从第一条开始
+            limit (int): 每页条数
+
+        Returns:
+            tuple: (消息列表, 是否还有下一页)；窗口无法回答时为None，由调用方查询数据库
+        """
+        if not self.enabled:
+            return None
+        window = self.get_window(conversation, "messages") or self._load_recent(
+            conversation
+        )
+        entries = window["messages"]
+        if after_id is None:
+            if not window["complete"]:
+                return None
+            start = 0
+        else:
+            start = next(
+                (i + 1 for i, entry in enumerate(entries) if entry["id"] == after_id),
+                None,
+            )
+            if start is None:
+                return None
+        return _public(entries[start : start + limit]), len(entries) > start + limit
+
+    def context_window(self, conversation, token_budget, max_messages, after_id=None):
+        """
+        在token预算内选取最近的消息，结果与 Message.context_window 相同
+
+        窗口中的消息不足以确定结果时（窗口不完整且预算和条数都没有用完），
+        改为由数据库计算。
+
+        Returns:
+            list: 按时间正序排列的 [{"role": "...", "content": "..."}]
+        """
+        if not self.enabled:
+            return Message.context_window(
+                conversation.id, token_budget, max_messages, after_id=after_id
+            )
+        if token_budget <= 0 or max_messages <= 0:
+            return []
+
+        window = self.get_window(conversation, "history") or self._load_recent(
+            conversation
+        )
+        entries = window["messages"]
+        selected = []
+        tokens = 0
+        # 窗口完整，或窗口最早的消息已被摘要（更早的消息同样被摘要）时，窗口足够
+        sufficient = window["complete"] or (
+            after_id is not None and entries and entries[0]["id"] <= after_id
+        )
+        for entry in reversed(entries):
+            if after_id is not None and entry["id"] <= after_id:
+                continue
+            if len(selected) == max_messages:
+                sufficient = True
+                break
+            tokens += entry["token_count"]
+            if tokens > token_budget:
+                sufficient = True
+                break
+            selected.append(entry)
+
+        if not sufficient:
+            return Message.context_window(
+                conversation.id, token_budget, max_messages, after_id=after_id
+            )
+        return [
+            {"role": entry["role"], "content": entry["content"]}
+            for entry in reversed(selected)
+        ]
+
+    def append_messages(self, conversation_id, messages):
+        """
+        消息写入数据库后追加到会话的窗口，会话没有缓存窗口时不做任何事
+
+        版本按写入后的会话统计更新：消息数加上实际追加的条数（窗口中已有的消息
+        不计入），最后消息时间为最后一条追加消息的时间，与插入消息时更新会话统计
+        的方式一致。
+
+        Args:
+            conversation_id (int): 会话ID
+            messages (list): 消息字典，包含 id、conversation_id、role、content、
+                created_at，可选 token_count，按写入顺序排列
+        """
+        if not self.enabled or not messages:
+            return
+        key = self._key(conversation_id)
+        with self._lock:
+            window = self.local.get(key) or self._shared_get(key)
+            if window is None:
+                return
+
+            # 窗口可能是在消息提交后加载的，已经包含这些消息，版本也已经是最新的；
+            # 版本只加上实际追加的条数，否则会超过数据库中的消息数，窗口再也无法命中
+            existing = {entry["id"] for entry in window["messages"]}
+            appended = [_window_entry(m) for m in messages if m["id"] not in existing]
+            if not appended:
+                return
+            entries = window["messages"] + appended
+            entries.sort(key=lambda entry: (entry["created_at"], entry["id"]))
+            count, _ = window["version"]
+            complete = window["complete"]
+            if len(entries) > self.window_size:
+                entries = entries[-self.window_size :]
+                complete = False
+            self._store(
+                conversation_id,
+                {
+                    "version": [
+                        count + len(appended),
+                        appended[-1]["created_at"],
+                    ],
+                    "complete": complete,
+                    "messages": entries,
+                },
+            )
+
+    def invalidate(self, conversation_ids):
+        """删除会话的窗口"""
+        if not self.enabled:
+            return
+        keys = [self._key(conversation_id) for conversation_id in conversation_ids]
+        for key in keys:
+            self.local.delete(key)
+        if self.shared is not None and keys:
+            try:
+                self.shared.delete(keys)
+            except Exception as e:
+                logger.warning(f"删除共享缓存失败: {str(e)}")
+
+
+# 每个进程一个实例；Redis客户端在第一次使用时才建立连接，fork后各自重新连接
+read_cache = ReadCache.from_config()
@@ -0,0 +1,249 @@
+"""
+大模型回复缓存
+
+两级缓存：
+1. 精确匹配：以规范化后的（系统提示词、摘要、历史窗口、用户消息、模型参数）
+   的哈希为键，命中即直接返回。
+2. 语义匹配（可选）：只用于没有历史的单轮提问。用本地向量化模型把用户消息
+   转成向量，与已缓存的提问做余弦相似度比较，超过阈值即视为同一问题。
+   只在系统提示词和模型参数（模型、temperature、max_tokens等）都相同的
+   命名空间内比较，修改配置后不会返回旧配置下生成的回复。
+两级缓存的条目都在 RESPONSE_CACHE_TTL_SECONDS 后过期，各级的命中和未命中次数
+见 /metrics 中的 llm_response_cache_requests_total。
+
+默认的向量化方式是字符n-gram哈希，不依赖任何模型文件；配置
+RESPONSE_CACHE_EMBEDDING_MODEL 后改用 sentence-transformers 模型。
+"""
+
+import hashlib
+import json
+import math
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from cache import LRUCache
+from metrics import LLM_RESPONSE_CACHE_REQUESTS
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """规范化文本：统一全角/半角字符，合并空白字符并统一大小写"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split()).lower()
+
+
+class HashingEmbedder:
+    """基于字符n-gram哈希的轻量向量化，适合中文的近似重复检测"""
+
+    def __init__(self, dimensions=4096, ngram_sizes=(1, 2, 3)):
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    def embed(self, text):
+        """返回L2归一化的稀疏向量 {维度: 权重}"""
+        text = normalize_text(text).replace(" ", "")
+        vector = {}
+        for n in self.ngram_sizes:
+            for i in range(len(text) - n + 1):
+                digest = hashlib.md5(text[i : i + n].encode("utf-8")).digest()
+                index = int.from_bytes(digest[:4], "little") % self.dimensions
+                vector[index] = vector.get(index, 0.0) + 1.0
+
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return {}
+        return {index: weight / norm for index, weight in vector.items()}
+
+    @staticmethod
+    def similarity(a, b):
+        """两个归一化稀疏向量的余弦相似度"""
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+
+class SentenceTransformerEmbedder:
+    """使用本地 sentence-transformers 模型向量化"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def embed(self, text):
+        return self.model.encode(normalize_text(text), normalize_embeddings=True)
+
+    @staticmethod
+    def similarity(a, b):
+        return float((a * b).sum())
+
+
+class SemanticCache:
+    """单轮提问的语义相似度缓存"""
+
+    def __init__(self, embedder, threshold, max_entries, ttl=None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 精确缓存键 -> (命名空间, 向量, 回复, 过期时间)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, namespace):
+        """查找同一命名空间中与提问最相似、超过阈值且未过期的缓存回复"""
+        vector = self.embedder.embed(text)
+        best_key, best_score = None, self.threshold
+
+        # 在快照上比较相似度，逐条计算期间不持有锁，不阻塞其他请求的查找和写入
+        with self._lock:
+            snapshot = list(self._entries.items())
+
+        now = time.monotonic()
+        expired = []
+        for key, (cached_namespace, cached_vector, _, expires_at) in snapshot:
+            if expires_at is not None and expires_at <= now:
+                expired.append(key)
+                continue
+            if cached_namespace != namespace:
+                continue
+            score = self.embedder.similarity(vector, cached_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        with self._lock:
+            for key in expired:
+                entry = self._entries.get(key)
+                # 比较期间可能已被重新写入，只删除仍然过期的条目
+                if entry is not None and entry[3] is not None and entry[3] <= now:
+                    del self._entries[key]
+
+            entry = self._entries.get(best_key) if best_key is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, text, response, namespace):
+        """缓存单轮提问的回复"""
+        vector = self.embedder.embed(text)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (namespace, vector, response, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ResponseCache:
+    """精确匹配加可选语义匹配的两级回复缓存"""
+
+    def __init__(self, exact_cache, semantic_cache=None):
+        self.exact = exact_cache
+        self.semantic = semantic_cache
+
+    @classmethod
+    def from_config(cls):
+        """根据配置创建回复缓存"""
+        exact = LRUCache(
+            max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+            ttl=Config.RESPONSE_CACHE_TTL_SECONDS,
+        )
+
+        semantic = None
+        if Config.RESPONSE_CACHE_SEMANTIC_ENABLED:
+            try:
+                if Config.RESPONSE_CACHE_EMBEDDING_MODEL:
+                    embedder = SentenceTransformerEmbedder(
+                        Config.RESPONSE_CACHE_EMBEDDING_MODEL
+                    )
+                else:
+                    embedder = HashingEmbedder()
+                semantic = SemanticCache(
+                    embedder,
+                    threshold=Config.RESPONSE_CACHE_SEMANTIC_THRESHOLD,
+                    max_entries=Config.RESPONSE_CACHE_SEMANTIC_MAX_ENTRIES,
+                    ttl=Config.RESPONSE_CACHE_TTL_SECONDS,
+                )
+            except Exception as e:
+                logger.warning(f"语义缓存初始化失败，仅使用精确匹配缓存: {e}")
+
+        return cls(exact, semantic)
+
+    @staticmethod
+    def make_namespace(system_prompt, model_params):
+        """由系统提示词和模型参数生成语义缓存的命名空间"""
+        payload = {"system": normalize_text(system_prompt), "params": model_params}
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(system_prompt, summary, history, user_message, model_params):
+        """由规范化后的提示词和模型参数生成缓存键"""
+        payload = {
+            "system": normalize_text(system_prompt),
+            "summary": normalize_text(summary),
+            "history": [
+                [msg["role"], normalize_text(msg["content"])] for msg in history or []
+            ],
+            "user": normalize_text(user_message),
+            "params": model_params,
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key, user_message, single_turn, namespace):
+        """
+        查找缓存的回复
+
+        Args:
+            key (str): make_key 生成的缓存键
+            user_message (str): 用户消息，用于语义匹配
+            single_turn (bool): 是否为没有历史和摘要的单轮提问
+            namespace (str): make_namespace 生成的语义缓存命名空间
+
+        Returns:
+            str: 缓存的回复，未命中时为None
+        """
+        response = self.exact.get(key)
+        LLM_RESPONSE_CACHE_REQUESTS.inc(
+            tier="exact", result="miss" if response is None else "hit"
+        )
+        if response is None and single_turn and self.semantic is not None:
+            response = self.semantic.get(user_message, namespace)
+            LLM_RESPONSE_CACHE_REQUESTS.inc(
+                tier="semantic", result="miss" if response is None else "hit"
+            )
+        return response
+
+    def set(self, key, user_message, single_turn, namespace, response):
+        """缓存回复"""
+        self.exact.set(key, response)
+        if single_turn and self.semantic is not None:
+            self.semantic.set(key, user_message, response, namespace)
+
+    def stats(self):
+        """返回各级缓存的命中统计"""
+        return {
+            "exact": self.exact.stats(),
+            "semantic": self.semantic.stats() if self.semantic else None,
+        }
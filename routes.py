@@ -1,32 +1,226 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, Response, abort, stream_with_context
 from models import db, Conversation, Message
-from llm_service import DeepSeekService
+from llm_service import get_llm_service
+from pagination import keyset_paginate
+from read_cache import read_cache
+from serializers import (
+    CONVERSATION_COLUMNS,
+    CONVERSATION_FIELDS,
+    MESSAGE_COLUMNS,
+    MESSAGE_FIELDS,
+    dumps,
+    json_response,
+    row_to_dict,
+    rows_to_dicts,
+)
+from compression import compress_response
+from archive import remove_archives, restore_conversation
+from ndjson_io import iter_export, parse_time
+from search import find_highlights, search_messages
+from search_index import highlight_needles
+from summarizer import maybe_schedule_summary
+from title_worker import TitleWorker, placeholder_title
+from write_behind import MessageWriter
+from metrics import (
+    CHAT_REQUEST_SECONDS,
+    DB_COMMIT_SECONDS,
+    DB_READ_SECONDS,
+    SEARCH_SECONDS,
+)
+from config import Config
+from sqlalchemy import delete, tuple_
 from datetime import datetime
+import time
+import zlib
 import logging
 
 logger = logging.getLogger(__name__)
 
 # 创建蓝图
 api_bp = Blueprint("api", __name__, url_prefix="/api")
+api_bp.after_request(compress_response)
 
-# 初始化DeepSeek服务
-llm_service = DeepSeekService()
+# 后台标题生成（大模型服务由 app.create_app 注册，首次使用时创建）
+title_worker = TitleWorker()
+
+# AI回复的延迟写入
+message_writer = MessageWriter()
+
+
+# 会话列表支持的排序方式：排序列（最后一列为唯一的主键）和是否降序
+CONVERSATION_SORTS = {
+    "updated_desc": ([Conversation.updated_at, Conversation.id], True),
+    "created_desc": ([Conversation.created_at, Conversation.id], True),
+    "title_asc": ([Conversation.title, Conversation.id], False),
+}
+
+
+# 批量操作支持的动作
+BULK_ACTIONS = ("delete", "archive", "unarchive")
+
+
+def _escape_like(value):
+    """转义LIKE模式中的通配符"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _page_size(default):
+    """从查询参数读取每页条数，并限制在允许范围内"""
+    limit = request.args.get("limit", default, type=int)
+    return max(1, min(limit, Config.MAX_PAGE_SIZE))
+
+
+def _conversation_etag(conversation, pending=()):
+    """
+    由更新时间、消息数和标题生成会话的弱ETag，会话或其消息变化时随之变化
+
+    后台生成标题时不改变会话的更新时间，标题单独计入。
+    尚未写入数据库的消息也计入，写入完成后ETag随之变化。
+    """
+    updated_at = conversation.updated_at.isoformat() if conversation.updated_at else ""
+    title = zlib.crc32((conversation.title or "").encode("utf-8"))
+    etag = f"{conversation.id}-{updated_at}-{conversation.message_count}-{title:x}"
+    if pending:
+        etag += f"-p{len(pending)}"
+    return etag
+
+
+def _merge_pending(messages, pending):
+    """在消息列表末尾追加尚未写入数据库的消息，已查询到的消息不重复追加"""
+    existing = {message["id"] for message in messages}
+    for message in pending:
+        data = message.to_dict()
+        if data["id"] is None or data["id"] not in existing:
+            messages.append(data)
+    return messages
+
+
+def _get_conversation_row(conversation_id):
+    """
+    只查询序列化需要的列获取会话，不存在时返回404
+
+    会话的消息已归档时先从归档文件恢复，恢复不改变会话的更新时间和消息数。
+    """
+    conversation = (
+        db.session.query(*CONVERSATION_COLUMNS, Conversation.messages_archived_at)
+        .filter(Conversation.id == conversation_id)
+        .first()
+    )
+    if conversation is None:
+        abort(404)
+    if conversation.messages_archived_at is not None:
+        restore_conversation(conversation_id)
+    return conversation
+
+
+def _message_rows(query, limit=None):
+    """按时间正序查询消息的序列化列"""
+    query = query.order_by(Message.created_at.asc(), Message.id.asc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _query_messages_after(conversation_id, after_id, limit):
+    """
+    从数据库查询游标消息之后的一页消息
+
+    Returns:
+        tuple: (消息字典列表, 是否还有下一页)
+    """
+    query = db.session.query(*MESSAGE_COLUMNS).filter(
+        Message.conversation_id == conversation_id
+    )
+    if after_id is not None:
+        # 按 (created_at, id) 从游标消息之后继续，走会话消息索引
+        anchor_created_at = (
+            db.session.query(Message.created_at)
+            .filter(Message.id == after_id, Message.conversation_id == conversation_id)
+            .scalar_subquery()
+        )
+        query = query.filter(
+            tuple_(Message.created_at, Message.id) > tuple_(anchor_created_at, after_id)
+        )
+
+    # 多取一条用于判断是否还有下一页
+    messages = _message_rows(query, limit=limit + 1)
+    return rows_to_dicts(messages[:limit], MESSAGE_FIELDS), len(messages) > limit
+
+
+def _not_modified(etag):
+    """客户端缓存的ETag仍然有效时返回304响应，否则返回None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _with_etag(response, etag):
+    """为响应附加弱ETag，要求客户端每次使用前重新验证"""
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @api_bp.route("/conversations", methods=["GET"])
 def get_conversations():
-    """获取所有会话列表"""
+    """
+    分页获取会话列表
+
+    查询参数:
+        sort: 排序方式，updated_desc（默认）/ created_desc / title_asc
+        q: 按标题搜索的关键词
+        archived: 为 true 时只列出已归档的会话，默认只列出未归档的会话
+        cursor: 上一页返回的 next_cursor
+        limit: 每页条数
+    """
     try:
-        conversations = Conversation.query.order_by(
-            Conversation.updated_at.desc()
-        ).all()
-        return jsonify(
-            {"success": True, "data": [conv.to_dict() for conv in conversations]}
+        sort = request.args.get("sort", "updated_desc")
+        if sort not in CONVERSATION_SORTS:
+            return (
+                json_response(
+                    {"success": False, "message": f"不支持的排序方式: {sort}"}
+                ),
+                400,
+            )
+        columns, descending = CONVERSATION_SORTS[sort]
+
+        query = db.session.query(*CONVERSATION_COLUMNS)
+        if request.args.get("archived", "false").lower() == "true":
+            query = query.filter(Conversation.archived_at.isnot(None))
+        else:
+            query = query.filter(Conversation.archived_at.is_(None))
+
+        search = request.args.get("q", "").strip()
+        if search:
+            query = query.filter(
+                Conversation.title.ilike(f"%{_escape_like(search)}%", escape="\\")
+            )
+
+        try:
+            conversations, next_cursor = keyset_paginate(
+                query,
+                columns,
+                descending,
+                cursor=request.args.get("cursor"),
+                limit=_page_size(Config.CONVERSATION_PAGE_SIZE),
+            )
+        except ValueError as e:
+            return json_response({"success": False, "message": str(e)}), 400
+
+        return json_response(
+            {
+                "success": True,
+                "data": rows_to_dicts(conversations, CONVERSATION_FIELDS),
+                "next_cursor": next_cursor,
+            }
         )
     except Exception as e:
         logger.error(f"获取会话列表失败: {str(e)}")
         return (
-            jsonify({"success": False, "message": f"获取会话列表失败: {str(e)}"}),
+            json_response({"success": False, "message": f"获取会话列表失败: {str(e)}"}),
             500,
         )
 
@@ -39,135 +233,572 @@ def create_conversation():
         db.session.add(conversation)
         db.session.commit()
 
-        return jsonify({"success": True, "data": conversation.to_dict()})
+        return json_response({"success": True, "data": conversation.to_dict()})
     except Exception as e:
         logger.error(f"创建会话失败: {str(e)}")
-        return jsonify({"success": False, "message": f"创建会话失败: {str(e)}"}), 500
+        return (
+            json_response({"success": False, "message": f"创建会话失败: {str(e)}"}),
+            500,
+        )
 
 
 @api_bp.route("/conversations/<int:conversation_id>", methods=["GET"])
 def get_conversation(conversation_id):
     """获取指定会话的详细信息"""
     try:
-        conversation = Conversation.query.get_or_404(conversation_id)
-        messages = (
-            Message.query.filter_by(conversation_id=conversation_id)
-            .order_by(Message.created_at.asc())
-            .all()
-        )
+        pending = message_writer.pending_messages(conversation_id)
+        conversation = _get_conversation_row(conversation_id)
+        etag = _conversation_etag(conversation, pending)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
 
-        return jsonify(
+        # 正在聊天的会话直接从消息窗口缓存返回
+        messages = read_cache.conversation_messages(conversation)
+
+        response = json_response(
             {
                 "success": True,
                 "data": {
-                    "conversation": conversation.to_dict(),
-                    "messages": [msg.to_dict() for msg in messages],
+                    "conversation": row_to_dict(conversation, CONVERSATION_FIELDS),
+                    "messages": _merge_pending(messages, pending),
                 },
             }
         )
+        return _with_etag(response, etag)
     except Exception as e:
         logger.error(f"获取会话详情失败: {str(e)}")
         return (
-            jsonify({"success": False, "message": f"获取会话详情失败: {str(e)}"}),
+            json_response({"success": False, "message": f"获取会话详情失败: {str(e)}"}),
             500,
         )
 
 
+def _delete_conversations(conversation_ids):
+    """
+    用一条语句删除会话
+
+    消息由数据库的 ON DELETE CASCADE 删除，不加载到内存中，也不触发
+    消息的 after_delete 事件（会话已被删除，无需更新其统计字段）。
+
+    Returns:
+        int: 删除的会话数
+    """
+    result = db.session.execute(
+        delete(Conversation).where(Conversation.id.in_(conversation_ids)),
+        execution_options={"synchronize_session": False},
+    )
+    with DB_COMMIT_SECONDS.time(operation="delete_conversations"):
+        db.session.commit()
+    read_cache.invalidate(conversation_ids)
+    remove_archives(conversation_ids)
+    return result.rowcount
+
+
+def _set_archived(conversation_ids, archived):
+    """
+    批量归档或取消归档会话
+
+    Returns:
+        int: 状态发生变化的会话数
+    """
+    conversations = Conversation.__table__
+    stmt = conversations.update().where(conversations.c.id.in_(conversation_ids))
+    if archived:
+        stmt = stmt.where(conversations.c.archived_at.is_(None))
+    else:
+        stmt = stmt.where(conversations.c.archived_at.isnot(None))
+    result = db.session.execute(
+        stmt.values(
+            archived_at=datetime.utcnow() if archived else None,
+            # 显式保留 updated_at，归档不改变会话在列表中的顺序
+            updated_at=conversations.c.updated_at,
+        )
+    )
+    with DB_COMMIT_SECONDS.time(operation="archive_conversations"):
+        db.session.commit()
+    return result.rowcount
+
+
 @api_bp.route("/conversations/<int:conversation_id>", methods=["DELETE"])
 def delete_conversation(conversation_id):
     """删除会话"""
     try:
-        conversation = Conversation.query.get_or_404(conversation_id)
-        db.session.delete(conversation)
-        db.session.commit()
+        if not _delete_conversations([conversation_id]):
+            return json_response({"success": False, "message": "会话不存在"}), 404
 
-        return jsonify({"success": True, "message": "会话删除成功"})
+        return json_response({"success": True, "message": "会话删除成功"})
     except Exception as e:
         logger.error(f"删除会话失败: {str(e)}")
-        return jsonify({"success": False, "message": f"删除会话失败: {str(e)}"}), 500
+        db.session.rollback()
+        return (
+            json_response({"success": False, "message": f"删除会话失败: {str(e)}"}),
+            500,
+        )
 
 
-@api_bp.route("/conversations/<int:conversation_id>/messages", methods=["POST"])
-def send_message(conversation_id):
-    """发送消息并获取AI回复"""
+@api_bp.route("/conversations/bulk", methods=["POST"])
+def bulk_update_conversations():
+    """
+    批量删除、归档或取消归档会话
+
+    请求体: {"action": "delete" / "archive" / "unarchive", "ids": [会话ID, ...]}
+    """
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    ids = data.get("ids")
+
+    if action not in BULK_ACTIONS:
+        return (
+            json_response({"success": False, "message": f"不支持的操作: {action}"}),
+            400,
+        )
+    if (
+        not isinstance(ids, list)
+        or not ids
+        or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+    ):
+        return (
+            json_response({"success": False, "message": "ids 必须是非空的会话ID列表"}),
+            400,
+        )
+    if len(ids) > Config.BULK_MAX_CONVERSATIONS:
+        return (
+            json_response(
+                {
+                    "success": False,
+                    "message": f"单次最多操作 {Config.BULK_MAX_CONVERSATIONS} 个会话",
+                }
+            ),
+            400,
+        )
+
     try:
-        data = request.get_json()
-        user_message = data.get("message", "").strip()
+        ids = list(set(ids))
+        if action == "delete":
+            affected = _delete_conversations(ids)
+        else:
+            affected = _set_archived(ids, archived=action == "archive")
+
+        return json_response({"success": True, "action": action, "affected": affected})
+    except Exception as e:
+        logger.error(f"批量操作会话失败: {str(e)}")
+        db.session.rollback()
+        return (
+            json_response({"success": False, "message": f"批量操作会话失败: {str(e)}"}),
+            500,
+        )
 
-        logger.info(f"API收到用户消息: {user_message}")
-        logger.info(f"请求数据: {data}")
 
-        if not user_message:
-            return jsonify({"success": False, "message": "消息内容不能为空"}), 400
+def _load_conversation_history(conversation, user_message):
+    """
+    按token预算加载构建提示词所需的对话历史（已被摘要的消息除外）
 
-        # 获取会话
-        conversation = Conversation.query.get_or_404(conversation_id)
+    历史从消息窗口缓存中选取，尚未写入数据库的AI回复是最新的消息，追加在末尾。
+    """
+    history = read_cache.context_window(
+        conversation,
+        get_llm_service().history_token_budget(
+            user_message, conversation.summary_token_count
+        ),
+        Config.MAX_CONVERSATION_MESSAGES,
+        after_id=conversation.summary_message_id,
+    )
+    for message in message_writer.pending_messages(conversation.id):
+        history.append({"role": message.role, "content": message.content})
+    return history
 
-        # 保存用户消息
-        user_msg = Message(
-            conversation_id=conversation_id, role="user", content=user_message
+
+def _save_user_message(conversation, user_message):
+    """
+    保存用户消息并立即提交
+
+    会话的统计字段和更新时间由插入消息时的事件一并更新。
+    如果是第一条消息，会话先使用占位标题，真正的标题在后台生成。
+    """
+    user_msg = Message(
+        conversation_id=conversation.id, role="user", content=user_message
+    )
+    db.session.add(user_msg)
+
+    is_first_message = conversation.message_count == 0
+    if is_first_message:
+        conversation.title = placeholder_title(user_message)
+
+    with DB_COMMIT_SECONDS.time(operation="user_message"):
+        db.session.commit()
+    read_cache.append_messages(
+        conversation.id, [{**user_msg.to_dict(), "token_count": user_msg.token_count}]
+    )
+
+    if is_first_message:
+        title_worker.enqueue(conversation.id, user_message, conversation.title)
+    return user_msg
+
+
+def _save_assistant_message(conversation_id, content, wait=True):
+    """
+    把AI回复（可能是流中断时的部分回复）交给后台线程批量写入
+
+    Args:
+        conversation_id (int): 会话ID
+        content (str): 回复内容
+        wait (bool): 是否等待写入完成，超时后返回尚未写入的消息（id为None）
+
+    Returns:
+        PendingMessage: 待写入或已写入的消息
+
+    Raises:
+        RuntimeError: 写入失败
+    """
+    ai_msg = message_writer.enqueue(conversation_id, content)
+    if not wait:
+        return ai_msg
+    if not ai_msg.wait(Config.WRITE_BEHIND_WAIT_SECONDS):
+        logger.warning(
+            f"AI回复尚未写入数据库，先返回未保存的消息: 会话 {conversation_id}"
         )
-        db.session.add(user_msg)
+    elif ai_msg.error is not None:
+        raise RuntimeError(str(ai_msg.error))
+    return ai_msg
 
-        # 如果是第一条消息，生成标题
-        if len(conversation.messages) == 0:
-            title = llm_service.generate_title(user_message)
-            conversation.title = title
 
-        # 更新会话时间
-        conversation.updated_at = datetime.utcnow()
+def _read_user_message():
+    """
+    从请求体中取出用户消息
 
-        # 获取对话历史
-        history_messages = (
-            Message.query.filter_by(conversation_id=conversation_id)
-            .order_by(Message.created_at.asc())
-            .all()
+    Returns:
+        tuple: (用户消息, 错误响应)，请求体不正确时用户消息为None
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None, (
+            json_response({"success": False, "message": "请求体必须是JSON对象"}),
+            400,
+        )
+    message = data.get("message") or ""
+    if not isinstance(message, str):
+        return None, (
+            json_response({"success": False, "message": "message 必须是字符串"}),
+            400,
+        )
+    message = message.strip()
+    if not message:
+        return None, (
+            json_response({"success": False, "message": "消息内容不能为空"}),
+            400,
         )
-        conversation_history = [msg.to_dict() for msg in history_messages]
+    return message, None
+
+
+@api_bp.route("/conversations/<int:conversation_id>/messages", methods=["POST"])
+def send_message(conversation_id):
+    """发送消息并获取AI回复"""
+    started = time.perf_counter()
+    user_message, error_response = _read_user_message()
+    if error_response is not None:
+        return error_response
+
+    # 获取会话，不存在时返回404
+    conversation = Conversation.query.get_or_404(conversation_id)
+
+    try:
+        llm_service = get_llm_service()
+
+        # 消息已归档时先恢复
+        if conversation.messages_archived_at is not None:
+            restore_conversation(conversation_id)
+
+        # 获取对话历史（不包含本次用户消息），恢复归档不计入读取耗时
+        with DB_READ_SECONDS.time(endpoint="send_message"):
+            conversation_history = _load_conversation_history(
+                conversation, user_message
+            )
+        summary = conversation.summary
+
+        # 保存用户消息
+        user_msg = _save_user_message(conversation, user_message)
+        user_payload = user_msg.to_dict()
+        # 结束读取事务，等待AI回复期间不占用数据库连接
+        db.session.commit()
 
         # 生成AI回复
-        ai_response = llm_service.generate_response(user_message, conversation_history)
+        ai_response = llm_service.generate_response(
+            user_message, conversation_history, summary
+        )
 
         # 保存AI回复
-        ai_msg = Message(
-            conversation_id=conversation_id, role="assistant", content=ai_response
-        )
-        db.session.add(ai_msg)
+        ai_msg = _save_assistant_message(conversation_id, ai_response)
 
-        db.session.commit()
+        # 按需在后台更新会话摘要
+        maybe_schedule_summary(llm_service, conversation_id, conversation.message_count)
 
-        return jsonify(
+        response = json_response(
             {
                 "success": True,
                 "data": {
-                    "user_message": user_msg.to_dict(),
+                    "user_message": user_payload,
                     "ai_message": ai_msg.to_dict(),
                     "conversation": conversation.to_dict(),
                 },
             }
         )
+        CHAT_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, endpoint="send_message"
+        )
+        return response
 
     except Exception as e:
         logger.error(f"发送消息失败: {str(e)}")
         db.session.rollback()
-        return jsonify({"success": False, "message": f"发送消息失败: {str(e)}"}), 500
+        return (
+            json_response({"success": False, "message": f"发送消息失败: {str(e)}"}),
+            500,
+        )
+
+
+def _sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    payload = dumps(data).decode("utf-8")
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@api_bp.route("/conversations/<int:conversation_id>/messages/stream", methods=["POST"])
+def stream_message(conversation_id):
+    """发送消息并通过SSE流式返回AI回复"""
+    started = time.perf_counter()
+    user_message, error_response = _read_user_message()
+    if error_response is not None:
+        return error_response
+
+    # 获取会话
+    conversation = Conversation.query.get_or_404(conversation_id)
+
+    try:
+        llm_service = get_llm_service()
+
+        # 消息已归档时先恢复
+        if conversation.messages_archived_at is not None:
+            restore_conversation(conversation_id)
+
+        # 获取对话历史（不包含本次用户消息），恢复归档不计入读取耗时
+        with DB_READ_SECONDS.time(endpoint="stream_message"):
+            conversation_history = _load_conversation_history(
+                conversation, user_message
+            )
+        summary = conversation.summary
+
+        # 先提交用户消息，流式回复期间不持有未提交的事务
+        user_msg = _save_user_message(conversation, user_message)
+        start_payload = {
+            "user_message": user_msg.to_dict(),
+            "conversation": conversation.to_dict(),
+        }
+        # 结束读取事务，流式回复期间不占用数据库连接
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"发送消息失败: {str(e)}")
+        db.session.rollback()
+        return (
+            json_response({"success": False, "message": f"发送消息失败: {str(e)}"}),
+            500,
+        )
+
+    def generate():
+        chunks = []
+        error = None
+        try:
+            yield _sse_event("start", start_payload)
+            for chunk in llm_service.stream_response(
+                user_message, conversation_history, summary
+            ):
+                chunks.append(chunk)
+                yield _sse_event("delta", {"content": chunk})
+        except GeneratorExit:
+            # 客户端断开连接，保存已生成的部分回复
+            if chunks:
+                logger.warning(f"流式回复中断，保存部分回复: 会话 {conversation_id}")
+                _save_assistant_message(conversation_id, "".join(chunks), wait=False)
+            raise
+        except Exception as e:
+            logger.error(f"流式生成回复失败: {str(e)}")
+            error = e
+
+        content = "".join(chunks)
+        if error is not None and not content:
+            content = f"抱歉，生成回复时出现错误：{str(error)}"
+
+        try:
+            ai_msg = _save_assistant_message(conversation_id, content)
+        except Exception as e:
+            logger.error(f"保存AI回复失败: {str(e)}")
+            db.session.rollback()
+            yield _sse_event("error", {"message": f"保存AI回复失败: {str(e)}"})
+            return
+
+        # 按需在后台更新会话摘要
+        maybe_schedule_summary(llm_service, conversation_id, conversation.message_count)
+
+        # 附带最新的会话信息，标题可能已在后台生成完成
+        final_payload = {
+            "ai_message": ai_msg.to_dict(),
+            "conversation": conversation.to_dict(),
+        }
+        CHAT_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, endpoint="stream_message"
+        )
+        if error is not None:
+            final_payload["message"] = f"生成回复时出现错误: {str(error)}"
+            yield _sse_event("error", final_payload)
+        else:
+            yield _sse_event("done", final_payload)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @api_bp.route("/conversations/<int:conversation_id>/messages", methods=["GET"])
 def get_messages(conversation_id):
-    """获取指定会话的所有消息"""
+    """
+    按时间顺序分页获取会话消息
+
+    查询参数 after_id 为客户端已有的最后一条消息ID，只返回其后的消息；
+    limit 为每页条数。has_more 为真时以本页最后一条消息的ID继续获取。
+    """
     try:
-        conversation = Conversation.query.get_or_404(conversation_id)
-        messages = (
-            Message.query.filter_by(conversation_id=conversation_id)
-            .order_by(Message.created_at.asc())
-            .all()
-        )
+        pending = message_writer.pending_messages(conversation_id)
+        conversation = _get_conversation_row(conversation_id)
+        etag = _conversation_etag(conversation, pending)
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        limit = _page_size(Config.MESSAGE_PAGE_SIZE)
+        after_id = request.args.get("after_id", type=int)
+        # 游标在消息窗口缓存内时直接从缓存返回，否则查询数据库
+        page = read_cache.messages_after(conversation, after_id, limit)
+        if page is not None:
+            messages, has_more = page
+        else:
+            messages, has_more = _query_messages_after(conversation_id, after_id, limit)
+        if not has_more:
+            # 最后一页附带尚未写入数据库的消息
+            messages = _merge_pending(messages, pending)
 
-        return jsonify({"success": True, "data": [msg.to_dict() for msg in messages]})
+        response = json_response(
+            {
+                "success": True,
+                "data": messages,
+                "has_more": has_more,
+                "conversation": row_to_dict(conversation, CONVERSATION_FIELDS),
+            }
+        )
+        return _with_etag(response, etag)
     except Exception as e:
         logger.error(f"获取消息列表失败: {str(e)}")
         return (
-            jsonify({"success": False, "message": f"获取消息列表失败: {str(e)}"}),
+            json_response({"success": False, "message": f"获取消息列表失败: {str(e)}"}),
             500,
         )
+
+
+@api_bp.route("/export", methods=["GET"])
+def export_conversations():
+    """
+    以NDJSON流式导出会话和消息
+
+    查询参数 since / until 为ISO格式的日期或时间，按会话的更新时间筛选
+    （包含 since，不包含 until），筛选出的会话导出其全部消息。
+    """
+    try:
+        since = parse_time(request.args.get("since"))
+        until = parse_time(request.args.get("until"))
+    except ValueError:
+        return json_response({"success": False, "message": "无效的时间格式"}), 400
+
+    filename = f"conversations-{datetime.utcnow():%Y%m%d%H%M%S}.ndjson"
+    return Response(
+        stream_with_context(iter_export(since, until)),
+        mimetype="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@api_bp.route("/search", methods=["GET"])
+def search():
+    """
+    全文检索消息内容和会话标题
+
+    查询参数:
+        q: 关键词，多个关键词以空格分隔，需要同时命中
+        offset: 跳过的消息命中数，即上一页返回的 next_offset
+        limit: 每页条数
+
+    标题命中的会话只在第一页返回。高亮以 [起始, 结束) 字符区间给出，
+    由前端渲染，避免在服务端拼接HTML。
+    """
+    query = request.args.get("q", "").strip()
+    needles = highlight_needles(query)
+    if not needles:
+        return json_response({"success": False, "message": "请输入搜索关键词"}), 400
+
+    offset = max(0, request.args.get("offset", 0, type=int))
+    if offset > Config.SEARCH_MAX_OFFSET:
+        return (
+            json_response(
+                {"success": False, "message": "结果太多，请使用更具体的关键词"}
+            ),
+            400,
+        )
+    limit = _page_size(Config.SEARCH_PAGE_SIZE)
+
+    try:
+        with SEARCH_SECONDS.time():
+            hits, has_more = search_messages(query, limit, offset)
+
+            conversations = []
+            if offset == 0:
+                rows = (
+                    db.session.query(
+                        Conversation.id, Conversation.title, Conversation.updated_at
+                    )
+                    .filter(
+                        *[
+                            Conversation.title.ilike(
+                                f"%{_escape_like(needle)}%", escape="\\"
+                            )
+                            for needle in needles
+                        ]
+                    )
+                    .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+                    .limit(limit)
+                    .all()
+                )
+                conversations = [
+                    {
+                        "id": row.id,
+                        "title": row.title,
+                        "updated_at": row.updated_at,
+                        "highlights": find_highlights(row.title, needles),
+                    }
+                    for row in rows
+                ]
+
+        return json_response(
+            {
+                "success": True,
+                "data": hits,
+                "conversations": conversations,
+                "has_more": has_more,
+                "next_offset": offset + len(hits) if has_more else None,
+            }
+        )
+    except Exception as e:
+        logger.error(f"搜索失败: {str(e)}")
+        return json_response({"success": False, "message": f"搜索失败: {str(e)}"}), 500
@@ -0,0 +1,180 @@
+"""
+消息全文检索
+
+按相关度返回命中的消息及高亮片段。分词方式和索引定义见 search_index.py：
+- PostgreSQL：通过GIN索引取出最新的若干条命中消息作为候选，再按 ts_rank_cd 排序；
+- SQLite：同样从FTS5表中取出最新的候选，按bm25排序，用于本地开发和测试。
+常见词命中大量消息时，只对最新的 SEARCH_MAX_CANDIDATES 条排序，开销有上限。
+"""
+
+import re
+from sqlalchemy import Float, Integer, func, literal_column, select, text
+from models import db, Conversation, Message
+from search_index import PG_SEARCH_VECTOR_SQL, highlight_needles, query_terms
+from config import Config
+
+_SIMPLE_CONFIG = literal_column("'simple'")
+
+
+def _pg_tsquery(terms):
+    """把查询项组合为tsquery：项内按相邻短语匹配，项之间为“且”"""
+    query = None
+    for tokens, prefix in terms:
+        if prefix:
+            # 单个中日韩字符，不包含tsquery的特殊字符
+            part = func.to_tsquery(_SIMPLE_CONFIG, f"{tokens[0]}:*")
+        else:
+            part = func.phraseto_tsquery(_SIMPLE_CONFIG, " ".join(tokens))
+        query = part if query is None else query.op("&&")(part)
+    return query
+
+
+def _fts5_query(terms):
+    """把查询项组合为FTS5查询语句，词只含字母数字，可以直接放在引号中"""
+    parts = []
+    for tokens, prefix in terms:
+        phrase = '"' + " ".join(tokens) + '"'
+        parts.append(phrase + "*" if prefix else phrase)
+    return " AND ".join(parts)
+
+
+def _hit_columns():
+    return (
+        Message.id,
+        Message.conversation_id,
+        Message.role,
+        Message.content,
+        Message.created_at,
+        Conversation.title,
+    )
+
+
+def _search_postgresql(terms, limit, offset):
+    vector = literal_column(PG_SEARCH_VECTOR_SQL)
+    tsquery = _pg_tsquery(terms)
+    candidates = (
+        select(Message.id)
+        .where(vector.op("@@")(tsquery))
+        .order_by(Message.id.desc())
+        .limit(Config.SEARCH_MAX_CANDIDATES)
+        .subquery()
+    )
+    rank = func.ts_rank_cd(vector, tsquery)
+    return db.session.execute(
+        select(*_hit_columns(), rank.label("rank"))
+        .join(candidates, candidates.c.id == Message.id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .order_by(rank.desc(), Message.id.desc())
+        .offset(offset)
+        .limit(limit)
+    ).all()
+
+
+def _search_sqlite(terms, limit, offset):
+    matches = (
+        text(
+            "SELECT rowid AS id, bm25(messages_fts) AS score FROM messages_fts "
+            "WHERE messages_fts MATCH :match ORDER BY rowid DESC LIMIT :candidates"
+        )
+        .bindparams(match=_fts5_query(terms), candidates=Config.SEARCH_MAX_CANDIDATES)
+        .columns(id=Integer, score=Float)
+        .subquery()
+    )
+    # bm25越小越相关，取相反数使两种数据库的 rank 都是越大越相关
+    return db.session.execute(
+        select(*_hit_columns(), (-matches.c.score).label("rank"))
+        .join(matches, matches.c.id == Message.id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .order_by(matches.c.score.asc(), Message.id.desc())
+        .offset(offset)
+        .limit(limit)
+    ).all()
+
+
+def find_highlights(content, needles):
+    """
+    在原文中查找关键词（不区分大小写）
+
+    Returns:
+        list: 按位置排序、互不重叠的 [起始, 结束) 区间
+    """
+    ranges = []
+    for needle in needles:
+        for match in re.finditer(re.escape(needle), content, re.IGNORECASE):
+            ranges.append([match.start(), match.end()])
+    ranges.sort()
+
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def make_snippet(content, highlights, width):
+    """
+    截取第一个关键词附近的片段，换行替换为空格
+
+    Returns:
+        tuple: (片段, 片段内的高亮区间)
+    """
+    first = highlights[0][0] if highlights else 0
+    begin = max(0, min(first - width // 4, len(content) - width))
+    end = min(len(content), begin + width)
+
+    prefix = "…" if begin > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    shift = len(prefix) - begin
+    ranges = [
+        [max(start, begin) + shift, min(stop, end) + shift]
+        for start, stop in highlights
+        if start < end and stop > begin
+    ]
+    snippet = content[begin:end].replace("\r", " ").replace("\n", " ")
+    return prefix + snippet + suffix, ranges
+
+
+def search_messages(query, limit, offset=0):
+    """
+    全文检索消息内容
+
+    Args:
+        query (str): 关键词，多个关键词以空格分隔，需要同时命中
+        limit (int): 返回的条数
+        offset (int): 跳过的条数
+
+    Returns:
+        tuple: (命中列表, 是否还有更多)，无有效关键词时返回 ([], False)
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+
+    if db.engine.dialect.name == "postgresql":
+        rows = _search_postgresql(terms, limit + 1, offset)
+    else:
+        rows = _search_sqlite(terms, limit + 1, offset)
+
+    needles = highlight_needles(query)
+    hits = []
+    for row in rows[:limit]:
+        snippet, highlights = make_snippet(
+            row.content,
+            find_highlights(row.content, needles),
+            Config.SEARCH_SNIPPET_LENGTH,
+        )
+        hits.append(
+            {
+                "message_id": row.id,
+                "conversation_id": row.conversation_id,
+                "conversation_title": row.title,
+                "role": row.role,
+                "created_at": row.created_at,
+                "rank": float(row.rank),
+                "snippet": snippet,
+                "highlights": highlights,
+            }
+        )
+    return hits, len(rows) > limit
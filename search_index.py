@@ -0,0 +1,101 @@
+"""
+全文检索的分词和索引定义
+
+消息内容以中文为主，数据库自带的分词器不能切分中文，因此在应用中预先分词，
+把结果以空格分隔保存在 messages.search_tokens 中，数据库只需按空格切分：
+- 连续的中日韩字符切分为相邻两字（bigram），并在末尾补上最后一个字，
+  两字及以上的关键词按相邻的bigram做短语匹配，单字关键词按前缀匹配；
+- 其余文字按字母数字组成的单词切分，统一转为小写；
+- PostgreSQL在 to_tsvector('simple', search_tokens) 上建立GIN索引，
+  SQLite使用FTS5外部内容表，由触发器与messages表保持同步。
+"""
+
+import re
+import unicodedata
+
+# 中日韩字符：假名、CJK统一表意文字（含扩展A）、谚文音节、兼容表意文字
+_CJK_RANGES = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿"
+_SEGMENT_PATTERN = re.compile(rf"([{_CJK_RANGES}]+)|([^\W_{_CJK_RANGES}]+)")
+
+# PostgreSQL：与查询中的表达式完全一致时才能使用该索引
+PG_SEARCH_INDEX_NAME = "ix_messages_search_tokens"
+PG_SEARCH_VECTOR_SQL = "to_tsvector('simple', search_tokens)"
+
+# SQLite：FTS5外部内容表及同步触发器
+SQLITE_FTS_STATEMENTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "search_tokens, content='messages', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, search_tokens) "
+    "VALUES (new.id, new.search_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update "
+    "AFTER UPDATE OF search_tokens ON messages BEGIN "
+    "INSERT INTO messages_fts (messages_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); "
+    "INSERT INTO messages_fts (rowid, search_tokens) "
+    "VALUES (new.id, new.search_tokens); END",
+)
+
+
+def _segments(text):
+    """按中日韩字符和其他单词切分，返回 (片段, 是否为中日韩字符)"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    for match in _SEGMENT_PATTERN.finditer(text):
+        if match.group(1):
+            yield match.group(1), True
+        else:
+            yield match.group(2), False
+
+
+def _bigrams(run):
+    return [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text):
+    """
+    将文本切分为索引用的词
+
+    Returns:
+        list: 按出现顺序排列的词
+    """
+    tokens = []
+    for segment, is_cjk in _segments(text):
+        if is_cjk:
+            # 末尾补上最后一个字，使单字关键词也能匹配到词尾的字
+            tokens.extend(_bigrams(segment))
+            tokens.append(segment[-1])
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+def search_tokens(text):
+    """返回保存到 search_tokens 列的分词结果"""
+    return " ".join(tokenize(text))
+
+
+def query_terms(query):
+    """
+    将搜索关键词切分为查询项，各查询项之间为“且”的关系
+
+    Returns:
+        list: [(词列表, 是否前缀匹配)]，词列表按相邻短语匹配；
+            单个中日韩字符按前缀匹配
+    """
+    terms = []
+    for segment, is_cjk in _segments(query):
+        if is_cjk and len(segment) == 1:
+            terms.append(([segment], True))
+        elif is_cjk:
+            terms.append((_bigrams(segment), False))
+        else:
+            terms.append(([segment], False))
+    return terms
+
+
+def highlight_needles(query):
+    """返回在原文中高亮的关键词片段（已转为小写）"""
+    return [segment for segment, _ in _segments(query)]
@@ -0,0 +1,70 @@
+"""
+API响应的序列化
+
+列表接口直接查询需要的列得到元组，不构造ORM对象，也不逐个调用 to_dict()；
+编码优先使用orjson（原生支持datetime，输出UTF-8字节），未安装时退化为标准库json。
+输出的字段和格式与模型的 to_dict() 一致。
+"""
+
+import datetime
+import json
+from flask import Response
+from models import Conversation, Message
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 与 Conversation.to_dict() / Message.to_dict() 相同的字段
+CONVERSATION_FIELDS = (
+    "id",
+    "title",
+    "created_at",
+    "updated_at",
+    "message_count",
+    "last_message_at",
+    "last_message_preview",
+)
+MESSAGE_FIELDS = ("id", "conversation_id", "role", "content", "created_at")
+
+CONVERSATION_COLUMNS = tuple(
+    getattr(Conversation, name) for name in CONVERSATION_FIELDS
+)
+MESSAGE_COLUMNS = tuple(getattr(Message, name) for name in MESSAGE_FIELDS)
+
+
+def _default(value):
+    """标准库json无法直接编码的类型"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(data):
+    """
+    将数据编码为JSON字节串
+
+    datetime按ISO格式输出，非ASCII字符不转义。
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        data, ensure_ascii=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+def json_response(data, status=200):
+    """构造JSON响应，用于替代 jsonify"""
+    return Response(dumps(data), status=status, mimetype="application/json")
+
+
+def row_to_dict(row, fields):
+    """将按 fields 顺序查询得到的一行转换为字典"""
+    return dict(zip(fields, row))
+
+
+def rows_to_dicts(rows, fields):
+    """将按 fields 顺序查询得到的多行转换为字典列表"""
+    return [dict(zip(fields, row)) for row in rows]
@@ -3,10 +3,18 @@ class ChatApp {
     constructor() {
         this.currentConversationId = null;
         this.isLoading = false;
+        // 会话消息缓存：会话ID -> { etag, conversation, messages }
+        this.messageCache = new Map();
         this.init();
     }
 
     init() {
+        // 消息列表只渲染可见区域附近的消息，长对话的渲染开销不随历史增长
+        this.messageList = new VirtualList(document.getElementById('messages-list'), {
+            scrollElement: document.getElementById('messages-container'),
+            renderItem: msg => this.createMessageElement(msg),
+            estimatedHeight: 80
+        });
         this.bindEvents();
         this.loadConversations();
         this.setupMessageInput();
@@ -111,6 +119,11 @@ class ChatApp {
 
             if (data.success) {
                 this.currentConversationId = data.data.id;
+                this.messageCache.set(data.data.id, {
+                    etag: null,
+                    conversation: data.data,
+                    messages: []
+                });
                 this.clearMessages();
                 this.updateChatTitle(data.data.title);
                 this.loadConversations();
@@ -126,6 +139,17 @@ class ChatApp {
     }
 
     async loadConversation(conversationId) {
+        const cached = this.messageCache.get(conversationId);
+        if (cached) {
+            // 先用缓存渲染，再只获取新增的消息
+            this.currentConversationId = conversationId;
+            this.updateChatTitle(cached.conversation.title);
+            this.renderMessages(cached.messages);
+            this.updateActiveConversation(conversationId);
+            await this.syncConversation(conversationId, cached);
+            return;
+        }
+
         try {
             this.showLoading(true);
 
@@ -133,6 +157,13 @@ class ChatApp {
             const data = await response.json();
 
             if (data.success) {
+                // 尚未写入数据库的消息（pending）没有ID，不缓存，写入后再同步
+                const saved = this.savedMessages(data.data.messages);
+                this.messageCache.set(conversationId, {
+                    etag: saved.length === data.data.messages.length ? response.headers.get('ETag') : null,
+                    conversation: data.data.conversation,
+                    messages: saved
+                });
                 this.currentConversationId = conversationId;
                 this.updateChatTitle(data.data.conversation.title);
                 this.renderMessages(data.data.messages);
@@ -148,6 +179,59 @@ class ChatApp {
         }
     }
 
+    async syncConversation(conversationId, cached) {
+        // 带上缓存的ETag，会话未变化时服务端直接返回304
+        try {
+            let hasMore = true;
+            while (hasMore) {
+                const last = cached.messages[cached.messages.length - 1];
+                const url = `/api/conversations/${conversationId}/messages` +
+                    (last ? `?after_id=${last.id}` : '');
+                const headers = cached.etag ? { 'If-None-Match': cached.etag } : {};
+                const response = await fetch(url, { headers: headers });
+                if (response.status === 304) return;
+
+                const data = await response.json();
+                if (!data.success) {
+                    console.error('同步对话失败:', data.message);
+                    return;
+                }
+
+                cached.conversation = data.conversation;
+                if (conversationId === this.currentConversationId) {
+                    this.updateChatTitle(data.conversation.title);
+                    this.appendMessages(data.data);
+                }
+                const saved = this.savedMessages(data.data);
+                cached.messages.push(...saved);
+                hasMore = data.has_more;
+                // 翻页期间会话可能继续变化，取完全部新消息且没有待写入的消息时才记录ETag
+                const complete = !hasMore && saved.length === data.data.length;
+                cached.etag = complete ? response.headers.get('ETag') : null;
+            }
+        } catch (error) {
+            console.error('同步对话失败:', error);
+        }
+    }
+
+    savedMessages(messages) {
+        return messages.filter(msg => msg.id !== null);
+    }
+
+    cacheMessage(conversationId, message) {
+        // 本地发送的消息直接写入缓存，并使缓存的ETag失效；尚未写入数据库的消息只使ETag失效
+        const cached = this.messageCache.get(conversationId);
+        if (!cached) return;
+        if (message.id === null) {
+            cached.etag = null;
+            return;
+        }
+        if (!cached.messages.some(msg => msg.id === message.id)) {
+            cached.messages.push(message);
+        }
+        cached.etag = null;
+    }
+
     async sendMessage() {
         const input = document.getElementById('message-input');
         const message = input.value.trim();
@@ -171,31 +255,25 @@ class ChatApp {
             document.getElementById('send-btn').disabled = true;
             document.querySelector('.char-count').textContent = '0/2000';
 
-            console.log('发送消息:', message);
-            console.log('会话ID:', this.currentConversationId);
-
-            const response = await fetch(`/api/conversations/${this.currentConversationId}/messages`, {
+            const response = await fetch(`/api/conversations/${this.currentConversationId}/messages/stream`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
                 body: JSON.stringify({ message: message })
             });
 
-            const data = await response.json();
-
-            if (data.success) {
-                // 更新对话标题
-                this.updateChatTitle(data.data.conversation.title);
-
-                // 添加AI回复到界面
-                this.addMessage('assistant', data.data.ai_message.content);
-
-                // 重新加载会话列表以更新标题
-                this.loadConversations();
-            } else {
+            if (!response.ok || !response.body) {
+                const data = await response.json();
                 this.addMessage('assistant', '抱歉，发送消息失败: ' + data.message);
+                return;
             }
+
+            await this.readReplyStream(response);
+
+            // 重新加载会话列表以更新标题
+            this.loadConversations();
         } catch (error) {
             console.error('发送消息失败:', error);
             this.addMessage('assistant', '抱歉，发送消息失败: ' + error.message);
@@ -206,66 +284,164 @@ class ChatApp {
         }
     }
 
-    addMessage(role, content) {
-        const container = document.getElementById('messages-container');
+    async readReplyStream(response) {
+        // 逐块读取SSE事件并实时渲染AI回复
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let replyContent = '';
+        let reply = null;
+        let startTitle = null;
+        let isFirstMessage = false;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const raw of events) {
+                const event = this.parseSseEvent(raw);
+                if (!event) continue;
+
+                switch (event.type) {
+                    case 'start':
+                        this.cacheMessage(event.data.conversation.id, event.data.user_message);
+                        startTitle = event.data.conversation.title;
+                        isFirstMessage = event.data.conversation.message_count === 1;
+                        this.updateChatTitle(startTitle);
+                        break;
+                    case 'delta':
+                        if (!reply) {
+                            // 收到第一个片段后隐藏加载提示
+                            this.showLoading(false);
+                            reply = this.addMessage('assistant', '');
+                        }
+                        replyContent += event.data.content;
+                        this.updateMessageContent(reply, replyContent);
+                        break;
+                    case 'done':
+                    case 'error':
+                        if (event.type === 'error') {
+                            if (!reply) {
+                                this.addMessage('assistant', '抱歉，' + event.data.message);
+                            }
+                            console.error('流式回复出错:', event.data.message);
+                        }
+                        if (event.data.ai_message) {
+                            this.cacheMessage(event.data.ai_message.conversation_id, event.data.ai_message);
+                        }
+                        if (event.data.conversation) {
+                            this.updateChatTitle(event.data.conversation.title);
+                            // 标题仍是占位标题时，稍后再获取后台生成的标题
+                            if (isFirstMessage && event.data.conversation.title === startTitle) {
+                                this.refreshConversationTitle(event.data.conversation.id, startTitle, 3);
+                            }
+                        }
+                        break;
+                }
+            }
+        }
+    }
+
+    refreshConversationTitle(conversationId, placeholder, attempts) {
+        setTimeout(async () => {
+            try {
+                const response = await fetch(`/api/conversations/${conversationId}`);
+                const data = await response.json();
+                if (!data.success) return;
+
+                const title = data.data.conversation.title;
+                if (title !== placeholder) {
+                    if (conversationId === this.currentConversationId) {
+                        this.updateChatTitle(title);
+                    }
+                    this.loadConversations();
+                } else if (attempts > 1) {
+                    this.refreshConversationTitle(conversationId, placeholder, attempts - 1);
+                }
+            } catch (error) {
+                console.error('获取会话标题失败:', error);
+            }
+        }, 2000);
+    }
+
+    parseSseEvent(raw) {
+        let type = 'message';
+        const dataLines = [];
+
+        raw.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+
+        if (dataLines.length === 0) return null;
+        return { type: type, data: JSON.parse(dataLines.join('\n')) };
+    }
 
-        // 如果是第一条消息，清除欢迎信息
-        if (container.querySelector('.welcome-message')) {
-            container.innerHTML = '';
+    updateMessageContent(message, content) {
+        // 只重新渲染这条消息；用户向上翻看历史时不强制滚动到底部
+        const stick = this.messageList.isNearBottom();
+        message.content = content;
+        this.messageList.updateItem(message);
+        if (stick) {
+            this.messageList.scrollToBottom();
         }
+    }
 
+    addMessage(role, content) {
+        // 追加一条消息并滚动到底部，返回消息对象，用于流式更新内容
+        const message = { role: role, content: content, created_at: new Date().toISOString() };
+        this.appendMessages([message]);
+        this.messageList.scrollToBottom();
+        return message;
+    }
+
+    appendMessages(messages) {
+        if (messages.length === 0) return;
+        this.showWelcome(false);
+        this.messageList.append(messages);
+    }
+
+    createMessageElement(msg) {
         const messageDiv = document.createElement('div');
-        messageDiv.className = `message ${role}`;
+        messageDiv.className = `message ${msg.role}`;
 
-        const avatar = role === 'user' ?
+        const avatar = msg.role === 'user' ?
             '<i class="fas fa-user"></i>' :
             '<i class="fas fa-robot"></i>';
 
         messageDiv.innerHTML = `
             <div class="message-avatar">${avatar}</div>
             <div class="message-content">
-                ${this.formatMessageContent(content)}
-                <div class="message-time">${this.formatTime(new Date().toISOString())}</div>
+                <div class="message-body">${this.formatMessageContent(msg.content)}</div>
+                <div class="message-time">${this.formatTime(msg.created_at || new Date().toISOString())}</div>
             </div>
         `;
-
-        container.appendChild(messageDiv);
-        container.scrollTop = container.scrollHeight;
+        return messageDiv;
     }
 
     renderMessages(messages) {
-        const container = document.getElementById('messages-container');
-        container.innerHTML = '';
-
-        if (messages.length === 0) {
-            container.innerHTML = `
-                <div class="welcome-message">
-                    <div class="welcome-icon">
-                        <i class="fas fa-robot"></i>
-                    </div>
-                    <h3>开始新的对话</h3>
-                    <p>输入您的消息开始与AI助手对话！</p>
-                </div>
-            `;
-            return;
-        }
-
-        messages.forEach(msg => {
-            this.addMessage(msg.role, msg.content);
-        });
+        // 列表保存自己的副本，之后追加消息不会修改缓存中的数组
+        this.showWelcome(messages.length === 0);
+        this.messageList.setItems(messages);
+        this.messageList.scrollToBottom();
     }
 
     clearMessages() {
-        const container = document.getElementById('messages-container');
-        container.innerHTML = `
-            <div class="welcome-message">
-                <div class="welcome-icon">
-                    <i class="fas fa-robot"></i>
-                </div>
-                <h3>开始新的对话</h3>
-                <p>输入您的消息开始与AI助手对话！</p>
-            </div>
-        `;
+        const welcome = document.getElementById('welcome-message');
+        welcome.querySelector('h3').textContent = '开始新的对话';
+        welcome.querySelector('p').textContent = '输入您的消息开始与AI助手对话！';
+        this.renderMessages([]);
+    }
+
+    showWelcome(show) {
+        document.getElementById('welcome-message').classList.toggle('hidden', !show);
     }
 
     updateChatTitle(title) {
@@ -297,6 +473,7 @@ class ChatApp {
                 const data = await response.json();
 
                 if (data.success) {
+                    this.messageCache.delete(this.currentConversationId);
                     this.currentConversationId = null;
                     this.clearMessages();
                     this.updateChatTitle('开始新的对话');
@@ -1,16 +1,38 @@
 // 会话记录页面JavaScript
+
+// 会话卡片的最小宽度和间距，与 conversations.css 中的网格设置一致
+const CARD_MIN_WIDTH = 350;
+const CARD_GAP = 20;
+
 class ConversationsApp {
     constructor() {
         this.conversations = [];
-        this.filteredConversations = [];
         this.sortBy = 'updated_desc';
         this.searchTerm = '';
-        this.deleteConversationId = null;
+        this.nextCursor = null;
+        this.isLoadingPage = false;
+        this.requestSeq = 0;
+        this.searchTimer = null;
+        this.archived = false;
+        // 搜索范围：title 按标题筛选会话列表，content 全文检索消息内容
+        this.searchScope = 'title';
+        this.searchOffset = null;
+        // 批量操作选中的会话ID
+        this.selectedIds = new Set();
+        // 待确认删除的会话ID列表
+        this.deleteConversationIds = [];
         this.init();
     }
 
     init() {
+        // 只渲染可见区域附近的卡片，滚动加载再多页也不会拖慢页面
+        this.list = new VirtualList(document.getElementById('conversations-list'), {
+            renderItem: item => item.searchHit ? this.createSearchHitCard(item) : this.createConversationCard(item),
+            estimatedHeight: 220,
+            columns: () => this.columnCount()
+        });
         this.bindEvents();
+        this.setupInfiniteScroll();
         this.loadConversations();
     }
 
@@ -20,16 +42,60 @@ class ConversationsApp {
             this.loadConversations();
         });
 
-        // 搜索输入
+        // 搜索输入（停止输入后再请求服务端，关键词没有变化时不重新加载）
         document.getElementById('search-input').addEventListener('input', (e) => {
-            this.searchTerm = e.target.value.toLowerCase();
-            this.filterAndRenderConversations();
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => {
+                const term = e.target.value.trim();
+                if (term === this.searchTerm) return;
+                this.searchTerm = term;
+                this.loadConversations();
+            }, 300);
+        });
+
+        // 搜索范围
+        document.getElementById('search-scope').addEventListener('change', (e) => {
+            this.searchScope = e.target.value;
+            document.getElementById('search-input').placeholder =
+                this.searchScope === 'content' ? '搜索消息内容...' : '搜索会话标题...';
+            this.loadConversations();
         });
 
         // 排序选择
         document.getElementById('sort-select').addEventListener('change', (e) => {
             this.sortBy = e.target.value;
-            this.filterAndRenderConversations();
+            this.loadConversations();
+        });
+
+        // 切换已归档/未归档的会话
+        document.getElementById('archive-select').addEventListener('change', (e) => {
+            this.archived = e.target.value === 'archived';
+            document.getElementById('bulk-archive-label').textContent = this.archived ? '取消归档' : '归档';
+            this.loadConversations();
+        });
+
+        // 勾选会话（事件委托，滚动加载的卡片同样生效）
+        document.getElementById('conversations-list').addEventListener('change', (e) => {
+            if (e.target.classList.contains('conversation-select')) {
+                this.toggleSelection(Number(e.target.dataset.id), e.target.checked);
+            }
+        });
+
+        // 批量操作
+        document.getElementById('bulk-select-all').addEventListener('click', () => {
+            this.conversations.forEach(conv => this.toggleSelection(conv.id, true));
+        });
+
+        document.getElementById('bulk-clear').addEventListener('click', () => {
+            this.clearSelection();
+        });
+
+        document.getElementById('bulk-archive').addEventListener('click', () => {
+            this.bulkArchive();
+        });
+
+        document.getElementById('bulk-delete').addEventListener('click', () => {
+            this.showDeleteModal(Array.from(this.selectedIds));
         });
 
         // 模态框关闭
@@ -54,16 +120,63 @@ class ConversationsApp {
         });
     }
 
+    setupInfiniteScroll() {
+        // 滚动到列表底部时加载下一页
+        const sentinel = document.getElementById('load-more-sentinel');
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadMoreConversations();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(sentinel);
+    }
+
+    columnCount() {
+        // 与网格的 auto-fill 规则一致，窄屏时为单列
+        if (window.matchMedia('(max-width: 768px)').matches) return 1;
+        const width = document.getElementById('conversations-list').clientWidth;
+        return Math.max(1, Math.floor((width + CARD_GAP) / (CARD_MIN_WIDTH + CARD_GAP)));
+    }
+
+    buildListUrl(cursor) {
+        const params = new URLSearchParams({ sort: this.sortBy });
+        if (this.archived) {
+            params.set('archived', 'true');
+        }
+        if (this.searchTerm) {
+            params.set('q', this.searchTerm);
+        }
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        return `/api/conversations?${params.toString()}`;
+    }
+
+    isContentSearch() {
+        return this.searchScope === 'content' && this.searchTerm !== '';
+    }
+
     async loadConversations() {
+        if (this.isContentSearch()) {
+            return this.loadSearchResults(false);
+        }
+
+        // 重新加载第一页；序号用于丢弃过期请求的响应
+        const seq = ++this.requestSeq;
+
         try {
+            this.isLoadingPage = true;
             this.showLoading(true);
 
-            const response = await fetch('/api/conversations');
+            const response = await fetch(this.buildListUrl(null));
             const data = await response.json();
+            if (seq !== this.requestSeq) return;
 
             if (data.success) {
                 this.conversations = data.data;
-                this.filterAndRenderConversations();
+                this.nextCursor = data.next_cursor;
+                this.clearSelection();
+                this.renderConversations();
             } else {
                 console.error('加载会话列表失败:', data.message);
                 this.showError('加载会话列表失败: ' + data.message);
@@ -72,64 +185,173 @@ class ConversationsApp {
             console.error('加载会话列表失败:', error);
             this.showError('加载会话列表失败: ' + error.message);
         } finally {
-            this.showLoading(false);
+            if (seq === this.requestSeq) {
+                this.isLoadingPage = false;
+                this.showLoading(false);
+            }
         }
     }
 
-    filterAndRenderConversations() {
-        // 过滤会话
-        this.filteredConversations = this.conversations.filter(conv => {
-            return conv.title.toLowerCase().includes(this.searchTerm);
-        });
+    async loadMoreConversations() {
+        if (this.isContentSearch()) {
+            return this.loadSearchResults(true);
+        }
+        if (this.isLoadingPage || !this.nextCursor) return;
 
-        // 排序会话
-        this.filteredConversations.sort((a, b) => {
-            switch (this.sortBy) {
-                case 'created_desc':
-                    return new Date(b.created_at) - new Date(a.created_at);
-                case 'title_asc':
-                    return a.title.localeCompare(b.title);
-                case 'updated_desc':
-                default:
-                    return new Date(b.updated_at) - new Date(a.updated_at);
-            }
-        });
+        const seq = this.requestSeq;
 
-        this.renderConversations();
+        try {
+            this.isLoadingPage = true;
+
+            const response = await fetch(this.buildListUrl(this.nextCursor));
+            const data = await response.json();
+            if (seq !== this.requestSeq) return;
+
+            if (data.success) {
+                this.conversations = this.conversations.concat(data.data);
+                this.nextCursor = data.next_cursor;
+                this.list.append(data.data);
+            } else {
+                console.error('加载更多会话失败:', data.message);
+            }
+        } catch (error) {
+            console.error('加载更多会话失败:', error);
+        } finally {
+            if (seq === this.requestSeq) {
+                this.isLoadingPage = false;
+            }
+        }
     }
 
-    renderConversations() {
-        const container = document.getElementById('conversations-list');
-        const emptyState = document.getElementById('empty-state');
+    async loadSearchResults(append) {
+        // 全文检索消息内容，append 为真时加载下一页
+        if (append && (this.isLoadingPage || this.searchOffset === null)) return;
+
+        const seq = append ? this.requestSeq : ++this.requestSeq;
+        const params = new URLSearchParams({ q: this.searchTerm });
+        if (append) {
+            params.set('offset', this.searchOffset);
+        }
+
+        try {
+            this.isLoadingPage = true;
+            if (!append) {
+                this.showLoading(true);
+            }
+
+            const response = await fetch(`/api/search?${params.toString()}`);
+            const data = await response.json();
+            if (seq !== this.requestSeq) return;
+
+            if (!data.success) {
+                if (!append) {
+                    this.showError('搜索失败: ' + data.message);
+                }
+                return;
+            }
 
-        if (this.filteredConversations.length === 0) {
-            container.innerHTML = '';
-            emptyState.classList.remove('hidden');
-            return;
+            this.searchOffset = data.next_offset;
+            const hits = data.conversations.map(conv => ({
+                searchHit: true,
+                conversationId: conv.id,
+                title: conv.title,
+                titleHighlights: conv.highlights,
+                label: '标题匹配',
+                snippet: null,
+                highlights: [],
+                time: conv.updated_at
+            })).concat(data.data.map(hit => ({
+                searchHit: true,
+                conversationId: hit.conversation_id,
+                title: hit.conversation_title,
+                titleHighlights: [],
+                label: hit.role === 'user' ? '用户' : 'AI助手',
+                snippet: hit.snippet,
+                highlights: hit.highlights,
+                time: hit.created_at
+            })));
+
+            if (append) {
+                this.list.append(hits);
+            } else {
+                this.conversations = [];
+                this.clearSelection();
+                document.getElementById('empty-state').classList.toggle('hidden', hits.length > 0);
+                this.list.setItems(hits);
+            }
+        } catch (error) {
+            console.error('搜索失败:', error);
+            if (!append) {
+                this.showError('搜索失败: ' + error.message);
+            }
+        } finally {
+            if (seq === this.requestSeq) {
+                this.isLoadingPage = false;
+                this.showLoading(false);
+            }
         }
+    }
 
-        emptyState.classList.add('hidden');
-        container.innerHTML = '';
+    createSearchHitCard(hit) {
+        const card = document.createElement('div');
+        card.className = 'conversation-card';
+        card.innerHTML = `
+            <div class="conversation-header">
+                <div class="conversation-title"></div>
+                <div class="conversation-time">${this.formatTime(hit.time)}</div>
+            </div>
+            <div class="search-hit-role">${hit.label}</div>
+            <div class="search-hit-snippet"></div>
+        `;
+        card.querySelector('.conversation-title').appendChild(this.highlightText(hit.title, hit.titleHighlights));
+        if (hit.snippet !== null) {
+            card.querySelector('.search-hit-snippet').appendChild(this.highlightText(hit.snippet, hit.highlights));
+        }
+        card.addEventListener('click', () => this.viewConversation(hit.conversationId));
+        return card;
+    }
 
-        this.filteredConversations.forEach(conv => {
-            const card = this.createConversationCard(conv);
-            container.appendChild(card);
+    highlightText(text, ranges) {
+        // 按服务端返回的 [起始, 结束) 区间生成高亮，只使用文本节点，不拼接HTML；
+        // 区间按Unicode字符计数，先拆成字符数组，避免表情等字符错位
+        const chars = Array.from(text);
+        const fragment = document.createDocumentFragment();
+        let position = 0;
+        ranges.forEach(([start, end]) => {
+            fragment.appendChild(document.createTextNode(chars.slice(position, start).join('')));
+            const mark = document.createElement('mark');
+            mark.textContent = chars.slice(start, end).join('');
+            fragment.appendChild(mark);
+            position = end;
         });
+        fragment.appendChild(document.createTextNode(chars.slice(position).join('')));
+        return fragment;
+    }
+
+    renderConversations() {
+        document.getElementById('empty-state').classList.toggle('hidden', this.conversations.length > 0);
+        this.list.setItems(this.conversations);
     }
 
     createConversationCard(conversation) {
         const card = document.createElement('div');
         card.className = 'conversation-card';
         card.dataset.conversationId = conversation.id;
+        const selected = this.selectedIds.has(conversation.id);
+        if (selected) {
+            card.classList.add('selected');
+        }
 
         card.innerHTML = `
             <div class="conversation-header">
-                <div>
+                <div class="conversation-heading">
+                    <input type="checkbox" class="conversation-select" data-id="${conversation.id}" ${selected ? 'checked' : ''}>
                     <div class="conversation-title">${this.escapeHtml(conversation.title)}</div>
                 </div>
                 <div class="conversation-time">${this.formatTime(conversation.updated_at)}</div>
             </div>
-            
+            ${conversation.last_message_preview ? `
+            <div class="conversation-preview">${this.escapeHtml(conversation.last_message_preview)}</div>` : ''}
             <div class="conversation-stats">
                 <div class="stat-item">
                     <i class="fas fa-comments"></i>
@@ -146,7 +368,7 @@ class ConversationsApp {
                     <i class="fas fa-eye"></i>
                     查看
                 </button>
-                <button class="action-btn delete-btn" onclick="conversationsApp.showDeleteModal(${conversation.id})">
+                <button class="action-btn delete-btn" onclick="conversationsApp.showDeleteModal([${conversation.id}])">
                     <i class="fas fa-trash"></i>
                     删除
                 </button>
@@ -161,37 +383,90 @@ class ConversationsApp {
         window.location.href = `/?conversation=${conversationId}`;
     }
 
-    showDeleteModal(conversationId) {
-        this.deleteConversationId = conversationId;
-        document.getElementById('delete-modal').classList.remove('hidden');
+    toggleSelection(conversationId, selected) {
+        if (selected) {
+            this.selectedIds.add(conversationId);
+        } else {
+            this.selectedIds.delete(conversationId);
+        }
+        const card = document.querySelector(`[data-conversation-id="${conversationId}"]`);
+        if (card) {
+            card.classList.toggle('selected', selected);
+            card.querySelector('.conversation-select').checked = selected;
+        }
+        this.updateBulkToolbar();
     }
 
-    hideDeleteModal() {
-        this.deleteConversationId = null;
-        document.getElementById('delete-modal').classList.add('hidden');
+    clearSelection() {
+        Array.from(this.selectedIds).forEach(id => this.toggleSelection(id, false));
     }
 
-    async confirmDelete() {
-        if (!this.deleteConversationId) return;
+    updateBulkToolbar() {
+        const count = this.selectedIds.size;
+        document.getElementById('bulk-count').textContent = `已选择 ${count} 个会话`;
+        document.getElementById('bulk-toolbar').classList.toggle('hidden', count === 0);
+    }
 
+    async bulkAction(action, ids) {
+        // 一次请求批量处理选中的会话，返回是否成功
         try {
-            const response = await fetch(`/api/conversations/${this.deleteConversationId}`, {
-                method: 'DELETE'
+            const response = await fetch('/api/conversations/bulk', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ action: action, ids: ids })
             });
-
             const data = await response.json();
-
-            if (data.success) {
-                // 从本地数组中移除已删除的会话
-                this.conversations = this.conversations.filter(conv => conv.id !== this.deleteConversationId);
-                this.filterAndRenderConversations();
-                this.hideDeleteModal();
-            } else {
-                this.showError('删除会话失败: ' + data.message);
+            if (!data.success) {
+                this.showError('操作失败: ' + data.message);
+                return false;
             }
+            return true;
         } catch (error) {
-            console.error('删除会话失败:', error);
-            this.showError('删除会话失败: ' + error.message);
+            console.error('批量操作失败:', error);
+            this.showError('操作失败: ' + error.message);
+            return false;
+        }
+    }
+
+    removeConversations(ids) {
+        // 从本地数组中移除会话后重新渲染可见区域
+        const removed = new Set(ids);
+        this.conversations = this.conversations.filter(conv => !removed.has(conv.id));
+        ids.forEach(id => this.selectedIds.delete(id));
+        this.updateBulkToolbar();
+        this.renderConversations();
+    }
+
+    async bulkArchive() {
+        // 归档后的会话不再出现在当前列表中（取消归档同理）
+        const ids = Array.from(this.selectedIds);
+        if (ids.length === 0) return;
+        if (await this.bulkAction(this.archived ? 'unarchive' : 'archive', ids)) {
+            this.removeConversations(ids);
+        }
+    }
+
+    showDeleteModal(conversationIds) {
+        if (conversationIds.length === 0) return;
+        this.deleteConversationIds = conversationIds;
+        document.getElementById('delete-message').textContent = conversationIds.length === 1
+            ? '确定要删除这个会话吗？删除后无法恢复。'
+            : `确定要删除选中的 ${conversationIds.length} 个会话吗？删除后无法恢复。`;
+        document.getElementById('delete-modal').classList.remove('hidden');
+    }
+
+    hideDeleteModal() {
+        this.deleteConversationIds = [];
+        document.getElementById('delete-modal').classList.add('hidden');
+    }
+
+    async confirmDelete() {
+        const ids = this.deleteConversationIds;
+        if (ids.length === 0) return;
+
+        if (await this.bulkAction('delete', ids)) {
+            this.removeConversations(ids);
+            this.hideDeleteModal();
         }
     }
 
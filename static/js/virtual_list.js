@@ -0,0 +1,274 @@
+// 虚拟列表：只渲染可见区域附近的条目，列表再长，页面中的节点数也基本不变
+//
+// 条目高度可以不同：未渲染过的行按估计高度占位，渲染后记录实际高度；
+// 可见区域之外的行用列表的上下内边距代替。多列布局时按行渲染，每行包含 columns() 个条目。
+class VirtualList {
+    constructor(container, options) {
+        // container: 列表元素，不能设置上下内边距
+        // options.renderItem(item, index): 返回条目的DOM元素
+        // options.scrollElement: 滚动的元素，默认为window
+        // options.estimatedHeight: 未测量行的估计高度（像素）
+        // options.columns: 返回每行条目数的函数，默认为1
+        // options.overscan: 可见区域上下额外渲染的高度（像素）
+        this.container = container;
+        this.renderItem = options.renderItem;
+        this.scrollElement = options.scrollElement || window;
+        this.estimatedHeight = options.estimatedHeight || 100;
+        this.getColumns = options.columns || (() => 1);
+        this.overscan = options.overscan || 600;
+
+        this.items = [];
+        this.columns = this.getColumns();
+        this.rowHeights = [];
+        this.offsets = null;
+        this.rows = new Map(); // 行号 -> 已渲染的行元素
+        this.stickToBottom = false;
+        this.rendering = false;
+        this.frame = null;
+
+        this.container.classList.add('virtual-list');
+        this.container.style.setProperty('--virtual-columns', this.columns);
+
+        const target = this.scrollElement === window ? window : this.scrollElement;
+        target.addEventListener('scroll', () => {
+            if (!this.rendering) {
+                this.stickToBottom = this.isNearBottom();
+            }
+            this.scheduleRender();
+        }, { passive: true });
+        window.addEventListener('resize', () => this.handleResize());
+    }
+
+    get length() {
+        return this.items.length;
+    }
+
+    setItems(items) {
+        // 替换全部条目，已渲染的行全部丢弃
+        this.items = items.slice();
+        this.rowHeights = [];
+        this.offsets = null;
+        this.rows.forEach(row => row.remove());
+        this.rows.clear();
+        this.render();
+    }
+
+    append(items) {
+        // 在末尾追加条目，只重新渲染未填满的最后一行
+        if (items.length === 0) return;
+        const lastRow = this.rowCount() - 1;
+        if (lastRow >= 0 && this.items.length % this.columns !== 0) {
+            this.invalidateRow(lastRow);
+        }
+        this.items.push(...items);
+        this.offsets = null;
+        this.render();
+    }
+
+    updateItem(item) {
+        // 条目内容变化后重新渲染它所在的行（未渲染时只作废行高）
+        const index = this.items.indexOf(item);
+        if (index === -1) return;
+        this.invalidateRow(Math.floor(index / this.columns));
+        this.render();
+    }
+
+    getElement(item) {
+        // 返回条目当前渲染的元素，不在可见区域时返回null
+        const index = this.items.indexOf(item);
+        if (index === -1) return null;
+        const row = this.rows.get(Math.floor(index / this.columns));
+        return row ? row.children[index % this.columns] || null : null;
+    }
+
+    scrollToBottom() {
+        this.stickToBottom = true;
+        this.render();
+    }
+
+    isNearBottom() {
+        const { top, height } = this.viewport();
+        return top + height >= this.totalHeight() - 80;
+    }
+
+    rowCount() {
+        return Math.ceil(this.items.length / this.columns);
+    }
+
+    invalidateRow(rowIndex) {
+        this.rowHeights[rowIndex] = undefined;
+        this.offsets = null;
+        const row = this.rows.get(rowIndex);
+        if (row) {
+            row.remove();
+            this.rows.delete(rowIndex);
+        }
+    }
+
+    handleResize() {
+        const columns = Math.max(1, this.getColumns());
+        if (columns !== this.columns) {
+            this.columns = columns;
+            this.container.style.setProperty('--virtual-columns', columns);
+            this.setItems(this.items);
+            return;
+        }
+        // 宽度变化会改变行高，重新测量已渲染的行
+        this.scheduleRender();
+    }
+
+    scheduleRender() {
+        if (this.frame !== null) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+
+    computeOffsets() {
+        // 每行顶部位置的前缀和，最后一项为列表总高度
+        const count = this.rowCount();
+        const offsets = new Array(count + 1);
+        offsets[0] = 0;
+        for (let i = 0; i < count; i++) {
+            const height = this.rowHeights[i];
+            offsets[i + 1] = offsets[i] + (height === undefined ? this.estimatedHeight : height);
+        }
+        this.offsets = offsets;
+    }
+
+    totalHeight() {
+        if (this.offsets === null) this.computeOffsets();
+        return this.offsets[this.offsets.length - 1];
+    }
+
+    findRow(position) {
+        // 二分查找包含该位置的行
+        let low = 0;
+        let high = this.rowCount() - 1;
+        while (low < high) {
+            const mid = (low + high + 1) >> 1;
+            if (this.offsets[mid] <= position) {
+                low = mid;
+            } else {
+                high = mid - 1;
+            }
+        }
+        return Math.max(low, 0);
+    }
+
+    viewport() {
+        // 可见区域在列表坐标系中的位置
+        const listRect = this.container.getBoundingClientRect();
+        if (this.scrollElement === window) {
+            return { top: -listRect.top, height: window.innerHeight };
+        }
+        const scrollRect = this.scrollElement.getBoundingClientRect();
+        return { top: scrollRect.top - listRect.top, height: this.scrollElement.clientHeight };
+    }
+
+    scrollBy(delta) {
+        if (this.scrollElement === window) {
+            window.scrollBy(0, delta);
+        } else {
+            this.scrollElement.scrollTop += delta;
+        }
+    }
+
+    scrollToEnd() {
+        if (this.scrollElement === window) {
+            window.scrollTo(0, document.documentElement.scrollHeight);
+        } else {
+            this.scrollElement.scrollTop = this.scrollElement.scrollHeight;
+        }
+    }
+
+    createRow(rowIndex) {
+        const row = document.createElement('div');
+        row.className = 'virtual-list-row';
+        const start = rowIndex * this.columns;
+        const end = Math.min(start + this.columns, this.items.length);
+        for (let index = start; index < end; index++) {
+            row.appendChild(this.renderItem(this.items[index], index));
+        }
+        return row;
+    }
+
+    render() {
+        this.rendering = true;
+        try {
+            // 测得的行高与估计不同会改变总高度，贴底时再渲染一次以保持在底部
+            for (let pass = 0; pass < 3; pass++) {
+                if (this.stickToBottom) {
+                    this.scrollToEnd();
+                }
+                if (!this.renderPass() && !this.stickToBottom) break;
+            }
+        } finally {
+            this.rendering = false;
+        }
+    }
+
+    renderPass() {
+        // 渲染可见区域内的行，返回行高是否有变化
+        if (this.offsets === null) this.computeOffsets();
+        const count = this.rowCount();
+        if (count === 0) {
+            this.container.style.paddingTop = '0px';
+            this.container.style.paddingBottom = '0px';
+            return false;
+        }
+
+        const { top, height } = this.viewport();
+        const start = this.findRow(top - this.overscan);
+        const end = this.findRow(top + height + this.overscan);
+        const firstVisible = this.findRow(top);
+
+        // 移除范围之外的行，按顺序插入范围之内的行
+        this.rows.forEach((row, rowIndex) => {
+            if (rowIndex < start || rowIndex > end) {
+                row.remove();
+                this.rows.delete(rowIndex);
+            }
+        });
+        let previous = null;
+        for (let rowIndex = start; rowIndex <= end; rowIndex++) {
+            let row = this.rows.get(rowIndex);
+            if (!row) {
+                row = this.createRow(rowIndex);
+                this.rows.set(rowIndex, row);
+            }
+            const expected = previous ? previous.nextSibling : this.container.firstChild;
+            if (row !== expected) {
+                this.container.insertBefore(row, expected);
+            }
+            previous = row;
+        }
+
+        // 记录实际行高；可见区域之上的行高变化时同步调整滚动位置，内容不会跳动
+        let changed = false;
+        let anchorDelta = 0;
+        for (let rowIndex = start; rowIndex <= end; rowIndex++) {
+            const measured = this.rows.get(rowIndex).offsetHeight;
+            const known = this.rowHeights[rowIndex];
+            const previousHeight = known === undefined ? this.estimatedHeight : known;
+            if (known !== measured) {
+                this.rowHeights[rowIndex] = measured;
+                if (measured !== previousHeight) {
+                    changed = true;
+                    if (rowIndex < firstVisible) {
+                        anchorDelta += measured - previousHeight;
+                    }
+                }
+            }
+        }
+        if (changed) this.computeOffsets();
+
+        this.container.style.paddingTop = `${this.offsets[start]}px`;
+        this.container.style.paddingBottom = `${this.totalHeight() - this.offsets[end + 1]}px`;
+        if (anchorDelta !== 0 && !this.stickToBottom) {
+            this.scrollBy(anchorDelta);
+        }
+        return changed;
+    }
+}
@@ -0,0 +1,133 @@
+"""
+会话滚动摘要
+
+每隔 SUMMARY_EVERY_N_TURNS 轮对话，在后台把较早的消息合并进会话的摘要，
+只保留最近 SUMMARY_KEEP_RECENT_MESSAGES 条消息不做摘要。构建提示词时，
+摘要作为一条系统消息放在最近消息之前，已被摘要的消息不再发送，
+因此长对话每轮的提示词大小基本保持不变。
+"""
+
+import threading
+from sqlalchemy import select
+from models import db, Conversation, Message
+from tokenizer import count_tokens
+from config import Config
+import background
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 正在本进程中更新摘要的会话，避免重复提交；检查和登记在锁内完成
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+def maybe_schedule_summary(llm_service, conversation_id, message_count):
+    """
+    在满足条件时提交后台摘要任务
+
+    Args:
+        llm_service: DeepSeekService实例
+        conversation_id (int): 会话ID
+        message_count (int): 保存AI回复后会话的消息总数
+    """
+    turns = message_count // 2
+    if message_count <= Config.SUMMARY_KEEP_RECENT_MESSAGES:
+        return
+    if turns % Config.SUMMARY_EVERY_N_TURNS != 0:
+        return
+    with _in_progress_lock:
+        if conversation_id in _in_progress:
+            return
+        _in_progress.add(conversation_id)
+
+    try:
+        background.submit(_run_summary, llm_service, conversation_id)
+    except Exception:
+        _discard_in_progress(conversation_id)
+        raise
+
+
+def _discard_in_progress(conversation_id):
+    """任务结束或提交失败后取消登记"""
+    with _in_progress_lock:
+        _in_progress.discard(conversation_id)
+
+
+def _run_summary(llm_service, conversation_id):
+    """后台任务入口"""
+    try:
+        update_conversation_summary(llm_service, conversation_id)
+    finally:
+        _discard_in_progress(conversation_id)
+
+
+def update_conversation_summary(llm_service, conversation_id):
+    """
+    将尚未摘要且不在最近窗口内的消息合并进会话摘要
+
+    消息按 SUMMARY_INPUT_TOKEN_BUDGET 分批送入模型，每批完成后立即保存，
+    中途失败时已完成的部分不会丢失。
+
+    Args:
+        llm_service: DeepSeekService实例
+        conversation_id (int): 会话ID
+    """
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        return
+
+    # 最近的若干条消息保持原文，只摘要它们之前的消息
+    fold_upto_id = db.session.execute(
+        select(Message.id)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .offset(Config.SUMMARY_KEEP_RECENT_MESSAGES)
+        .limit(1)
+    ).scalar()
+    if fold_upto_id is None:
+        return
+
+    summary = conversation.summary
+    summarized_id = conversation.summary_message_id or 0
+
+    while summarized_id < fold_upto_id:
+        batch = _next_batch(conversation_id, summarized_id, fold_upto_id)
+        if not batch:
+            break
+
+        summary = llm_service.summarize_conversation(
+            summary,
+            [{"role": row.role, "content": row.content} for row in batch],
+        )
+        summarized_id = batch[-1].id
+
+        conversation.summary = summary
+        conversation.summary_message_id = summarized_id
+        conversation.summary_token_count = count_tokens(summary)
+        db.session.commit()
+
+    logger.info(f"会话 {conversation_id} 摘要已更新至消息 {summarized_id}")
+
+
+def _next_batch(conversation_id, after_id, upto_id):
+    """按token预算读取下一批需要摘要的消息，至少包含一条"""
+    rows = db.session.execute(
+        select(Message.id, Message.role, Message.content, Message.token_count)
+        .where(
+            Message.conversation_id == conversation_id,
+            Message.id > after_id,
+            Message.id <= upto_id,
+        )
+        .order_by(Message.id.asc())
+        .limit(Config.MAX_CONVERSATION_MESSAGES)
+    ).all()
+
+    batch = []
+    tokens = 0
+    for row in rows:
+        if batch and tokens + row.token_count > Config.SUMMARY_INPUT_TOKEN_BUDGET:
+            break
+        batch.append(row)
+        tokens += row.token_count
+    return batch
@@ -86,6 +86,53 @@ def test_send_message(conversation_id):
         return False
 
 
+def test_stream_message(conversation_id):
+    """测试流式发送消息接口"""
+    print("\n🔍 测试流式发送消息接口...")
+
+    if not conversation_id:
+        print("  ❌ 没有有效的会话ID")
+        return False
+
+    try:
+        response = requests.post(
+            f"{BASE_URL}/api/conversations/{conversation_id}/messages/stream",
+            json={"message": "请用一句话介绍Python"},
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+        )
+
+        if response.status_code != 200:
+            print(f"  ❌ 流式发送失败: {response.status_code}")
+            return False
+
+        start_time = time.time()
+        first_chunk_time = None
+        chunks = []
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:") :].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:") :])
+                if event == "delta":
+                    if first_chunk_time is None:
+                        first_chunk_time = time.time() - start_time
+                    chunks.append(data["content"])
+                elif event == "error":
+                    print(f"  ❌ 流式回复出错: {data['message']}")
+                    return False
+
+        print(f"  ✅ 流式回复完成，共 {len(chunks)} 个片段")
+        if first_chunk_time is not None:
+            print(f"  ⏱️ 首个片段耗时: {first_chunk_time:.2f}s")
+        print(f"  🤖 AI回复: {''.join(chunks)[:100]}...")
+        return True
+    except Exception as e:
+        print(f"  ❌ 流式发送异常: {e}")
+        return False
+
+
 def test_get_conversations():
     """测试获取会话列表接口"""
     print("\n🔍 测试获取会话列表接口...")
@@ -128,6 +175,7 @@ def main():
     # 测试发送消息
     if conversation_id:
         test_send_message(conversation_id)
+        test_stream_message(conversation_id)
 
     # 测试获取会话列表
     test_get_conversations()
@@ -0,0 +1,168 @@
+"""
+大模型多端点路由测试
+"""
+
+import threading
+import time
+import pytest
+from llm_router import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    Endpoint,
+    LLMRouter,
+    NoAvailableEndpoint,
+)
+from llm_scheduler import LLMScheduler, PRIORITY_CHAT
+
+
+class FakeClient:
+    """代替 ChatOpenAI 的假客户端，按设定的延迟产出分块或抛出异常"""
+
+    def __init__(self, chunks=(), delay=0, stall=None, error=None):
+        """
+        Args:
+            chunks (tuple): 依次产出的分块
+            delay (float): 产出第一个分块前等待的秒数
+            stall (threading.Event): 设置后才产出分块，模拟卡住的上游
+            error (Exception): 产出分块前抛出的异常
+        """
+        self.model_name = "fake"
+        self.chunks = chunks
+        self.delay = delay
+        self.stall = stall
+        self.error = error
+        self.calls = 0
+
+    def stream(self, messages, config=None):
+        self.calls += 1
+        if self.stall is not None:
+            self.stall.wait(5)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        yield from self.chunks
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def _router(*clients, scheduler=None, **kwargs):
+    endpoints = [
+        Endpoint(f"endpoint-{index}", client, **kwargs)
+        for index, client in enumerate(clients)
+    ]
+    return LLMRouter(
+        endpoints,
+        hedge_min_delay=0.05,
+        hedge_max_delay=0.05,
+        scheduler=scheduler,
+    )
+
+
+def test_hedge_winner_cancels_stalled_loser():
+    """主端点先产出内容时，卡住的对冲请求立即归还名额"""
+    stall = threading.Event()
+    scheduler = LLMScheduler(max_concurrency=4)
+    router = _router(
+        FakeClient(["主", "端点"], delay=0.3),
+        FakeClient(["对冲"], stall=stall),
+        scheduler=scheduler,
+    )
+
+    try:
+        with scheduler.slot(PRIORITY_CHAT):
+            chunks = router.stream([])
+            assert next(chunks) == "主"
+            # 对冲请求仍卡在上游，但已经被取消并归还了名额
+            assert scheduler.stats()["active"] == 1
+            assert list(chunks) == ["端点"]
+    finally:
+        stall.set()
+
+    assert router.hedges == 1
+    assert router.hedge_wins == 0
+    assert scheduler.stats()["active"] == 0
+
+
+def test_hedge_wins_when_primary_stalls():
+    """主端点卡住时对冲请求胜出，只转发对冲端点的输出"""
+    stall = threading.Event()
+    scheduler = LLMScheduler(max_concurrency=4)
+    primary = FakeClient(["主端点"], stall=stall)
+    router = _router(primary, FakeClient(["对冲", "端点"]), scheduler=scheduler)
+
+    try:
+        assert list(router.stream([])) == ["对冲", "端点"]
+    finally:
+        stall.set()
+
+    assert router.hedges == 1
+    assert router.hedge_wins == 1
+    _wait_for(lambda: scheduler.stats()["active"] == 0)
+
+
+def test_hedge_skipped_when_scheduler_full():
+    """调度器没有空闲名额时不发送对冲请求"""
+    scheduler = LLMScheduler(max_concurrency=1)
+    hedge = FakeClient(["对冲"])
+    router = _router(FakeClient(["主端点"], delay=0.2), hedge, scheduler=scheduler)
+
+    with scheduler.slot(PRIORITY_CHAT):
+        assert list(router.stream([])) == ["主端点"]
+
+    assert router.hedges_skipped == 1
+    assert hedge.calls == 0
+
+
+def test_failover_before_first_chunk():
+    """端点在产出内容前出错时改用下一个端点"""
+    router = _router(
+        FakeClient(error=RuntimeError("上游错误")),
+        FakeClient(["备用"]),
+    )
+    router.hedge_enabled = False
+
+    assert list(router.stream([])) == ["备用"]
+    assert router.failovers == 1
+    assert router.endpoints[0].consecutive_failures == 1
+
+
+def test_circuit_opens_and_half_opens():
+    """连续失败达到阈值后熔断，冷却后只放行一次试探请求"""
+    endpoint = Endpoint("flaky", FakeClient(), failure_threshold=2, reset_seconds=0.05)
+
+    endpoint.record_failure()
+    assert endpoint.state == CIRCUIT_CLOSED
+    endpoint.record_failure()
+    assert endpoint.state == CIRCUIT_OPEN
+    assert not endpoint.allow()
+
+    time.sleep(0.06)
+    assert endpoint.allow()
+    assert endpoint.state == CIRCUIT_HALF_OPEN
+    assert not endpoint.allow()
+
+    # 试探失败重新熔断，冷却后再次试探成功即恢复
+    endpoint.record_failure()
+    assert endpoint.state == CIRCUIT_OPEN
+    time.sleep(0.06)
+    assert endpoint.allow()
+    endpoint.record_success(0.1)
+    assert endpoint.state == CIRCUIT_CLOSED
+    assert endpoint.allow()
+
+
+def test_all_endpoints_open():
+    """所有端点都熔断时直接报错，不发送请求"""
+    client = FakeClient(["不会发送"])
+    router = _router(client, failure_threshold=1, reset_seconds=60)
+    router.endpoints[0].record_failure()
+
+    with pytest.raises(NoAvailableEndpoint):
+        list(router.stream([]))
+    assert client.calls == 0
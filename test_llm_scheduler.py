@@ -0,0 +1,67 @@
+"""
+大模型调用调度器测试
+"""
+
+import threading
+import time
+from llm_scheduler import (
+    LLMScheduler,
+    PRIORITY_CHAT,
+    PRIORITY_SUMMARY,
+    PRIORITY_TITLE,
+)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_queued_requests_run_in_priority_order():
+    """名额释放后按优先级放行，聊天回复先于摘要和标题"""
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+
+    def request(name, priority):
+        with scheduler.slot(priority):
+            order.append(name)
+
+    with scheduler.slot(PRIORITY_CHAT):
+        threads = []
+        for name, priority in (
+            ("title", PRIORITY_TITLE),
+            ("summary", PRIORITY_SUMMARY),
+            ("chat", PRIORITY_CHAT),
+        ):
+            thread = threading.Thread(target=request, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            # 依次进入队列，先到的优先级更低
+            _wait_for(lambda: scheduler.stats()["waiting"] == len(threads))
+
+    for thread in threads:
+        thread.join(5)
+    assert order == ["chat", "summary", "title"]
+    assert scheduler.stats()["active"] == 0
+
+
+def test_try_acquire_rejects_when_full():
+    """并发数已满时对冲请求不排队，直接放弃"""
+    scheduler = LLMScheduler(max_concurrency=2)
+    with scheduler.slot(PRIORITY_CHAT):
+        assert scheduler.try_acquire()
+        assert not scheduler.try_acquire()
+        scheduler.release()
+        assert scheduler.try_acquire()
+        scheduler.release()
+    assert scheduler.stats()["active"] == 0
+
+
+def test_try_acquire_respects_rate_limit():
+    """令牌桶没有令牌时对冲请求不发送"""
+    scheduler = LLMScheduler(max_concurrency=4, rate_per_second=0.01, burst=1)
+    with scheduler.slot(PRIORITY_CHAT):
+        assert not scheduler.try_acquire()
+    assert scheduler.stats()["active"] == 0
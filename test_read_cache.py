@@ -0,0 +1,59 @@
+"""
+会话消息窗口缓存测试
+"""
+
+from cache import LRUCache
+from models import db, Message
+from read_cache import ReadCache
+
+
+def _add_message(conversation, content):
+    message = Message(conversation_id=conversation.id, role="user", content=content)
+    db.session.add(message)
+    db.session.commit()
+    return {
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "role": message.role,
+        "content": message.content,
+        "created_at": message.created_at,
+    }
+
+
+def _cache():
+    return ReadCache(local=LRUCache(max_entries=100), window_size=10)
+
+
+def test_append_to_window_loaded_before_commit(app, conversation):
+    """窗口在消息提交前加载：追加后版本与会话一致，继续命中"""
+    cache = _cache()
+    _add_message(conversation, "第一条")
+    db.session.refresh(conversation)
+    assert [m["content"] for m in cache.conversation_messages(conversation)] == [
+        "第一条"
+    ]
+
+    message = _add_message(conversation, "第二条")
+    cache.append_messages(conversation.id, [message])
+
+    db.session.refresh(conversation)
+    window = cache.get_window(conversation, "detail")
+    assert window is not None
+    assert [entry["content"] for entry in window["messages"]] == ["第一条", "第二条"]
+
+
+def test_append_to_window_loaded_after_commit(app, conversation):
+    """窗口在消息提交后加载，已经包含该消息：追加不改变版本，继续命中"""
+    cache = _cache()
+    _add_message(conversation, "第一条")
+    message = _add_message(conversation, "第二条")
+    db.session.refresh(conversation)
+    cache.conversation_messages(conversation)
+
+    cache.append_messages(conversation.id, [message])
+
+    db.session.refresh(conversation)
+    window = cache.get_window(conversation, "detail")
+    assert window is not None
+    assert window["version"][0] == conversation.message_count == 2
+    assert [entry["content"] for entry in window["messages"]] == ["第一条", "第二条"]
@@ -0,0 +1,58 @@
+"""
+消息延迟写入测试
+"""
+
+from models import db, Conversation, Message
+from write_behind import MessageWriter, PendingMessage
+import write_behind
+
+
+def test_batch_failure_isolates_bad_rows(app, conversation):
+    """批量写入失败后逐条写入，只有出错的消息失败"""
+    writer = MessageWriter(max_retries=0)
+    good = PendingMessage(conversation.id, "assistant", "正常的回复")
+    # 所属会话不存在
+    orphan = PendingMessage(conversation.id + 1000, "assistant", "会话已删除")
+    # 违反非空约束
+    invalid = PendingMessage(conversation.id, "assistant", None)
+    later = PendingMessage(conversation.id, "assistant", "之后的回复")
+    batch = [good, orphan, invalid, later]
+
+    writer._write(batch)
+
+    assert all(message.wait(0) for message in batch)
+    assert good.id is not None and good.error is None
+    assert later.id is not None and later.error is None
+    assert orphan.id is None and orphan.error is not None
+    assert invalid.id is None and invalid.error is not None
+
+    contents = [
+        message.content
+        for message in Message.query.filter_by(conversation_id=conversation.id)
+        .order_by(Message.id)
+        .all()
+    ]
+    assert contents == ["正常的回复", "之后的回复"]
+    db.session.expire_all()
+    assert db.session.get(Conversation, conversation.id).message_count == 2
+
+
+def test_unexpected_error_keeps_writer_running(app, conversation, monkeypatch):
+    """一批消息出现意外错误后，等待的请求得到通知，后台线程继续写入"""
+    writer = MessageWriter(flush_interval=0)
+
+    def broken(conversation_id, messages):
+        raise RuntimeError("缓存不可用")
+
+    monkeypatch.setattr(write_behind.read_cache, "append_messages", broken)
+    first = writer.enqueue(conversation.id, "第一条")
+    assert first.wait(5)
+    # 已提交的消息保留ID，不记为失败
+    assert first.id is not None and first.error is None
+    assert writer.pending_messages(conversation.id) == []
+
+    monkeypatch.undo()
+    second = writer.enqueue(conversation.id, "第二条")
+    assert second.wait(5)
+    assert second.id is not None and second.error is None
+    assert writer.pending_count() == 0
@@ -0,0 +1,126 @@
+"""
+后台标题生成
+
+会话收到第一条消息时先使用由消息截断得到的占位标题，并把真正的标题生成
+放入队列。后台线程把短时间内到达的多个请求合并成一次模型调用，生成后写回
+Conversation.title，不占用聊天请求的响应时间。
+"""
+
+import queue
+import threading
+import time
+from flask import current_app
+from models import db, Conversation
+from llm_service import get_llm_service
+from metrics import TITLE_GENERATION_SECONDS
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 标题的最大长度，超出部分以省略号代替
+TITLE_MAX_LENGTH = 20
+
+# 生成失败时 generate_title 返回的默认标题
+DEFAULT_TITLE = "新对话"
+
+
+def truncate_title(title):
+    """限制标题长度"""
+    title = title.strip()
+    if len(title) > TITLE_MAX_LENGTH:
+        title = title[:TITLE_MAX_LENGTH] + "..."
+    return title
+
+
+def placeholder_title(first_message):
+    """由第一条消息生成占位标题"""
+    return truncate_title(" ".join(first_message.split())) or DEFAULT_TITLE
+
+
+class TitleWorker:
+    """批量生成会话标题的后台线程"""
+
+    def __init__(self, batch_size=None, batch_wait=None):
+        """
+        初始化标题生成线程，大模型服务在后台线程中按需获取
+
+        Args:
+            batch_size (int): 单次模型调用最多生成的标题数
+            batch_wait (float): 收到第一个请求后等待更多请求的秒数
+        """
+        self.batch_size = batch_size or Config.TITLE_BATCH_SIZE
+        self.batch_wait = (
+            batch_wait if batch_wait is not None else Config.TITLE_BATCH_WAIT_SECONDS
+        )
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+
+    def enqueue(self, conversation_id, first_message, placeholder):
+        """
+        提交标题生成请求，需要在应用上下文中调用
+
+        Args:
+            conversation_id (int): 会话ID
+            first_message (str): 会话的第一条用户消息
+            placeholder (str): 当前的占位标题，标题未被修改时才会被替换
+        """
+        self._ensure_started()
+        self._queue.put((conversation_id, first_message, placeholder))
+
+    def _ensure_started(self):
+        """延迟启动后台线程，使每个工作进程拥有自己的线程"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._app = current_app._get_current_object()
+                self._thread = threading.Thread(
+                    target=self._run, name="title-worker", daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        """取出下一批请求：阻塞等待第一个，再在等待窗口内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """后台线程主循环"""
+        while True:
+            batch = self._next_batch()
+            with self._app.app_context():
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    logger.error(f"批量生成标题失败: {str(e)}")
+                    db.session.rollback()
+
+    def _process(self, batch):
+        """为一批会话生成标题并写回数据库"""
+        with TITLE_GENERATION_SECONDS.time():
+            titles = get_llm_service().generate_titles([item[1] for item in batch])
+
+        for (conversation_id, _, placeholder), title in zip(batch, titles):
+            if not title or title == DEFAULT_TITLE:
+                continue
+            # 只替换仍为占位标题的会话；显式保留 updated_at，后台生成标题不改变
+            # 会话在列表中的顺序
+            Conversation.query.filter(
+                Conversation.id == conversation_id,
+                Conversation.title == placeholder,
+            ).update(
+                {"title": title, "updated_at": Conversation.updated_at},
+                synchronize_session=False,
+            )
+        db.session.commit()
+        logger.info(f"已生成 {len(batch)} 个会话标题")
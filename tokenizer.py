@@ -0,0 +1,69 @@
+"""
+Token计数工具
+
+优先使用tiktoken的cl100k_base编码计数；tiktoken不可用（未安装或无法下载
+编码文件）时退化为按字符估算。计数只用于控制提示词大小，不要求与DeepSeek
+的分词结果完全一致。
+"""
+
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 估算时CJK字符按每字一个token计算，其余字符按每4个字符一个token计算
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# 每条消息在对话格式中的固定开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_unavailable = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """延迟加载tiktoken编码，加载失败后不再重试"""
+    global _encoding, _encoding_unavailable
+
+    if _encoding is None and not _encoding_unavailable:
+        # 并发请求只加载一次编码
+        with _encoding_lock:
+            if _encoding is None and not _encoding_unavailable:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"tiktoken不可用，使用字符数估算token: {e}")
+                    _encoding_unavailable = True
+    return _encoding
+
+
+def estimate_tokens(text):
+    """按字符类型粗略估算token数"""
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    other_chars = len(text) - cjk_chars
+    return cjk_chars + (other_chars + 3) // 4
+
+
+def count_tokens(text):
+    """
+    计算一段文本作为一条对话消息的token数
+
+    Args:
+        text (str): 消息内容
+
+    Returns:
+        int: token数（包含消息格式开销）
+    """
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = len(encoding.encode(text, disallowed_special=()))
+    else:
+        tokens = estimate_tokens(text)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
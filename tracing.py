@@ -0,0 +1,328 @@
+"""
+大模型调用跟踪
+
+对大模型的每次调用记录一条跟踪数据，异步批量上报到Opik，不占用聊天请求的时间：
+- 请求路径上只做采样判断和一次非阻塞入队，消息的序列化和上报都在后台线程中进行；
+- 队列有长度上限，队列满时直接丢弃新的跟踪数据并计数，而不是阻塞或无限占用内存；
+- 后台线程把短时间内的多条跟踪数据合并成一批上报；
+- 按路由配置头部采样率（例如标题生成只跟踪10%），出错的调用总是会被跟踪；
+- 统计请求路径上的耗时和后台上报的耗时，便于确认跟踪本身的开销，
+  与入队、丢弃、未采样和上报的条数一起见 /metrics 中的 llm_tracing_*。
+"""
+
+import atexit
+import datetime
+import queue
+import random
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from config import Config
+from metrics import (
+    TRACING_EXPORT_SECONDS,
+    TRACING_EXPORTED_SPANS,
+    TRACING_QUEUED_SPANS,
+    TRACING_RECORD_SECONDS,
+    TRACING_SPANS,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_sample_rates(value):
+    """解析 "chat=1.0,title=0.1" 形式的采样率配置"""
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        route, rate = item.split("=", 1)
+        try:
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            logger.warning(f"忽略无效的采样率配置: {item}")
+    return rates
+
+
+class Span:
+    """一次大模型调用的跟踪数据"""
+
+    def __init__(self, route, sampled, messages=None, metadata=None):
+        self.route = route
+        self.sampled = sampled
+        self.messages = messages
+        self.metadata = metadata or {}
+        self.output = None
+        self.error = None
+        self.error_traceback = None
+        self.start_time = datetime.datetime.now(datetime.timezone.utc)
+        self.end_time = None
+
+
+class OpikExporter:
+    """把跟踪数据上报到Opik"""
+
+    def __init__(self, project_name=None, workspace=None, api_key=None, tags=None):
+        self.project_name = project_name
+        self.workspace = workspace
+        self.api_key = api_key
+        self.tags = tags or []
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import opik
+
+            self._client = opik.Opik(
+                project_name=self.project_name,
+                workspace=self.workspace,
+                api_key=self.api_key,
+            )
+        return self._client
+
+    @staticmethod
+    def _serialize_messages(messages):
+        return [
+            {"role": message.type, "content": message.content}
+            for message in messages or []
+        ]
+
+    def export(self, spans):
+        """上报一批跟踪数据，等待发送完成"""
+        client = self._get_client()
+        for span in spans:
+            error_info = None
+            if span.error is not None:
+                error_info = {
+                    "exception_type": type(span.error).__name__,
+                    "message": str(span.error),
+                    "traceback": span.error_traceback or "",
+                }
+            data = {
+                "start_time": span.start_time,
+                "end_time": span.end_time,
+                "input": {"messages": self._serialize_messages(span.messages)},
+                "output": {"content": span.output},
+                "metadata": span.metadata,
+                "error_info": error_info,
+            }
+            trace = client.trace(name=span.route, tags=self.tags + [span.route], **data)
+            trace.span(
+                name=span.metadata.get("model") or span.route,
+                type="llm",
+                model=span.metadata.get("model"),
+                **data,
+            )
+        client.flush()
+
+
+class Tracer:
+    """带采样、有界队列和后台批量上报的跟踪器"""
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rates=None,
+        queue_size=1000,
+        batch_size=50,
+        flush_interval=1.0,
+    ):
+        """
+        初始化跟踪器
+
+        Args:
+            exporter: 上报器，需要实现 export(spans)；为None时不跟踪
+            sample_rates (dict): 路由 -> 采样率，未配置的路由全部跟踪
+            queue_size (int): 待上报队列的长度上限
+            batch_size (int): 单次上报的最大条数
+            flush_interval (float): 收到第一条数据后等待凑批的秒数
+        """
+        self.exporter = exporter
+        self.sample_rates = sample_rates or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # 统计由请求线程和上报线程同时更新，在 _stats_lock 内累加
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.exported = 0
+        self.export_errors = 0
+        self.record_seconds = 0.0  # 请求路径上的累计耗时
+        self.export_seconds = 0.0  # 后台上报的累计耗时
+        self.export_batches = 0
+
+        if exporter is not None:
+            atexit.register(self.flush)
+            TRACING_QUEUED_SPANS.set_function(self._queue.qsize)
+
+    @classmethod
+    def from_config(cls, tags=None):
+        """根据配置创建跟踪器，未配置Opik时返回不上报的跟踪器"""
+        if not Config.OPIK_API_KEY:
+            logger.info("Opik配置不完整，跳过跟踪器初始化")
+            logger.info(
+                f"OPIK_WORKSPACE: {'已设置' if Config.OPIK_WORKSPACE else '未设置'}"
+            )
+            return cls(None)
+
+        exporter = OpikExporter(
+            project_name=Config.OPIK_PROJECT_NAME,
+            workspace=Config.OPIK_WORKSPACE,
+            api_key=Config.OPIK_API_KEY,
+            tags=tags,
+        )
+        logger.info("Opik跟踪器初始化成功")
+        return cls(
+            exporter,
+            sample_rates=parse_sample_rates(Config.TRACING_SAMPLE_RATES),
+            queue_size=Config.TRACING_QUEUE_SIZE,
+            batch_size=Config.TRACING_BATCH_SIZE,
+            flush_interval=Config.TRACING_FLUSH_INTERVAL_SECONDS,
+        )
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    @contextmanager
+    def trace(self, route, messages=None, **metadata):
+        """
+        跟踪一次大模型调用
+
+        调用方在 with 块中设置 span.output；块内抛出的异常会被记录后继续抛出，
+        流式输出被调用方中途关闭（GeneratorExit）时记为已取消而不是出错。
+
+        Args:
+            route (str): 路由名称，用于采样和分类
+            messages (list): 发送给模型的消息，只保存引用，在后台线程中序列化
+            **metadata: 附加的元数据
+
+        Yields:
+            Span: 本次调用的跟踪数据
+        """
+        sampled = self.enabled and random.random() < self.sample_rates.get(route, 1.0)
+        span = Span(route, sampled, messages, metadata)
+        try:
+            yield span
+        except GeneratorExit:
+            span.metadata["cancelled"] = True
+            raise
+        except Exception as e:
+            span.error = e
+            span.error_traceback = traceback.format_exc()
+            raise
+        finally:
+            self._record(span)
+
+    def _record(self, span):
+        """请求路径上的唯一开销：采样判断和非阻塞入队"""
+        if not self.enabled:
+            return
+
+        started = time.perf_counter()
+        result = "enqueued"
+        if not span.sampled and span.error is None:
+            result = "sampled_out"
+        else:
+            span.end_time = datetime.datetime.now(datetime.timezone.utc)
+            self._ensure_started()
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                result = "dropped"
+        elapsed = time.perf_counter() - started
+
+        with self._stats_lock:
+            setattr(self, result, getattr(self, result) + 1)
+            self.record_seconds += elapsed
+        TRACING_SPANS.inc(route=span.route, result=result)
+        TRACING_RECORD_SECONDS.observe(elapsed)
+
+    def _ensure_started(self):
+        """延迟启动后台上报线程，使每个工作进程拥有自己的线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="trace-exporter", daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self, block=True):
+        """取出下一批跟踪数据：等待第一条，再在等待窗口内尽量凑满一批"""
+        try:
+            batch = [self._queue.get(block=block)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        started = time.perf_counter()
+        result = "exported"
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            result = "export_errors"
+            logger.warning(f"上报 {len(batch)} 条跟踪数据失败: {str(e)}")
+        elapsed = time.perf_counter() - started
+
+        with self._stats_lock:
+            setattr(self, result, getattr(self, result) + len(batch))
+            self.export_seconds += elapsed
+            self.export_batches += 1
+        TRACING_EXPORTED_SPANS.inc(
+            len(batch), result="success" if result == "exported" else "error"
+        )
+        TRACING_EXPORT_SECONDS.observe(elapsed)
+
+    def _run(self):
+        """后台线程主循环"""
+        while True:
+            self._export(self._next_batch())
+
+    def flush(self):
+        """上报队列中剩余的跟踪数据，进程退出时调用"""
+        while True:
+            batch = self._next_batch(block=False)
+            if not batch:
+                return
+            self._export(batch)
+
+    def stats(self):
+        """返回跟踪器的运行统计"""
+        with self._stats_lock:
+            recorded = self.enqueued + self.dropped + self.sampled_out
+            return {
+                "enabled": self.enabled,
+                "queued": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "exported": self.exported,
+                "export_errors": self.export_errors,
+                "record_overhead_ms": (
+                    self.record_seconds / recorded * 1000 if recorded else 0.0
+                ),
+                "export_batch_ms": (
+                    self.export_seconds / self.export_batches * 1000
+                    if self.export_batches
+                    else 0.0
+                ),
+            }
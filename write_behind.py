@@ -0,0 +1,321 @@
+"""
+消息延迟写入（write-behind）
+
+用户消息在请求中立即提交；AI回复和会话统计（消息数、最后一条消息、更新时间）
+的写入放入队列，由后台线程把短时间内多个请求的回复合并为一个事务：
+一条多行INSERT写入消息，再按会话各执行一次UPDATE，只提交一次。
+请求在等待大模型回复和等待写入期间都不持有数据库连接。
+批量写入失败时（例如生成回复期间会话被删除）改为逐条写入，只有出错的消息失败，
+同一批中其他请求的回复照常写入。
+
+尚未提交的消息保存在本进程内，读取会话和消息时合并返回，用户不会看到回复消失。
+批量写入不经过ORM事件，会话统计由 increment_conversation_stats 增量更新。
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+from models import db, Conversation, Message, increment_conversation_stats
+from read_cache import read_cache
+from metrics import (
+    DB_COMMIT_SECONDS,
+    WRITE_BEHIND_BATCH_MESSAGES,
+    WRITE_BEHIND_FAILURES,
+    WRITE_BEHIND_PENDING,
+)
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMessage:
+    """已进入写入队列的消息，写入完成后 id 被设置"""
+
+    def __init__(self, conversation_id, role, content):
+        self.conversation_id = conversation_id
+        self.role = role
+        self.content = content
+        self.created_at = datetime.utcnow()
+        self.id = None
+        self.error = None
+        self._written = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        等待消息写入完成
+
+        Returns:
+            bool: 是否已写入（或已确定写入失败）
+        """
+        return self._written.wait(timeout)
+
+    def to_dict(self):
+        """转换为与 Message.to_dict() 相同的格式，尚未写入时附带 pending 标记"""
+        data = {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
+            "role": self.role,
+            "content": self.content,
+            "created_at": self.created_at.isoformat(),
+        }
+        if self.id is None:
+            data["pending"] = True
+        return data
+
+
+class MessageWriter:
+    """合并多个请求的消息写入的后台线程"""
+
+    def __init__(self, batch_size=None, flush_interval=None, max_retries=None):
+        """
+        初始化消息写入线程
+
+        Args:
+            batch_size (int): 单次提交最多写入的消息数
+            flush_interval (float): 收到第一条消息后等待凑批的秒数
+            max_retries (int): 提交失败时的重试次数
+        """
+        self.batch_size = batch_size or Config.WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval = (
+            flush_interval
+            if flush_interval is not None
+            else Config.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS
+        )
+        self.max_retries = (
+            max_retries if max_retries is not None else Config.WRITE_BEHIND_MAX_RETRIES
+        )
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # 保证后台线程和退出时的 flush 不会同时写入
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._pending = {}  # 会话ID -> 尚未写入的消息列表
+
+        WRITE_BEHIND_PENDING.set_function(self.pending_count)
+        atexit.register(self.flush)
+
+    def enqueue(self, conversation_id, content, role="assistant"):
+        """
+        提交一条消息，需要在应用上下文中调用
+
+        Returns:
+            PendingMessage: 可以等待写入完成并取得ID
+        """
+        message = PendingMessage(conversation_id, role, content)
+        with self._lock:
+            self._pending.setdefault(conversation_id, []).append(message)
+        self._ensure_started()
+        self._queue.put(message)
+        return message
+
+    def pending_messages(self, conversation_id):
+        """
+        返回会话中尚未写入的消息，按提交顺序排列
+
+        已取得ID的消息已经提交，之后的查询能够读到，不再返回。
+        """
+        with self._lock:
+            return [
+                message
+                for message in self._pending.get(conversation_id, ())
+                if message.id is None
+            ]
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(messages) for messages in self._pending.values())
+
+    def _ensure_started(self):
+        """延迟启动后台线程，使每个工作进程拥有自己的线程"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._app = current_app._get_current_object()
+                self._thread = threading.Thread(
+                    target=self._run, name="message-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self, block=True):
+        """取出下一批消息：等待第一条，再在等待窗口内尽量凑满一批"""
+        try:
+            batch = [self._queue.get(block=block)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _row(message):
+        return {
+            "conversation_id": message.conversation_id,
+            "role": message.role,
+            "content": message.content,
+            "created_at": message.created_at,
+        }
+
+    def _insert(self, batch):
+        """在一个事务中写入一批消息并更新会话统计，返回按顺序排列的消息ID"""
+        rows = [self._row(message) for message in batch]
+        ids = (
+            db.session.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                rows,
+            )
+            .scalars()
+            .all()
+        )
+        increment_conversation_stats(rows)
+        with DB_COMMIT_SECONDS.time(operation="write_behind"):
+            db.session.commit()
+        return ids
+
+    def _insert_each(self, batch):
+        """
+        逐条写入一批消息，批量写入失败后调用
+
+        所属会话已被删除的消息直接失败；其余消息各自在一个SAVEPOINT中写入，
+        违反约束等数据错误只影响该条消息。连接断开等其他错误继续抛出，由调用方重试。
+
+        Returns:
+            tuple: (消息ID列表, 错误列表)，与 batch 一一对应，失败的消息ID为None
+        """
+        existing = set(
+            db.session.execute(
+                select(Conversation.id).where(
+                    Conversation.id.in_({message.conversation_id for message in batch})
+                )
+            ).scalars()
+        )
+        ids = []
+        errors = []
+        written = []
+        for message in batch:
+            if message.conversation_id not in existing:
+                ids.append(None)
+                errors.append(ValueError(f"会话 {message.conversation_id} 已被删除"))
+                continue
+            row = self._row(message)
+            try:
+                with db.session.begin_nested():
+                    message_id = db.session.execute(
+                        insert(Message).values(row).returning(Message.id)
+                    ).scalar_one()
+            except (IntegrityError, DataError) as e:
+                ids.append(None)
+                errors.append(e)
+                continue
+            ids.append(message_id)
+            errors.append(None)
+            written.append(row)
+
+        increment_conversation_stats(written)
+        with DB_COMMIT_SECONDS.time(operation="write_behind"):
+            db.session.commit()
+        return ids, errors
+
+    def _write(self, batch):
+        """
+        写入一批消息并通知等待的请求
+
+        出现意外错误时整批尚未取得ID的消息记为失败，无论如何都会通知等待的请求
+        并移出待写入列表，后台线程继续处理后续的消息。
+        """
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            logger.error(f"写入 {len(batch)} 条消息时出错: {str(e)}")
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+            for message in batch:
+                if message.id is None and message.error is None:
+                    message.error = e
+        finally:
+            for message in batch:
+                message._written.set()
+            with self._lock:
+                for message in batch:
+                    messages = self._pending.get(message.conversation_id)
+                    if messages is None or message not in messages:
+                        continue
+                    messages.remove(message)
+                    if not messages:
+                        del self._pending[message.conversation_id]
+
+    def _write_batch(self, batch):
+        """写入一批消息，失败时逐条写入并重试"""
+        try:
+            ids = self._insert(batch)
+            errors = [None] * len(batch)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"批量写入 {len(batch)} 条消息失败，改为逐条写入: {str(e)}")
+            ids, errors = None, None
+            for attempt in range(self.max_retries + 1):
+                try:
+                    ids, errors = self._insert_each(batch)
+                    break
+                except Exception as e:
+                    db.session.rollback()
+                    errors = [e] * len(batch)
+                    logger.warning(
+                        f"逐条写入 {len(batch)} 条消息失败（第 {attempt + 1} 次）: {str(e)}"
+                    )
+                    if attempt < self.max_retries:
+                        time.sleep(0.1 * 2**attempt)
+            if ids is None:
+                ids = [None] * len(batch)
+
+        failed = [error for error in errors if error is not None]
+        if failed:
+            WRITE_BEHIND_FAILURES.inc(len(failed))
+            logger.error(f"放弃写入 {len(failed)} 条消息: {str(failed[0])}")
+        if len(failed) < len(batch):
+            WRITE_BEHIND_BATCH_MESSAGES.observe(len(batch) - len(failed))
+
+        # 先设置ID，再由 _write 移出待写入列表，读取方不会在两者之间漏掉消息
+        written = {}
+        for message, message_id, error in zip(batch, ids, errors):
+            if error is not None:
+                message.error = error
+                continue
+            message.id = message_id
+            written.setdefault(message.conversation_id, []).append(message.to_dict())
+        # 在通知等待的请求之前追加到会话的消息窗口缓存，下一轮对话可以直接命中
+        for conversation_id, messages in written.items():
+            read_cache.append_messages(conversation_id, messages)
+
+    def _run(self):
+        """后台线程主循环"""
+        while True:
+            batch = self._next_batch()
+            with self._write_lock, self._app.app_context():
+                self._write(batch)
+
+    def flush(self):
+        """写入队列中剩余的消息，进程退出时调用"""
+        if self._app is None:
+            return
+        with self._write_lock, self._app.app_context():
+            while True:
+                batch = self._next_batch(block=False)
+                if not batch:
+                    return
+                self._write(batch)